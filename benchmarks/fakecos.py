@@ -0,0 +1,583 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+本地模拟的 COS v4 服务, 用于不访问真实 bucket 的端到端测试和基准
+
+以 HTTP 代理的方式运行, coscli 和 SDK 不需要任何修改, 设置环境变量
+HTTP_PROXY 指向它后, 发往 *.file.myqcloud.com 的文件接口请求和发往
+{bucket}-{appid}.cos{region}.myqcloud.com 的下载请求都由它处理. 数据保存在
+内存中, 不校验签名. 支持 coscli.cos.COS 用到的接口:
+
+    list, stat, upload, upload_slice_init/data/finish, delete, move, copy,
+    下载(支持 Range)
+
+可以模拟每个请求的延迟, 每个请求的传输带宽, 随机的 503 错误和下载时
+连接中断. 单独运行:
+
+    python benchmarks/fakecos.py --port 8080 --latency 0.01
+    HTTP_PROXY=http://127.0.0.1:8080 coscli ls cosn://bucket/
+
+也可以在测试中使用:
+
+    with FakeCOSServer(latency=0.01) as server:
+        env["HTTP_PROXY"] = server.proxy_url
+"""
+
+import cgi
+import sys
+import json
+import time
+import uuid
+import bisect
+import random
+import socket
+import urllib
+import hashlib
+import argparse
+import urlparse
+import threading
+import SocketServer
+import BaseHTTPServer
+from cStringIO import StringIO
+
+
+# COS v4 错误码
+ERR_NOT_EXISTS = -197
+ERR_EXISTS = -4018
+ERR_SHA_MISMATCH = -5
+ERR_PARAMS = -1
+
+
+class CodeError(Exception):
+
+    def __init__(self, code, message, status=400):
+        super(CodeError, self).__init__(message)
+        self.code = code
+        self.status = status
+
+
+class Store(object):
+    """
+    内存中的 bucket 数据, key 为 (bucket, path), path 以 / 开头
+
+    keys 保持有序, 列出目录时用二分查找定位, 跳过子目录中的文件
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._objects = {}
+        self._keys = []
+        self._sessions = {}
+
+    def put(self, bucket, path, data, sha=None):
+        if sha is None:
+            sha = hashlib.sha1(data).hexdigest()
+
+        key = (bucket, path)
+        with self._lock:
+            if key not in self._objects:
+                bisect.insort(self._keys, key)
+            self._objects[key] = (data, int(time.time()), sha)
+
+    def get(self, bucket, path):
+        with self._lock:
+            obj = self._objects.get((bucket, path))
+        if obj is None:
+            raise CodeError(ERR_NOT_EXISTS, "ERROR_CMD_COS_INDEX_NOT_EXIST",
+                            404)
+        return obj
+
+    def exists(self, bucket, path):
+        with self._lock:
+            return (bucket, path) in self._objects
+
+    def delete(self, bucket, path):
+        key = (bucket, path)
+        with self._lock:
+            if self._objects.pop(key, None) is None:
+                raise CodeError(ERR_NOT_EXISTS,
+                                "ERROR_CMD_COS_INDEX_NOT_EXIST", 404)
+            del self._keys[bisect.bisect_left(self._keys, key)]
+
+    def count(self):
+        with self._lock:
+            return len(self._objects)
+
+    def list(self, bucket, path, num, context):
+        """
+        列出 path 下的文件和子目录(以 / 结尾), 按名称排序
+
+        :param context: 上一页最后一项的名称, 从其后开始
+        :return: (infos, listover, context)
+        """
+        infos = []
+        with self._lock:
+            keys = self._keys
+            if context:
+                start = self._skip(bucket, path + context)
+            else:
+                start = bisect.bisect_left(keys, (bucket, path))
+
+            while start < len(keys) and len(infos) < num:
+                key_bucket, key_path = keys[start]
+                if key_bucket != bucket or not key_path.startswith(path):
+                    break
+
+                rest = key_path[len(path):]
+                if "/" in rest:
+                    name = rest[:rest.index("/") + 1]
+                    infos.append({"name": name})
+                    start = self._skip(bucket, path + name)
+                    continue
+
+                data, mtime, sha = self._objects[keys[start]]
+                infos.append({
+                    "name": rest,
+                    "filesize": len(data),
+                    "filelen": len(data),
+                    "mtime": mtime,
+                    "ctime": mtime,
+                    "sha": sha,
+                })
+                start += 1
+
+            listover = True
+            if start < len(keys):
+                key_bucket, key_path = keys[start]
+                listover = not (key_bucket == bucket and
+                                key_path.startswith(path))
+
+        context = infos[-1]["name"] if infos and not listover else ""
+        return infos, listover, context
+
+    def _skip(self, bucket, path):
+        # path 之后的第一个 key, path 为目录时跳过目录下所有文件
+        if path.endswith("/"):
+            return bisect.bisect_left(self._keys, (bucket, path[:-1] + "0"))
+        return bisect.bisect_right(self._keys, (bucket, path))
+
+    def slice_init(self, bucket, path, filesize, slice_size):
+        """
+        同一文件未完成的上传返回原 session 和已上传分片的 offset, 可以继续
+
+        :return: (session, offsets)
+        """
+        key = (bucket, path)
+        with self._lock:
+            for session, state in self._sessions.items():
+                if (state["key"] == key and
+                        state["filesize"] == filesize and
+                        state["slice_size"] == slice_size):
+                    return session, sorted(state["parts"])
+
+            session = uuid.uuid4().hex
+            self._sessions[session] = {
+                "key": key,
+                "filesize": filesize,
+                "slice_size": slice_size,
+                "parts": {},
+            }
+        return session, []
+
+    def slice_data(self, session, offset, data):
+        with self._lock:
+            state = self._sessions.get(session)
+            if state is None:
+                raise CodeError(ERR_PARAMS, "session not exists")
+            state["parts"][offset] = data
+
+    def slice_finish(self, session, filesize):
+        with self._lock:
+            state = self._sessions.pop(session, None)
+        if state is None:
+            raise CodeError(ERR_PARAMS, "session not exists")
+
+        data = "".join(
+            part for _, part in sorted(state["parts"].items())
+        )
+        if len(data) != filesize:
+            raise CodeError(ERR_PARAMS, "filesize not match")
+
+        bucket, path = state["key"]
+        self.put(bucket, path, data)
+
+
+class FakeCOS(object):
+    """
+    模拟的 COS 行为: 延迟, 带宽和错误注入
+
+    :param latency: 每个请求增加的延迟, 秒
+    :param bandwidth: 每个请求上传或下载数据的速度, 字节每秒, 0 为不限制
+    :param error_rate: 请求返回 503 的概率
+    :param reset_rate: 下载只返回一半内容后断开连接的概率
+    """
+
+    def __init__(self, latency=0.0, bandwidth=0, error_rate=0.0,
+                 reset_rate=0.0):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.reset_rate = reset_rate
+        self.store = Store()
+
+        self._lock = threading.Lock()
+        self.requests = {}
+
+    def record(self, op):
+        with self._lock:
+            self.requests[op] = self.requests.get(op, 0) + 1
+
+    def delay(self, nbytes=0):
+        seconds = self.latency
+        if self.bandwidth > 0:
+            seconds += float(nbytes) / self.bandwidth
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def should_fail(self):
+        return self.error_rate > 0 and random.random() < self.error_rate
+
+    def should_reset(self):
+        return self.reset_rate > 0 and random.random() < self.reset_rate
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    请求行中是完整的 URL(代理请求), 按 host 区分文件接口和下载
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def cos(self):
+        return self.server.cos
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def _handle(self, method):
+        url = urlparse.urlsplit(self.path)
+        host = url.hostname or self.headers.get("Host", "").split(":")[0]
+        body = self._read_body()
+
+        self.cos.delay(len(body))
+        if self.cos.should_fail():
+            self.cos.record("error")
+            self._send(503, "server busy", "text/plain")
+            return
+
+        try:
+            if host.endswith(".file.myqcloud.com"):
+                self._file_api(method, url, body)
+            else:
+                self._download(host, url)
+        except CodeError as e:
+            self._send_json({"code": e.code, "message": str(e)}, e.status)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length == 0:
+            return ""
+        return self.rfile.read(length)
+
+    def _send(self, status, data, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _reset(self, status, data, content_type, headers=None):
+        """
+        响应头中是完整的长度, 只发送一半内容后断开连接,
+        客户端读取时得到请求异常或不完整的内容
+        """
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data[:len(data) // 2])
+        self.close_connection = 1
+
+    def _send_json(self, resp, status=200):
+        self._send(status, json.dumps(resp), "application/json")
+
+    def _form(self, body):
+        content_type = self.headers.get("Content-Type", "")
+        if content_type.startswith("application/json"):
+            return json.loads(body)
+        if not content_type.startswith("multipart/form-data"):
+            return {}
+
+        form = cgi.FieldStorage(
+            fp=StringIO(body),
+            headers=self.headers,
+            environ={"REQUEST_METHOD": "POST", "CONTENT_TYPE": content_type}
+        )
+        return dict((name, form[name].value) for name in form.keys())
+
+    def _file_api(self, method, url, body):
+        # /files/v2/{appid}/{bucket}{path}
+        parts = urllib.unquote(url.path).split("/", 5)
+        if len(parts) < 5 or parts[1:3] != ["files", "v2"]:
+            raise CodeError(ERR_PARAMS, "bad path %s" % url.path)
+        bucket = parts[4]
+        path = "/" + (parts[5] if len(parts) > 5 else "")
+
+        params = dict(urlparse.parse_qsl(url.query, keep_blank_values=True))
+        if method == "POST":
+            params.update(self._form(body))
+
+        op = params.get("op")
+        handler = getattr(self, "_op_" + str(op), None)
+        if handler is None:
+            raise CodeError(ERR_PARAMS, "unsupported op %s" % op)
+
+        self.cos.record(op)
+        data = handler(bucket, path, params)
+        self._send_json({"code": 0, "message": "SUCCESS", "data": data})
+
+    def _op_stat(self, bucket, path, params):
+        data, mtime, sha = self.cos.store.get(bucket, path)
+        return {
+            "filesize": len(data),
+            "filelen": len(data),
+            "mtime": mtime,
+            "ctime": mtime,
+            "sha": sha,
+        }
+
+    def _op_list(self, bucket, path, params):
+        infos, listover, context = self.cos.store.list(
+            bucket, path, int(params.get("num") or 199),
+            params.get("context", "")
+        )
+        return {
+            "infos": infos,
+            "listover": listover,
+            "context": context,
+        }
+
+    @staticmethod
+    def _upload_data(bucket, path):
+        return {
+            "access_url": "http://fake/%s%s" % (bucket, path),
+            "resource_path": "/%s%s" % (bucket, path),
+        }
+
+    def _check_overwrite(self, bucket, path, params, name):
+        if params.get(name, "0") != "0":
+            if self.cos.store.exists(bucket, path):
+                raise CodeError(ERR_EXISTS, "ERROR_CMD_COS_FILE_EXIST")
+
+    def _op_upload(self, bucket, path, params):
+        self._check_overwrite(bucket, path, params, "insertOnly")
+        data = params["filecontent"]
+        sha = params.get("sha")
+        if sha and hashlib.sha1(data).hexdigest() != sha:
+            raise CodeError(ERR_SHA_MISMATCH, "ERROR_CMD_COS_SHA_NOT_MATCH")
+
+        self.cos.store.put(bucket, path, data)
+        return self._upload_data(bucket, path)
+
+    def _op_upload_slice_init(self, bucket, path, params):
+        self._check_overwrite(bucket, path, params, "insertOnly")
+        slice_size = int(params["slice_size"])
+        session, offsets = self.cos.store.slice_init(
+            bucket, path, int(params["filesize"]), slice_size
+        )
+        data = {
+            "session": session,
+            "slice_size": slice_size,
+            "serial_upload": 0,
+        }
+        if offsets:
+            data["listparts"] = [
+                {"offset": offset, "datalen": slice_size}
+                for offset in offsets
+            ]
+        return data
+
+    def _op_upload_slice_data(self, bucket, path, params):
+        offset = int(params["offset"])
+        self.cos.store.slice_data(
+            params["session"], offset, params["filecontent"]
+        )
+        return {"session": params["session"], "offset": offset}
+
+    def _op_upload_slice_finish(self, bucket, path, params):
+        self.cos.store.slice_finish(
+            params["session"], int(params["filesize"])
+        )
+        return self._upload_data(bucket, path)
+
+    def _op_delete(self, bucket, path, params):
+        self.cos.store.delete(bucket, path)
+        return {}
+
+    def _op_move(self, bucket, path, params):
+        return self._transfer(bucket, path, params, True)
+
+    def _op_copy(self, bucket, path, params):
+        return self._transfer(bucket, path, params, False)
+
+    def _transfer(self, bucket, path, params, remove):
+        dest = urllib.unquote(params["dest_fileid"])
+        if not dest.startswith("/"):
+            dest = "/" + dest
+        if params.get("to_over_write", "0") == "0":
+            if self.cos.store.exists(bucket, dest):
+                raise CodeError(ERR_EXISTS, "ERROR_CMD_COS_FILE_EXIST")
+
+        data, _, sha = self.cos.store.get(bucket, path)
+        self.cos.store.put(bucket, dest, data, sha)
+        if remove:
+            self.cos.store.delete(bucket, path)
+        return {}
+
+    def _download(self, host, url):
+        # {bucket}-{appid}.cos{region}.myqcloud.com
+        bucket = host.split(".", 1)[0].rsplit("-", 1)[0]
+        path = urllib.unquote(url.path)
+
+        self.cos.record("download")
+        try:
+            data, _, _ = self.cos.store.get(bucket, path)
+        except CodeError:
+            self._send(404, "not found", "text/plain")
+            return
+
+        status, headers = 200, {}
+        size = len(data)
+        value = self.headers.get("Range", "")
+        if value.startswith("bytes="):
+            start, _, end = value[len("bytes="):].partition("-")
+            start = int(start or 0)
+            end = min(int(end), size - 1) if end else size - 1
+            headers["Content-Range"] = "bytes %d-%d/%d" % (start, end, size)
+            data = data[start:end + 1]
+            status = 206
+
+        self.cos.delay(len(data))
+        if self.cos.should_reset():
+            self.cos.record("reset")
+            self._reset(status, data, "application/octet-stream", headers)
+            return
+        self._send(status, data, "application/octet-stream", headers)
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    记录处理中的连接, 停止时关闭客户端保留的 keep-alive 连接, 否则处理线程
+    一直等待下一个请求, 在解释器退出时报错
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, *args):
+        BaseHTTPServer.HTTPServer.__init__(self, *args)
+        self._conns = set()
+        self._cond = threading.Condition()
+
+    def process_request_thread(self, request, client_address):
+        with self._cond:
+            self._conns.add(request)
+        try:
+            SocketServer.ThreadingMixIn.process_request_thread(
+                self, request, client_address
+            )
+        finally:
+            with self._cond:
+                self._conns.discard(request)
+                self._cond.notify_all()
+
+    def close_connections(self, timeout=5):
+        with self._cond:
+            for conn in self._conns:
+                try:
+                    conn.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass
+
+            deadline = time.time() + timeout
+            while self._conns and time.time() < deadline:
+                self._cond.wait(0.1)
+
+
+class FakeCOSServer(object):
+    """
+    在后台线程中运行 FakeCOS, proxy_url 用作 HTTP_PROXY
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, **kwargs):
+        self.cos = FakeCOS(**kwargs)
+        self._server = _Server((host, port), Handler)
+        self._server.cos = self.cos
+        self._thread = None
+
+    @property
+    def proxy_url(self):
+        host, port = self._server.server_address
+        return "http://%s:%d" % (host, port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.close_connections()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="fake COS v4 server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds added to every request")
+    parser.add_argument("--bandwidth", type=float, default=0,
+                        help="bytes per second of each transfer, 0 unlimited")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="probability of a 503 response")
+    parser.add_argument("--reset-rate", type=float, default=0.0,
+                        help="probability of a download cut off halfway")
+    opts = parser.parse_args()
+
+    server = FakeCOSServer(
+        opts.host, opts.port, latency=opts.latency,
+        bandwidth=opts.bandwidth, error_rate=opts.error_rate,
+        reset_rate=opts.reset_rate
+    )
+    print "fake COS listening, use HTTP_PROXY=%s" % server.proxy_url
+    sys.stdout.flush()
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+列出结果中每个 COSObject 占用的内存
+
+按 SDK 列出响应的格式(名称和 sha 为 unicode)生成 --count 个对象,
+统计对象及其引用的字符串, 整数的 sys.getsizeof 之和(共享的只计一次),
+以及进程 RSS 峰值的增长. 用法:
+
+    python benchmarks/memory.py --count 1e6
+
+每个对象超过 --max-bytes 时返回 1, 默认值与 COSObject 文档中的数值一致
+"""
+
+import gc
+import os
+import sys
+import resource
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from coscli.cos import COS  # noqa
+
+
+# 名称 17 个 ASCII 字符时每个对象约 270 字节
+MAX_BYTES = 300
+
+
+def _infos(n):
+    for i in xrange(n):
+        yield {
+            u"name": u"file-%08d.log" % i,
+            u"filesize": 1000000 + i * 37,
+            u"mtime": 1500000000 + i,
+            u"sha": u"%040x" % i,
+        }
+
+
+def _refs(obj):
+    if hasattr(obj, "__dict__"):
+        yield obj.__dict__
+        for value in obj.__dict__.values():
+            yield value
+    for name in getattr(type(obj), "__slots__", ()):
+        yield getattr(obj, name, None)
+
+
+def deep_size(objs):
+    """
+    对象和它直接引用的值的 getsizeof 之和, 同一个值只计一次
+    """
+    seen = set()
+    total = 0
+    for obj in objs:
+        for value in [obj] + list(_refs(obj)):
+            if value is None or isinstance(value, bool) or id(value) in seen:
+                continue
+            seen.add(id(value))
+            total += sys.getsizeof(value)
+    return total
+
+
+def _maxrss():
+    # Linux 上单位为 KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="COSObject memory usage")
+    parser.add_argument("--count", default="1e6",
+                        help="number of listed objects")
+    parser.add_argument("--max-bytes", type=int, default=MAX_BYTES,
+                        help="allowed bytes per object")
+    opts = parser.parse_args()
+
+    count = int(float(opts.count))
+    prefix = u"/data/dir001/"
+
+    gc.collect()
+    rss = _maxrss()
+    objs = [COS._info_obj(prefix, info) for info in _infos(count)]
+    rss = _maxrss() - rss
+
+    per_object = float(deep_size(objs)) / count
+    print "objects:      %d" % count
+    print "bytes/object: %.1f (getsizeof)" % per_object
+    # 包括保存对象的 list 和内存分配器的开销
+    print "rss/object:   %.1f" % (float(rss) / count)
+
+    if per_object > opts.max_bytes:
+        print "more than %d bytes per object" % opts.max_bytes
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
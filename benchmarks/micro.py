@@ -0,0 +1,372 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+纯 Python 热点路径的微基准, 大 bucket 列出和生成任务时每个对象都会执行:
+
+    cosuri_parse      COSUri 解析
+    compose_uri       COSUri.compose_uri
+    format_size       format_size(human_readable=True)
+    format_datetime   format_datetime
+    obj_output        ls 输出一个对象 (_cos_obj_output, 写入 /dev/null)
+    cos_object        列出结果生成 COSObject (COS._info_obj)
+    plan_get          get 生成下载任务 (_get_tasks)
+    list_dir_files    扫描本地目录并排序
+    plan_put          put 扫描本地目录生成上传任务 (_put_tasks)
+
+每项记录每个对象的耗时. 为了减少不同机器和机器负载变化的影响, 与一段
+固定的纯 Python 代码交替计时, 与基线比较时使用两者比值的中位数(--repeat
+次, 每次计时不少于 --min-time 秒). 慢于基线的项重新测量 --confirm 次,
+每次都慢于基线才算变慢. 用法:
+
+    # 与保存的基线比较, 任一项慢于基线超过 tolerance 时返回 1
+    python benchmarks/micro.py --sizes 1e4,1e5
+    # 更新基线
+    python benchmarks/micro.py --sizes 1e4,1e5 --save
+
+--sizes 可以到 1e7, 扫描本地目录的两项实际创建的文件数不超过 --max-files.
+这两项的耗时主要取决于文件系统和页缓存, 校准代码不能消除它们的波动,
+使用单独的更宽的 --files-tolerance.
+基线应在负载稳定的机器上生成, 负载波动大时增加 --repeat 或 --tolerance
+"""
+
+import gc
+import os
+import sys
+import json
+import shutil
+import timeit
+import tempfile
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from coscli import utils  # noqa
+from coscli.cos import COS  # noqa
+from coscli.utils import COSUri, format_size, format_datetime  # noqa
+from coscli.utils import list_dir_files  # noqa
+from coscli.command import _cos_obj_output, _get_tasks, _put_tasks  # noqa
+
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "micro_baseline.json")
+
+BENCHMARKS = []
+
+# 每个本地子目录中的文件数
+FILES_PER_DIR = 1000
+
+
+def bench(name, uses_files=False):
+    """
+    注册一项基准, 被装饰的函数参数为对象数, 返回需要计时的无参数函数
+    """
+    def decorator(func):
+        BENCHMARKS.append((name, func, uses_files))
+        return func
+    return decorator
+
+
+def _paths(n):
+    return ["/data/dir%03d/file-%08d.log" % (i % 1000, i) for i in xrange(n)]
+
+
+def _infos(n):
+    return [
+        {"name": "file-%08d.log" % i, "filesize": i * 37,
+         "mtime": 1500000000 + i, "sha": "%040x" % i}
+        for i in xrange(n)
+    ]
+
+
+@bench("cosuri_parse")
+def _cosuri_parse(n):
+    uris = ["cosn://bucket" + path for path in _paths(n)]
+
+    def run():
+        for uri in uris:
+            COSUri(uri)
+    return run
+
+
+@bench("compose_uri")
+def _compose_uri(n):
+    paths = _paths(n)
+
+    def run():
+        for path in paths:
+            COSUri.compose_uri("bucket", path)
+    return run
+
+
+@bench("format_size")
+def _format_size(n):
+    sizes = [(i * 7919) ** 3 % (1 << 40) for i in xrange(n)]
+
+    def run():
+        for size in sizes:
+            format_size(size, True)
+    return run
+
+
+@bench("format_datetime")
+def _format_datetime(n):
+    mtimes = [1500000000 + i * 61 for i in xrange(n)]
+
+    def run():
+        for mtime in mtimes:
+            format_datetime(mtime)
+    return run
+
+
+@bench("obj_output")
+def _obj_output(n):
+    objs = [COS._info_obj("/data/", info) for info in _infos(n)]
+
+    def run():
+        for obj in objs:
+            _cos_obj_output(obj, "bucket", True)
+        utils._writer.flush()
+    return run
+
+
+@bench("cos_object")
+def _cos_object(n):
+    infos = _infos(n)
+
+    def run():
+        for info in infos:
+            COS._info_obj("/data/", info)
+    return run
+
+
+@bench("plan_get")
+def _plan_get(n):
+    objs = [COS._info_obj("/data/", info) for info in _infos(n)]
+    prefix_len = len("/data")
+
+    def run():
+        for _ in _get_tasks(objs, "/tmp/dst", prefix_len, False):
+            pass
+    return run
+
+
+@bench("list_dir_files", uses_files=True)
+def _list_dir_files(root):
+    def run():
+        for _ in list_dir_files(root):
+            pass
+    return run
+
+
+@bench("plan_put", uses_files=True)
+def _plan_put(root):
+    cos_uri = COSUri("cosn://bucket/dst/")
+
+    def run():
+        for _ in _put_tasks([root], cos_uri, 1):
+            pass
+    return run
+
+
+def make_tree(root, count):
+    for i in xrange(count):
+        subdir = os.path.join(root, "d%04d" % (i // FILES_PER_DIR))
+        if i % FILES_PER_DIR == 0:
+            os.makedirs(subdir)
+        open(os.path.join(subdir, "f%08d" % i), "w").close()
+
+
+CALIBRATE_LOOPS = 50000
+
+
+def calibrate():
+    """
+    一段固定的纯 Python 代码(字符串格式化, dict 读写),
+    score 为每个对象的耗时相当于多少次这样的循环
+    """
+    d = {}
+    for i in xrange(CALIBRATE_LOOPS):
+        key = "key-%d" % (i & 1023)
+        d[key] = d.get(key, 0) + i
+
+
+def autorange(func, min_time):
+    """
+    与 timeit.Timer.autorange 一样, 按 1, 2, 5, 10, 20... 增加执行次数,
+    直到一次计时不少于 min_time 秒
+
+    :return: 执行次数
+    """
+    number = 1
+    while True:
+        for n in (number, number * 2, number * 5):
+            if _timed(func, n) >= min_time:
+                return n
+        number *= 10
+
+
+def _timed(func, number):
+    start = timeit.default_timer()
+    for _ in xrange(number):
+        func()
+    return timeit.default_timer() - start
+
+
+def measure(func, repeat, min_time):
+    """
+    交替计时 func 和校准代码, 每次计时都执行到不少于 min_time 秒, 两者经历
+    相同的机器负载变化. 取 repeat 次中两者比值的中位数, 单次的负载波动
+    不影响结果
+
+    :return: (func 每次的耗时(中位数), func 与校准代码每次循环耗时的比值)
+    """
+    # 与 timeit 一样计时期间关闭 gc, 避免大量对象时 gc 的耗时波动
+    gc.collect()
+    gc.disable()
+    try:
+        number = autorange(func, min_time)
+        calibrate_number = autorange(calibrate, min_time)
+
+        times = []
+        ratios = []
+        for _ in xrange(repeat):
+            unit = _timed(calibrate, calibrate_number) / (
+                calibrate_number * CALIBRATE_LOOPS
+            )
+            elapsed = _timed(func, number) / number
+            times.append(elapsed)
+            ratios.append(elapsed / unit)
+    finally:
+        gc.enable()
+
+    return _median(times), _median(ratios)
+
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def run_benchmark(name, func, uses_files, size, max_files, repeat, min_time):
+    """
+    :return: (name@n, 每个对象的耗时(秒), score)
+    """
+    if uses_files:
+        count = min(size, max_files)
+        root = tempfile.mkdtemp(prefix="coscli-micro-")
+        try:
+            make_tree(root, count)
+            elapsed, ratio = measure(func(root), repeat, min_time)
+        finally:
+            shutil.rmtree(root)
+    else:
+        count = size
+        elapsed, ratio = measure(func(count), repeat, min_time)
+
+    return "%s@%d" % (name, count), elapsed / count, ratio / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="coscli microbenchmarks")
+    parser.add_argument("--sizes", default="1e4,1e5",
+                        help="comma separated object counts, up to 1e7")
+    parser.add_argument("--max-files", type=int, default=20000,
+                        help="max local files created for scan benchmarks")
+    parser.add_argument("--repeat", type=int, default=9,
+                        help="timings per benchmark, the median is used")
+    parser.add_argument("--min-time", type=float, default=0.1,
+                        help="min seconds of each timing")
+    parser.add_argument("--only", default="",
+                        help="comma separated benchmark names")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--tolerance", type=float, default=0.3,
+                        help="allowed slowdown against the baseline")
+    parser.add_argument("--files-tolerance", type=float, default=1.0,
+                        help="allowed slowdown of the local scan benchmarks")
+    parser.add_argument("--confirm", type=int, default=2,
+                        help="reruns of a slower benchmark before failing")
+    parser.add_argument("--save", action="store_true",
+                        help="save results as the new baseline")
+    opts = parser.parse_args()
+
+    sizes = [int(float(v)) for v in opts.sizes.split(",")]
+    only = set(v for v in opts.only.split(",") if v)
+
+    # obj_output 写入 /dev/null
+    devnull = open(os.devnull, "w")
+    utils._writer = utils.OutputWriter(stream=devnull)
+
+    baseline = {}
+    if not opts.save and os.path.exists(opts.baseline):
+        with open(opts.baseline) as f:
+            baseline = json.load(f)
+
+    base_results = baseline.get("results", {})
+
+    print "%-24s %12s %8s %8s %8s" % ("benchmark", "ns/object", "score",
+                                      "baseline", "change")
+    results = {}
+    slower = []
+    for size in sizes:
+        for name, func, uses_files in BENCHMARKS:
+            if only and name not in only:
+                continue
+
+            args = (name, func, uses_files, size, opts.max_files,
+                    opts.repeat, opts.min_time)
+            key, per_item, score = run_benchmark(*args)
+            results[key] = {"ns": round(per_item * 1e9, 1),
+                            "score": round(score, 4)}
+            base = base_results.get(key)
+            if base is None:
+                print "%-24s %12.1f %8.3f %8s %8s" % (
+                    key, per_item * 1e9, score, "-", "-"
+                )
+                continue
+
+            if uses_files:
+                tolerance = opts.files_tolerance
+            else:
+                tolerance = opts.tolerance
+
+            # 慢于基线时重新测量, 每次都慢于基线才算变慢, 避免偶然的负载
+            change = score / base["score"] - 1
+            runs = 1
+            while change > tolerance and runs <= opts.confirm:
+                key, per_item, score = run_benchmark(*args)
+                change = score / base["score"] - 1
+                runs += 1
+
+            if change > tolerance:
+                slower.append(key)
+            print "%-24s %12.1f %8.3f %8.3f %+7.1f%%%s" % (
+                key, per_item * 1e9, score, base["score"], change * 100,
+                " (%d runs)" % runs if runs > 1 else ""
+            )
+
+    if opts.save:
+        with open(opts.baseline, "w") as f:
+            json.dump(
+                {"results": results}, f,
+                indent=2, sort_keys=True, separators=(",", ": ")
+            )
+            f.write("\n")
+        print "baseline saved to %s" % opts.baseline
+        return 0
+
+    if slower:
+        print "slower than baseline by more than %d%% (%d%% for local " \
+            "scans) in %d runs: %s" % (
+                opts.tolerance * 100, opts.files_tolerance * 100,
+                opts.confirm + 1, ", ".join(slower)
+            )
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
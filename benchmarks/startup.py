@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+coscli 启动耗时基准
+
+每次在新进程中执行 coscli, 统计从启动到退出的耗时, 不发送 COS 请求:
+
+    --help              只导入命令行
+    test --help         导入命令行并读取, 检查配置
+
+同时检查这些调用没有导入 qcloud_cos, 用法:
+
+    python benchmarks/startup.py [-n 20] [--max-ms 150]
+
+指定 --max-ms 时任一场景中位数超过该值, 或导入了 SDK 时返回 1
+"""
+
+import os
+import sys
+import time
+import tempfile
+import argparse
+import subprocess
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CONFIG = """[cos]
+app_id = 1000000
+access_key_id = key
+access_key_secret = secret
+region = shanghai
+"""
+
+# 在子进程中执行 cli, 退出前输出是否导入了 SDK
+RUNNER = """
+import sys
+sys.path.insert(0, %r)
+from coscli.main import cli
+try:
+    cli.main(args=sys.argv[1:], prog_name="coscli")
+except SystemExit:
+    pass
+sys.stderr.write("sdk-imported=%%d\\n" %% ("qcloud_cos" in sys.modules))
+""" % ROOT
+
+
+def run_once(args):
+    start = time.time()
+    proc = subprocess.Popen(
+        [sys.executable, "-c", RUNNER] + args,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    _, err = proc.communicate()
+    elapsed = time.time() - start
+
+    return elapsed, "sdk-imported=1" in err
+
+
+def bench(name, args, number):
+    times = []
+    imported = False
+    for _ in range(number):
+        elapsed, sdk = run_once(args)
+        times.append(elapsed)
+        imported = imported or sdk
+
+    times.sort()
+    median = times[len(times) // 2] * 1000
+    print "%-14s min %7.1fms  median %7.1fms  sdk imported: %s" % (
+        name, times[0] * 1000, median, "yes" if imported else "no"
+    )
+    return median, imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description="coscli startup benchmark")
+    parser.add_argument("-n", type=int, default=20, help="runs per case")
+    parser.add_argument("--max-ms", type=float,
+                        help="fail when a median exceeds this")
+    opts = parser.parse_args()
+
+    fd, config = tempfile.mkstemp(suffix=".cfg")
+    with os.fdopen(fd, "w") as f:
+        f.write(CONFIG)
+
+    cases = [
+        ("help", ["--help"]),
+        ("config", ["--config", config, "test", "--help"]),
+    ]
+
+    failed = False
+    try:
+        for name, args in cases:
+            median, imported = bench(name, args, opts.n)
+            if imported:
+                failed = True
+            if opts.max_ms is not None and median > opts.max_ms:
+                failed = True
+    finally:
+        os.remove(config)
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
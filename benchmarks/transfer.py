@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+端到端传输基准, 使用 fakecos.py 模拟的 COS, 不访问真实 bucket
+
+对每组文件数和文件大小, 依次执行:
+
+    put -> ls -r -> du -> get -> copy -r -> mv -r -> del -r
+
+每个命令在新进程中执行(包括启动耗时), 通过 HTTP_PROXY 访问 FakeCOS,
+输出耗时, files/s 和 MB/s, 以及请求数和新建连接数. 用法:
+
+    python benchmarks/transfer.py --counts 100,1000 --sizes 4k,1M --p 16
+    python benchmarks/transfer.py --latency 0.02 --error-rate 0.01
+    python benchmarks/transfer.py --ops put,get --reset-rate 0.05
+
+需要安装 qcloud_cos_v4, 任一命令失败时返回 1
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fakecos import FakeCOSServer  # noqa
+from coscli.ratelimit import parse_rate  # noqa
+
+
+CONFIG = """[cos]
+app_id = 1000000
+access_key_id = key
+access_key_secret = secret
+region = shanghai
+"""
+
+RUNNER = (
+    "import sys; sys.path.insert(0, %r); "
+    "from coscli.main import cli; cli(prog_name='coscli')" % ROOT
+)
+
+BUCKET = "bench"
+OPS = ("put", "ls", "du", "get", "copy", "mv", "del")
+# 每个本地子目录中的文件数
+FILES_PER_DIR = 100
+
+
+def make_tree(root, count, size):
+    """
+    生成 count 个 size 字节的文件, 每个子目录最多 FILES_PER_DIR 个
+    """
+    data = os.urandom(size)
+    for i in xrange(count):
+        subdir = os.path.join(root, "d%04d" % (i // FILES_PER_DIR))
+        if i % FILES_PER_DIR == 0:
+            os.makedirs(subdir)
+        with open(os.path.join(subdir, "f%06d" % i), "wb") as f:
+            f.write(data)
+
+
+def op_args(op, p, src, dst):
+    data = "cosn://%s/data/" % BUCKET
+    return {
+        "put": ["put", "--p", p, src, data],
+        "ls": ["ls", "-r", "--p", p, data],
+        "du": ["du", "--p", p, data],
+        "get": ["get", "--p", p, data, dst + "/"],
+        "copy": ["copy", "-r", "--p", p, data, "cosn://%s/copy/" % BUCKET],
+        "mv": ["mv", "-r", "--p", p, "cosn://%s/copy/" % BUCKET,
+               "cosn://%s/moved/" % BUCKET],
+        "del": ["del", "-r", "--p", p, "cosn://%s/moved/" % BUCKET],
+    }[op]
+
+
+class Bench(object):
+
+    def __init__(self, opts, workdir):
+        self.opts = opts
+        self.workdir = workdir
+        self.config = os.path.join(workdir, "coscli.cfg")
+        with open(self.config, "w") as f:
+            f.write(CONFIG)
+
+        # 校验缓存等写入 HOME 下, 使用临时目录避免影响当前用户
+        self.env = dict(os.environ, HOME=workdir)
+        for name in ("NO_PROXY", "no_proxy"):
+            self.env.pop(name, None)
+
+    def run(self, server, op, args):
+        """
+        :return: (耗时, 报告)
+        """
+        report = os.path.join(self.workdir, "report.json")
+        cmd = [sys.executable, "-c", RUNNER, "--config", self.config,
+               "--report", report] + args
+
+        env = dict(self.env, HTTP_PROXY=server.proxy_url,
+                   http_proxy=server.proxy_url)
+        with open(os.devnull, "w") as devnull:
+            start = time.time()
+            proc = subprocess.Popen(
+                cmd, env=env, stdout=devnull, stderr=subprocess.PIPE
+            )
+            _, err = proc.communicate()
+            elapsed = time.time() - start
+
+        if proc.returncode != 0:
+            raise RuntimeError("%s failed with exit code %d %s" % (
+                op, proc.returncode, err.strip()
+            ))
+
+        # ls/du 不写报告
+        if not os.path.exists(report):
+            return elapsed, None
+        with open(report) as f:
+            data = json.load(f)
+        os.remove(report)
+        return elapsed, data
+
+    def case(self, count, size):
+        src = os.path.join(self.workdir, "src")
+        dst = os.path.join(self.workdir, "dst")
+        for path in (src, dst):
+            if os.path.exists(path):
+                shutil.rmtree(path)
+        make_tree(src, count, size)
+        os.makedirs(dst)
+
+        opts = self.opts
+        server = FakeCOSServer(
+            latency=opts.latency, bandwidth=opts.bandwidth,
+            error_rate=opts.error_rate, reset_rate=opts.reset_rate
+        )
+        failed = False
+        with server:
+            for op in opts.ops:
+                before = sum(server.cos.requests.values())
+                try:
+                    elapsed, report = self.run(
+                        server, op, op_args(op, str(opts.p), src, dst)
+                    )
+                except RuntimeError as e:
+                    print "  %s" % e
+                    failed = True
+                    continue
+
+                requests = sum(server.cos.requests.values()) - before
+                self.output(op, count, size, elapsed, requests, report)
+
+        return failed
+
+    @staticmethod
+    def output(op, count, size, elapsed, requests, report):
+        # copy/mv/del/ls/du 不传输文件内容
+        mbps = "-"
+        if op in ("put", "get"):
+            mbps = "%.2f" % (count * size / elapsed / 1024 / 1024)
+
+        conns = "-"
+        if report is not None:
+            conns = "%d" % report["pool"]["misses"]
+
+        print "%-5s %8d %8d %8.2fs %10.1f %8s %9d %6s" % (
+            op, count, size, elapsed, count / elapsed, mbps, requests, conns
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="coscli transfer benchmark")
+    parser.add_argument("--counts", default="100,1000",
+                        help="comma separated object counts")
+    parser.add_argument("--sizes", default="4k,256k",
+                        help="comma separated object sizes, like 4k, 1M")
+    parser.add_argument("--p", default="16", help="--p of every command")
+    parser.add_argument("--ops", default=",".join(OPS),
+                        help="comma separated ops, in order")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds added to every request")
+    parser.add_argument("--bandwidth", type=parse_rate, default=0,
+                        help="per request transfer rate, like 10M")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="probability of a 503 response")
+    parser.add_argument("--reset-rate", type=float, default=0.0,
+                        help="probability of a download cut off halfway")
+    opts = parser.parse_args()
+
+    opts.ops = opts.ops.split(",")
+    counts = [int(v) for v in opts.counts.split(",")]
+    sizes = [parse_rate(v) for v in opts.sizes.split(",")]
+
+    print "%-5s %8s %8s %9s %10s %8s %9s %6s" % (
+        "op", "files", "size", "time", "files/s", "MB/s", "requests", "conns"
+    )
+
+    workdir = tempfile.mkdtemp(prefix="coscli-bench-")
+    failed = False
+    try:
+        bench = Bench(opts, workdir)
+        for count in counts:
+            for size in sizes:
+                failed = bench.case(count, size) or failed
+    finally:
+        shutil.rmtree(workdir)
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sqlite3
+import threading
+
+from coscli.utils import ensure_dir_exists, sha1_checksum
+
+
+DEFAULT_CHECKSUM_CACHE = "~/.cache/coscli/checksum.db"
+
+
+def _stat_key(st):
+    # Python2 的 os.stat 没有 st_mtime_ns, 由 st_mtime 换算
+    mtime_ns = int(round(st.st_mtime * 1e9))
+    return st.st_dev, st.st_ino, st.st_size, mtime_ns
+
+
+class ChecksumCache(object):
+    """
+    本地文件 sha1 缓存, 以 (device, inode, size, mtime_ns) 为 key,
+    文件没有变化时不需要重新计算
+    """
+
+    _schema = """
+        CREATE TABLE IF NOT EXISTS checksums (
+            dev INTEGER NOT NULL,
+            ino INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            sha1 TEXT NOT NULL,
+            PRIMARY KEY (dev, ino, size, mtime_ns)
+        )
+    """
+
+    _commit_every = 100
+
+    def __init__(self, path=DEFAULT_CHECKSUM_CACHE, rehash=False):
+        """
+        :param rehash: 忽略已有缓存, 重新计算并更新缓存
+        """
+        path = os.path.expanduser(path)
+        dirname = os.path.dirname(path)
+        if dirname:
+            ensure_dir_exists(dirname)
+
+        self.rehash = rehash
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.text_factory = str
+        self._conn.execute(self._schema)
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    def get(self, st):
+        """
+        :param st: 文件的 os.stat 结果
+        :return: 缓存的 sha1, 没有时返回 None
+        """
+        if self.rehash:
+            return None
+
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT sha1 FROM checksums "
+                "WHERE dev = ? AND ino = ? AND size = ? AND mtime_ns = ?",
+                _stat_key(st)
+            ).fetchone()
+
+        return row and row[0]
+
+    def store(self, st, sha1):
+        """
+        记录文件的 sha1, 如传输时已经计算出的 sha1
+
+        :param st: 计算 sha1 前文件的 os.stat 结果
+        """
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO checksums VALUES (?, ?, ?, ?, ?)",
+                _stat_key(st) + (sha1,)
+            )
+            self._pending += 1
+            if self._pending >= self._commit_every:
+                self._conn.commit()
+                self._pending = 0
+
+    def checksum(self, filepath):
+        """
+        文件 sha1, 缓存命中时不需要读取文件
+        """
+        st = os.stat(filepath)
+        sha1 = self.get(st)
+        if sha1 is None:
+            sha1 = sha1_checksum(filepath)
+            self.store(st, sha1)
+
+        return sha1
+
+    def close(self):
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
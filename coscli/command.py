@@ -3,102 +3,219 @@
 
 import os
 import glob
+import time
+import heapq
+import marshal
+import tempfile
+import itertools
 import posixpath
 
-from coscli.cos import COS, COSObject
-from coscli.utils import COSUri, output
-from coscli.utils import format_datetime, format_size, list_dir_files
-from coscli.tools import Uploader, Downloader, Deleter, MoveCopyer
+from coscli.checksum import ChecksumCache, DEFAULT_CHECKSUM_CACHE
+from coscli import metrics
+from coscli.cos import COSObject, COSWalker, COSUsage, borrow_client
+from coscli.manifest import SyncManifest
+from coscli.utils import COSUri, output, output_record, AUTO_PARALLEL
+from coscli.utils import format_datetime, format_size, scan_dir_files
+from coscli.utils import Progress, ThreadWorker
+from coscli.tools import Uploader, Downloader, Deleter, MoveCopyer, PutTask
 
 
 def _cos_obj_output(obj, bucket, human):
     """
     :type obj: COSObject
     """
+    uri = COSUri.compose_uri(bucket, obj.path)
+    fields = [
+        ("type", "dir" if obj.is_dir else "file"),
+        ("size", obj.filesize),
+        ("mtime", obj.mtime),
+        ("sha", obj.sha),
+        ("uri", uri),
+    ]
+
     if obj.is_dir:
-        output("%19s %10s  %s" % (
-            "1970-01-01 00:00:00",
-            "DIR",
-            COSUri.compose_uri(bucket, obj.path)
-        ))
+        text = "%19s %10s  %s" % ("1970-01-01 00:00:00", "DIR", uri)
     else:
         size, coeff = format_size(obj.filesize, human)
-        output("%19s %10s  %s" % (
-            format_datetime(obj.mtime),
-            "%s%s" % (size, coeff),
-            COSUri.compose_uri(bucket, obj.path)
+        text = "%19s %10s  %s" % (
+            format_datetime(obj.mtime), "%s%s" % (size, coeff), uri
+        )
+
+    output_record(fields, text)
+
+
+# --p auto 时并发列出子目录的线程数
+AUTO_WALKERS = 8
+
+def _walk_path(config, cos, bucket, path, p, ordered=False):
+    """
+    递归的列出目录下所有文件, p > 1 时并发列出子目录
+    """
+    if p == AUTO_PARALLEL:
+        p = AUTO_WALKERS
+    if p > 1:
+        return COSWalker(config.cos_config, p, ordered).walk(bucket, path)
+    return cos.walk_path(bucket, path)
+
+
+def _format_latency(seconds):
+    return "%dms" % round(seconds * 1000)
+
+
+def _metrics_summary(recorder):
+    """
+    输出总传输速度和每种 COS 请求的耗时分布
+    """
+    report = recorder.report()
+    if report["bytes"]:
+        size, coeff = format_size(report["bytes"], True)
+        speed, speed_coeff = format_size(report["throughput"], True)
+        output("Transferred %s%sB in %0.1f seconds, %0.2f%sB/s" % (
+            size, coeff, report["elapsed"], speed, speed_coeff
         ))
 
+    pool = report["pool"]
+    if pool["hits"] or pool["misses"]:
+        output("Connections: %d reused, %d new" % (
+            pool["hits"], pool["misses"]
+        ))
 
-def cos_ls(config, uri, recursive, human):
-    cos = COS(config.cos_config)
-    cos_uri = COSUri(uri)
+    for name, stats in sorted(report["ops"].items()):
+        latency = stats["latency"]
+        output("  %s: %d requests, %d failed, p50 %s, p95 %s, p99 %s" % (
+            name, stats["requests"], stats["failed"],
+            _format_latency(latency["p50"]),
+            _format_latency(latency["p95"]),
+            _format_latency(latency["p99"])
+        ))
 
-    if cos.file_exists(cos_uri.bucket, cos_uri.path):
-        cos_objs = [cos.stat_file(cos_uri.bucket, cos_uri.path)]
-    elif cos.dir_exists(cos_uri.bucket, cos_uri.path):
-        if not cos_uri.path.endswith("/"):
-            cos_uri.path += "/"
 
-        if recursive:
-            total = 0
-            for obj in cos.walk_path(cos_uri.bucket, cos_uri.path):
-                total += 1
-                _cos_obj_output(obj, cos_uri.bucket, human)
-            output("Found %s items" % total)
+def _summary(config, action, progress, result):
+    """
+    输出任务执行汇总, 指定了报告文件时写入 JSON 报告, 返回失败任务数.
+    统计只包括当前运行, batch 中每行命令各自汇总
+    """
+    recorder = metrics.current()
+    msg = "Found %d items to %s, %s" % (progress.found, action, result)
+    retries = recorder.total_retries()
+    if retries:
+        msg += ", %d retries" % retries
+    if result.concurrency is not None:
+        msg += ", concurrency %d" % result.concurrency
+    output(msg)
+    _metrics_summary(recorder)
+
+    if config.report is not None:
+        recorder.write_report(
+            config.report,
+            action=action,
+            found=progress.found,
+            succeeded=result.succeeded,
+            failed=result.failed,
+            retries=retries,
+            concurrency=result.concurrency
+        )
+
+    return result.failed
+
+
+# ls --sort 时在内存中排序的最多对象数, 超过时分块排序写入临时文件再归并
+LS_SORT_CHUNK = 100000
+
+
+def _dump_run(objs):
+    f = tempfile.TemporaryFile(prefix="coscli-ls-")
+    for obj in objs:
+        marshal.dump(
+            obj.ls_cmp_key() + (obj.filesize, obj.mtime, obj.sha), f
+        )
+    f.seek(0)
+    return f
+
+
+def _load_run(f):
+    while True:
+        try:
+            yield marshal.load(f)
+        except EOFError:
             return
 
-        cos_objs = list(cos.iter_path(cos_uri.bucket, cos_uri.path))
-    else:
-        output("Path '%s' not exists" % uri)
-        return
 
-    output("Found %s items" % len(cos_objs))
+def _sort_objs(objs, chunk_size=LS_SORT_CHUNK):
+    """
+    按 ls_cmp_key 排序, 对象数超过 chunk_size 时每 chunk_size 个排序后
+    写入临时文件, 最后归并, 内存中最多保存 chunk_size 个对象
+    """
+    runs = []
+    try:
+        chunk = []
+        for obj in objs:
+            chunk.append(obj)
+            if len(chunk) >= chunk_size:
+                chunk.sort(key=lambda x: x.ls_cmp_key())
+                runs.append(_dump_run(chunk))
+                chunk = []
+
+        chunk.sort(key=lambda x: x.ls_cmp_key())
+        if not runs:
+            for obj in chunk:
+                yield obj
+            return
 
-    cos_objs.sort(key=lambda x: x.ls_cmp_key())
-    for obj in cos_objs:
-        _cos_obj_output(obj, cos_uri.bucket, human)
+        if chunk:
+            runs.append(_dump_run(chunk))
+            chunk = []
+        for _, path, filesize, mtime, sha in heapq.merge(
+                *[_load_run(f) for f in runs]):
+            yield COSObject(path, filesize, mtime, sha)
+    finally:
+        for f in runs:
+            f.close()
+
+
+def cos_ls(config, uri, recursive, human, p, sort=False):
+    with borrow_client(config.cos_config) as cos:
+        cos_uri = COSUri(uri)
+
+        if cos.file_exists(cos_uri.bucket, cos_uri.path):
+            objs = [cos.stat_file(cos_uri.bucket, cos_uri.path)]
+        elif cos.dir_exists(cos_uri.bucket, cos_uri.path):
+            if not cos_uri.path.endswith("/"):
+                cos_uri.path += "/"
+
+            if recursive:
+                objs = _walk_path(
+                    config, cos, cos_uri.bucket, cos_uri.path, p, ordered=True
+                )
+            else:
+                objs = cos.iter_path(cos_uri.bucket, cos_uri.path)
+        else:
+            output("Path '%s' not exists" % uri)
+            return
 
+        # 默认按列出顺序边列出边输出, 总数在最后输出.
+        # 排序(目录在前)需要列出完成后才能输出
+        if sort:
+            objs = _sort_objs(objs)
 
-def cos_put(config, srcs, uri, force, checksum, p):
-    cos_uri = COSUri(uri)
+        total = 0
+        for obj in objs:
+            total += 1
+            _cos_obj_output(obj, cos_uri.bucket, human)
+        output("Found %s items" % total)
 
-    globs = []
-    for src in srcs:
-        globs.extend(glob.glob(src))
 
-    total = 0
-    local_files = []
-    for path in globs:
+def _put_tasks(paths, cos_uri, nworker):
+    for path in paths:
         if os.path.isfile(path):
-            files = [path]
+            files = [(path, os.stat(path))]
             is_file = True
         elif os.path.isdir(path):
             is_file = False
-            files = list(list_dir_files(path))
+            files = scan_dir_files(path, nworker)
         else:
             continue
 
-        if len(files) == 0:
-            continue
-
-        total += len(files)
-        local_files.append((path, is_file, files))
-
-    output("Found %s items to put" % total)
-
-    if total == 0:
-        return
-
-    # 多个文件只能 put 到目录下
-    if total > 1 and not cos_uri.path.endswith("/"):
-        output(
-            "multiple files must put to dir, %s need endswith '/'" % uri
-        )
-        return
-
-    tasks = []
-    for src, is_file, files in local_files:
         # 这里上传到 COS 的路径由以下方式决定
         # - src 是文件
         #   1. cos_uri.path 以 / 结束, 则 cos_uri.path/basename(src)
@@ -106,7 +223,7 @@ def cos_put(config, srcs, uri, force, checksum, p):
         # - src 是目录
         #   1. src 以 / 结束, 则相当于将 src 内文件上传至 cos_uri.path
         #   2. 否则将 src 目录上传至 cos_uri.path
-        for file_path in files:
+        for file_path, st in files:
             if is_file:
                 if cos_uri.path.endswith("/"):
                     basename = os.path.basename(file_path)
@@ -114,223 +231,364 @@ def cos_put(config, srcs, uri, force, checksum, p):
                 else:
                     dest = cos_uri.path
             else:
-                name = file_path[len(src):].lstrip(os.path.sep)
-                if not src.endswith(os.path.sep):
-                    dirname = os.path.basename(src)
+                name = file_path[len(path):].lstrip(os.path.sep)
+                if not path.endswith(os.path.sep):
+                    dirname = os.path.basename(path)
                     name = os.path.join(dirname, name)
                 dest = "/".join(
                     os.path.join(cos_uri.path, name).split(os.path.sep)
                 )
 
-            tasks.append((file_path, dest))
+            yield PutTask(file_path, dest, st)
 
-    uploader = Uploader(config, cos_uri.bucket, tasks, force, checksum)
-    if p > 1:
-        uploader.parallel_upload(p)
-    else:
-        uploader.simple_upload()
 
+def _plan_put(srcs, cos_uri, p=1):
+    """
+    根据本地路径生成上传任务 PutTask, 目录边扫描边生成, 无法上传时返回 None
 
-def cos_get(config, uri, dst, force, skip, checksum, p):
-    cos = COS(config.cos_config)
-    cos_uri = COSUri(uri)
+    :param p: 并发扫描目录的线程数
+    """
+    globs = []
+    for src in srcs:
+        globs.extend(glob.glob(src))
 
-    cos_objs = []
-    if cos.file_exists(cos_uri.bucket, cos_uri.path):
-        is_file = True
-        cos_objs.append(cos.stat_file(cos_uri.bucket, cos_uri.path))
-    elif cos.dir_exists(cos_uri.bucket, cos_uri.path):
-        is_file = False
-        if not cos_uri.path.endswith("/"):
-            cos_uri.path += "/"
-        for obj in cos.walk_path(cos_uri.bucket, cos_uri.path):
-            cos_objs.append(obj)
-    else:
-        output("Path '%s' not exists" % uri)
-        return
+    nworker = AUTO_WALKERS if p == AUTO_PARALLEL else p
+    tasks = _put_tasks(globs, cos_uri, nworker)
 
-    total = len(cos_objs)
-    output("Found %d items to download" % total)
+    # 只需要知道是否有多个文件, 不需要等待扫描完成
+    first = list(itertools.islice(tasks, 2))
+    if len(first) == 0:
+        output("Found 0 items to put")
+        return None
 
-    if total == 0:
-        return
+    # 多个文件只能 put 到目录下
+    if len(first) > 1 and not cos_uri.path.endswith("/"):
+        output(
+            "multiple files must put to dir, %s need endswith '/'" %
+            cos_uri.uri()
+        )
+        return None
 
-    tasks = []
-    if not os.path.isdir(dst):
-        if total > 1:
-            raise Exception("dest must a dir when download multiple files.")
-        tasks.append((cos_objs[0], dst))
-    elif os.path.isdir(dst):
-        # 下载到本地的文件路径由以下方式决定
-        # - cos path 是文件, 则 dst/basename(cos path)
-        # - cos path 是文件夹, 则 dst/dir/filename
-
-        prefix_len = len(posixpath.dirname(cos_uri.path.rstrip("/")))
-        for obj in cos_objs:
-            if is_file:
-                local_file = os.path.join(dst, posixpath.basename(obj.path))
-            else:
-                local_file = os.path.join(
-                    dst, obj.path[prefix_len:].lstrip("/")
-                )
-                if os.path.sep != "/":
-                    local_file = os.path.sep.join(local_file.split("/"))
-            tasks.append((obj, local_file))
-    else:
-        raise Exception("WTF? Is it a dir or not? -- %s" % dst)
+    return itertools.chain(first, tasks)
 
-    downloader = Downloader(
-        config, cos_uri.bucket, tasks, force, skip, checksum
-    )
-    if p > 1:
-        downloader.parallel_download(p)
-    else:
-        downloader.simple_download()
 
+def _open_checksum_cache(checksum, rehash):
+    # 不校验 sha1 时也就不需要缓存
+    if not checksum:
+        return None
+    return ChecksumCache(DEFAULT_CHECKSUM_CACHE, rehash)
 
-def cos_del(config, uri, recursive, p):
-    cos = COS(config.cos_config)
-    cos_uri = COSUri(uri)
 
-    cos_files = []
-    if cos.file_exists(cos_uri.bucket, cos_uri.path):
-        cos_files.append(cos_uri.path)
-    elif cos.dir_exists(cos_uri.bucket, cos_uri.path):
-        if not recursive:
-            output("Path '%s' is dir, use --recursive/-r" % uri)
-            return
+def cos_put(config, srcs, uri, force, checksum, p,
+            slice_size, slice_parallel, rehash=False, lazy_verify=False,
+            skip_identical=False):
+    cos_uri = COSUri(uri)
 
-        if not cos_uri.path.endswith("/"):
-            cos_uri.path += "/"
-        for obj in cos.walk_path(cos_uri.bucket, cos_uri.path):
-            cos_files.append(obj.path)
-    else:
-        output("Path '%s' not exists" % uri)
+    tasks = _plan_put(srcs, cos_uri, p)
+    if not tasks:
         return
 
-    total = len(cos_files)
-    output("Found %d items to delete" % total)
+    # 上传到目录时, 预先列出目录检查目标是否存在
+    dest_dir = None
+    if cos_uri.path.endswith("/"):
+        dest_dir = cos_uri.path
+
+    cache = _open_checksum_cache(checksum or skip_identical, rehash)
+    try:
+        uploader = Uploader(
+            config, cos_uri.bucket, tasks, force, checksum,
+            slice_size=slice_size * 1024, slice_parallel=slice_parallel,
+            checksum_cache=cache, lazy_verify=lazy_verify,
+            skip_identical=skip_identical
+        )
+        result = uploader.run(p, dest_dir)
+    finally:
+        if cache is not None:
+            cache.close()
+
+    return _summary(config, "put", uploader.progress, result)
+
+
+def cos_sync(config, srcs, uri, checksum, p, slice_size, slice_parallel,
+             manifest_path, rehash=False, lazy_verify=False):
+    cos_uri = COSUri(uri)
 
-    if total == 0:
+    tasks = _plan_put(srcs, cos_uri, p)
+    if not tasks:
         return
 
-    deleter = Deleter(config, cos_uri.bucket, cos_files)
-    if p > 1:
-        deleter.parallel_delete(p)
-    else:
-        deleter.simple_delete()
+    manifest = SyncManifest(manifest_path)
+    cache = _open_checksum_cache(checksum, rehash)
+    skipped = [0]
+
+    def changed():
+        # manifest 中记录未变化的文件直接跳过, 不需要请求 COS.
+        # 边扫描边检查, 变化的文件立即交给 Uploader
+        for task in tasks:
+            local_file, dest = task
+            if manifest.is_unchanged(
+                    cos_uri.bucket, dest, local_file, task.st):
+                skipped[0] += 1
+            else:
+                yield task
 
+    try:
+        uploader = Uploader(
+            config, cos_uri.bucket, changed(), True, checksum, manifest,
+            slice_size=slice_size * 1024, slice_parallel=slice_parallel,
+            checksum_cache=cache, lazy_verify=lazy_verify
+        )
+        result = uploader.run(p)
+    finally:
+        manifest.close()
+        if cache is not None:
+            cache.close()
 
-def cos_mv_copy(action, config, usrc, udst, force, recursive, p):
-    if action not in ("mv", "copy"):
-        raise Exception("not support '%s' action" % action)
+    output("Skip %d unchanged items" % skipped[0])
+    return _summary(config, "sync", uploader.progress, result)
 
-    cos = COS(config.cos_config)
-    src_uri = COSUri(usrc)
-    dst_uri = COSUri(udst)
 
-    if src_uri.bucket != dst_uri.bucket:
-        output("Cos %s should in same bucket" % action)
-        return
+def _get_tasks(cos_objs, dst, prefix_len, is_file):
+    # 下载到本地的文件路径由以下方式决定
+    # - cos path 是文件, 则 dst/basename(cos path)
+    # - cos path 是文件夹, 则 dst/dir/filename
+    for obj in cos_objs:
+        if is_file:
+            local_file = os.path.join(dst, posixpath.basename(obj.path))
+        else:
+            local_file = os.path.join(dst, obj.path[prefix_len:].lstrip("/"))
+            if os.path.sep != "/":
+                local_file = os.path.sep.join(local_file.split("/"))
+        yield obj, local_file
+
 
-    cos_files = []
-    if cos.file_exists(src_uri.bucket, src_uri.path):
-        is_file = True
-        cos_files.append(src_uri.path)
-    elif cos.dir_exists(src_uri.bucket, src_uri.path):
-        if not recursive:
-            output("Path '%s' is dir, use --recursive/-r" % usrc)
+def cos_get(config, uri, dst, force, skip, checksum, p, parts, part_size,
+            rehash=False, skip_identical=False):
+    with borrow_client(config.cos_config) as cos:
+        cos_uri = COSUri(uri)
+
+        if cos.file_exists(cos_uri.bucket, cos_uri.path):
+            is_file = True
+            cos_objs = [cos.stat_file(cos_uri.bucket, cos_uri.path)]
+        elif cos.dir_exists(cos_uri.bucket, cos_uri.path):
+            is_file = False
+            if not cos_uri.path.endswith("/"):
+                cos_uri.path += "/"
+            cos_objs = _walk_path(config, cos, cos_uri.bucket, cos_uri.path, p)
+        else:
+            output("Path '%s' not exists" % uri)
             return
 
-        if not dst_uri.path.endswith("/"):
-            output("Dest '%s' must dir, need endswith '/'" % udst)
+        # 列出结果直接流式交给 Downloader, 不需要等待列出完成
+        if not os.path.isdir(dst):
+            cos_objs = list(itertools.islice(cos_objs, 2))
+            if len(cos_objs) > 1:
+                raise Exception(
+                    "dest must a dir when download multiple files."
+                )
+            tasks = [(obj, dst) for obj in cos_objs]
+        else:
+            prefix_len = len(posixpath.dirname(cos_uri.path.rstrip("/")))
+            tasks = _get_tasks(cos_objs, dst, prefix_len, is_file)
+
+        cache = _open_checksum_cache(checksum or skip_identical, rehash)
+        try:
+            downloader = Downloader(
+                config, cos_uri.bucket, tasks, force, skip, checksum,
+                parts, part_size * 1024 * 1024, checksum_cache=cache,
+                skip_identical=skip_identical
+            )
+            result = downloader.run(p)
+        finally:
+            if cache is not None:
+                cache.close()
+
+        return _summary(config, "download", downloader.progress, result)
+
+
+def cos_del(config, uri, recursive, p):
+    with borrow_client(config.cos_config) as cos:
+        cos_uri = COSUri(uri)
+
+        if cos.file_exists(cos_uri.bucket, cos_uri.path):
+            cos_files = [cos_uri.path]
+        elif cos.dir_exists(cos_uri.bucket, cos_uri.path):
+            if not recursive:
+                output("Path '%s' is dir, use --recursive/-r" % uri)
+                return
+
+            if not cos_uri.path.endswith("/"):
+                cos_uri.path += "/"
+            objs = _walk_path(config, cos, cos_uri.bucket, cos_uri.path, p)
+            cos_files = (obj.path for obj in objs)
+        else:
+            output("Path '%s' not exists" % uri)
             return
 
-        is_file = False
-        if not src_uri.path.endswith("/"):
-            src_uri.path += "/"
-        for obj in cos.walk_path(src_uri.bucket, src_uri.path):
-            cos_files.append(obj.path)
-    else:
-        output("Path '%s' not exists" % usrc)
-        return
+        deleter = Deleter(config, cos_uri.bucket, cos_files)
+        result = deleter.run(p)
 
-    total = len(cos_files)
-    output("Found %d items to %s" % (total, action))
+        return _summary(config, "delete", deleter.progress, result)
 
-    if total == 0:
-        return
 
-    tasks = []
-    prefix_len = len(posixpath.dirname(src_uri.path.rstrip("/")))
+def _mv_copy_tasks(cos_files, dst_path, prefix_len, is_file):
     for cos_file in cos_files:
         if is_file:
-            if dst_uri.path.endswith("/"):
+            if dst_path.endswith("/"):
                 basename = posixpath.basename(cos_file)
-                dest = posixpath.join(dst_uri.path, basename)
+                dest = posixpath.join(dst_path, basename)
             else:
-                dest = dst_uri.path
+                dest = dst_path
         else:
             name = cos_file[prefix_len:].lstrip(os.path.sep)
-            dest = posixpath.join(dst_uri.path, name)
+            dest = posixpath.join(dst_path, name)
 
-        tasks.append((cos_file, dest))
+        yield cos_file, dest
 
-    mover = MoveCopyer(action, config, src_uri.bucket, tasks, force)
-    if p > 1:
-        mover.parallel_move_copy(p)
-    else:
-        mover.simple_move_copy()
 
+def cos_mv_copy(action, config, usrc, udst, force, recursive, p):
+    if action not in ("mv", "copy"):
+        raise Exception("not support '%s' action" % action)
+
+    with borrow_client(config.cos_config) as cos:
+        src_uri = COSUri(usrc)
+        dst_uri = COSUri(udst)
+
+        if src_uri.bucket != dst_uri.bucket:
+            output("Cos %s should in same bucket" % action)
+            return
+
+        if cos.file_exists(src_uri.bucket, src_uri.path):
+            is_file = True
+            cos_files = [src_uri.path]
+            dest_dir = None
+        elif cos.dir_exists(src_uri.bucket, src_uri.path):
+            if not recursive:
+                output("Path '%s' is dir, use --recursive/-r" % usrc)
+                return
+
+            if not dst_uri.path.endswith("/"):
+                output("Dest '%s' must dir, need endswith '/'" % udst)
+                return
+
+            is_file = False
+            dest_dir = dst_uri.path
+            if not src_uri.path.endswith("/"):
+                src_uri.path += "/"
+            objs = _walk_path(config, cos, src_uri.bucket, src_uri.path, p)
+            cos_files = (obj.path for obj in objs)
+
+            # 目标在源目录下时, 边列出边处理会再次列出新生成的文件, 需要先列出
+            if dst_uri.path.startswith(src_uri.path):
+                cos_files = list(cos_files)
+        else:
+            output("Path '%s' not exists" % usrc)
+            return
+
+        prefix_len = len(posixpath.dirname(src_uri.path.rstrip("/")))
+        tasks = _mv_copy_tasks(cos_files, dst_uri.path, prefix_len, is_file)
+        if isinstance(cos_files, list):
+            tasks = list(tasks)
+
+        mover = MoveCopyer(action, config, src_uri.bucket, tasks, force)
+        result = mover.run(p, dest_dir)
+
+        return _summary(config, action, mover.progress, result)
+
+
+def _du_output(obj, size, count, bucket, human):
+    uri = COSUri.compose_uri(bucket, obj.path)
+    value, coeff = format_size(size, human)
+    output_record(
+        [("size", size), ("count", count), ("uri", uri)],
+        "%10s  %s" % ("%s%s" % (value, coeff), uri)
+    )
 
-def cos_du(config, uri, s, human):
-    cos = COS(config.cos_config)
-    cos_uri = COSUri(uri)
 
-    if cos.file_exists(cos_uri.bucket, cos_uri.path):
-        cos_objs = [cos.stat_file(cos_uri.bucket, cos_uri.path)]
-    elif cos.dir_exists(cos_uri.bucket, cos_uri.path):
+def cos_du(config, uri, s, human, p, max_depth=None):
+    with borrow_client(config.cos_config) as cos:
+        cos_uri = COSUri(uri)
+
+        if cos.file_exists(cos_uri.bucket, cos_uri.path):
+            obj = cos.stat_file(cos_uri.bucket, cos_uri.path)
+            _du_output(obj, obj.filesize, 1, cos_uri.bucket, human)
+            return
+
+        if not cos.dir_exists(cos_uri.bucket, cos_uri.path):
+            output("Path '%s' not exists" % uri)
+            return
+
         if not cos_uri.path.endswith("/"):
             cos_uri.path += "/"
-        if s:
-            cos_objs = cos.iter_path(cos_uri.bucket, cos_uri.path)
-        else:
-            cos_objs = [COSObject(cos_uri.path)]
-    else:
-        output("Path '%s' not exists" % uri)
-        return
 
-    records = []
-    for cos_obj in cos_objs:
-        size = 0
-        if cos_obj.is_dir:
-            for obj in cos.walk_path(cos_uri.bucket, cos_obj.path):
-                size += obj.filesize
-        else:
-            size = cos_obj.filesize
+        # -s 显示目录下每个文件和子目录, 不显示目录本身
+        if max_depth is None:
+            max_depth = 1 if s else 0
 
-        records.append((cos_obj, size))
+        nworker = AUTO_WALKERS if p == AUTO_PARALLEL else p
+        usage = COSUsage(config.cos_config, nworker).usage(
+            cos_uri.bucket, cos_uri.path, max_depth, files=s
+        )
 
-    records.sort(key=lambda x: x[0].ls_cmp_key())
-    for obj, size in records:
-        size, coeff = format_size(size, human)
-        output("%10s  %s" % (
-            "%s%s" % (size, coeff),
-            COSUri.compose_uri(cos_uri.bucket, obj.path)
-        ))
+        # 子目录统计完成时立即输出, 最后输出目录本身
+        for obj, size, count in usage:
+            if s and obj.path == cos_uri.path:
+                continue
+            _du_output(obj, size, count, cos_uri.bucket, human)
 
 
 def cos_test(config, uri, d, e, f):
-    cos = COS(config.cos_config)
-    cos_uri = COSUri(uri)
+    with borrow_client(config.cos_config) as cos:
+        cos_uri = COSUri(uri)
+
+        file_exists = cos.file_exists(cos_uri.bucket, cos_uri.path)
+        if f:
+            return file_exists
+
+        dir_exists = cos.dir_exists(cos_uri.bucket, cos_uri.path)
+        if d:
+            return dir_exists
+
+        if e:
+            return file_exists or dir_exists
 
-    file_exists = cos.file_exists(cos_uri.bucket, cos_uri.path)
-    if f:
-        return file_exists
 
-    dir_exists = cos.dir_exists(cos_uri.bucket, cos_uri.path)
-    if d:
-        return dir_exists
+def cos_batch(config, lines, p, dispatch):
+    """
+    在同一进程中执行多条命令, p > 1 时并发执行, 每行结束时输出状态.
+    每行命令的汇总只统计这一行, 报告文件只在最后写入一次, 包括所有行
+
+    :param lines: (行号, 命令行) 迭代器
+    :param dispatch: 执行一条命令的函数, 返回退出码
+    :return: 失败的行数
+    """
+    progress = Progress()
+
+    def work(_, job):
+        lineno, line = job
+        start = time.time()
+        with metrics.scope():
+            code = dispatch(line)
+        elapsed = time.time() - start
+
+        status = "ok" if code == 0 else "failed"
+        output_record([
+            ("line", lineno),
+            ("status", status),
+            ("code", code),
+            ("elapsed", round(elapsed, 3)),
+            ("command", line),
+        ], "batch: %s line %d %s (exit %d, %0.2fs): %s" % (
+            progress.step(), lineno, status, code, elapsed, line
+        ))
+        return code == 0
+
+    # 各行命令共享 config, 执行期间不写入报告
+    report, config.report = config.report, None
+    try:
+        worker = ThreadWorker(p, work=work)
+        result = worker.run(progress.track(lines))
+    finally:
+        config.report = report
 
-    if e:
-        return file_exists or dir_exists
+    return _summary(config, "run", progress, result)
@@ -1,22 +1,90 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import os
+import re
+import time
+import Queue
+import random
+import contextlib
+import importlib
 import posixpath
-import qcloud_cos as qcos
+import threading
+
+from coscli.index import DEFAULT_INDEX, open_index
+from coscli.metrics import current, inherit
+from coscli.ratelimit import open_limiter, parse_rate
+
+
+class _LazySDK(object):
+    """
+    qcloud_cos 及其依赖(requests 等)导入较慢, 第一次创建 CosClient 或请求时
+    才导入, --help, 配置错误等不需要请求的调用不再导入 SDK
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        module = self._module
+        if module is None:
+            module = self._module = importlib.import_module(self._name)
+        return getattr(module, attr)
+
+
+qcos = _LazySDK("qcloud_cos")
+
+
+def _compact(value):
+    """
+    只包含 ASCII 的 unicode 转换为 str, 与 unicode 拼接和比较时结果不变
+    """
+    if isinstance(value, unicode):
+        try:
+            return value.encode("ascii")
+        except UnicodeError:
+            pass
+    return value
 
 
 class COSObject(object):
     """
     COS 目录(Prefix) 或文件
+
+    get/del 等命令列出的对象可能有数百万个, 为了节省内存:
+
+    - 使用 __slots__, 没有每个实例的 __dict__
+    - 列出结果中同一目录下的对象共享 parent 字符串, 只保存名称,
+      path 在访问时拼接
+    - 只包含 ASCII 的名称和 sha 保存为 str, UCS-4 编译的 Python 中
+      unicode 每个字符占 4 字节
+
+    64 位 Python 2.7 上列出结果中每个对象(名称 17 个 ASCII 字符)约占
+    270 字节, 原来约为 780 字节, 不超过 300 字节由 benchmarks/memory.py
+    检查
+
+    :param path: 完整路径, 指定 parent 时为 parent 下的名称
+    :param parent: 所在目录, 以 "/" 结尾
     """
 
-    def __init__(self, path, filesize=None, mtime=None, sha=None):
-        self.path = path
+    __slots__ = ("parent", "name", "filesize", "mtime", "sha")
+
+    def __init__(self, path, filesize=None, mtime=None, sha=None,
+                 parent=""):
+        self.parent = parent
+        self.name = _compact(path)
         self.filesize = filesize
         self.mtime = mtime
-        self.sha = sha
+        self.sha = _compact(sha)
 
-        self.is_dir = path.endswith("/")
+    @property
+    def path(self):
+        return self.parent + self.name
+
+    @property
+    def is_dir(self):
+        return self.name.endswith("/")
 
     def ls_cmp_key(self):
         """
@@ -27,6 +95,88 @@ class COSObject(object):
         return not self.is_dir, self.path
 
 
+class RetryPolicy(object):
+    """
+    COS 请求重试策略, 使用带上限的指数退避和 full jitter
+
+    :param max_attempts: 最多请求次数, 包括第一次
+    :param throttle_only: 只重试服务端明确拒绝(限流)的请求, 用于非幂等操作,
+                          避免请求已经生效但响应丢失时重复执行
+    """
+
+    def __init__(self, max_attempts=5, base=0.5, cap=20.0,
+                 throttle_only=False):
+        self.max_attempts = max_attempts
+        self.base = base
+        self.cap = cap
+        self.throttle_only = throttle_only
+
+    def should_retry(self, kind, attempt):
+        if kind is None or attempt + 1 >= self.max_attempts:
+            return False
+        if self.throttle_only:
+            return kind == "throttle"
+        return True
+
+    def delay(self, attempt):
+        return random.uniform(0, min(self.cap, self.base * (2 ** attempt)))
+
+
+# list/stat/download/delete/copy(覆盖)/upload(覆盖) 重复执行结果相同
+IDEMPOTENT = RetryPolicy()
+# move 成功后源文件已不存在, 重复执行会失败
+NON_IDEMPOTENT = RetryPolicy(throttle_only=True)
+
+
+# 下载时每次读取的数据量
+READ_SIZE = 64 * 1024
+
+# 文件接口为 "status_code:503", 下载为 "status code:503"
+_status_re = re.compile(r"status[_ ]code:\s*(\d+)")
+
+# SDK 的错误码, PARAMS_ERROR 是本地参数检查失败, 重试不会成功,
+# SERVER_ERROR 是 SDK 捕获的请求异常(连接失败, 超时等)
+PARAMS_ERROR = -1
+SERVER_ERROR = -3
+# _request 捕获的请求异常(下载时连接断开, 超时, 内容不完整等)
+REQUEST_ERROR = -100
+# COS 的错误码, 文件或目录不存在
+NOT_EXISTS = -197
+
+
+def _exception_code(error):
+    """
+    本地文件的错误(带有 filename)重试不会成功, 其他异常都作为请求异常
+    """
+    if isinstance(error, EnvironmentError) and error.filename is not None:
+        return PARAMS_ERROR
+    return REQUEST_ERROR
+
+
+def _error_kind(resp):
+    """
+    判断失败的响应是否为临时错误
+
+    :return: "throttle" 限流, "transient" 服务端或网络临时错误,
+             None 不需要重试
+    """
+    message = resp.get("message") or ""
+    match = _status_re.search(message)
+    if match:
+        status = int(match.group(1))
+        if status in (429, 503):
+            return "throttle"
+        if status >= 500:
+            return "transient"
+        return None
+
+    # 请求异常时没有 HTTP 状态码
+    if resp.get("code") in (SERVER_ERROR, REQUEST_ERROR):
+        return "transient"
+
+    return None
+
+
 class COS(object):
 
     def __init__(self, config):
@@ -36,6 +186,95 @@ class COS(object):
         region = unicode(config["region"])
 
         self.client = qcos.CosClient(appid, key, secret, region)
+        # release_client 按配置放回空闲实例
+        self.config_key = _config_key(config)
+
+        # 所有 COS 实例共享连接池, 与 SDK 一样使用时才导入 requests
+        from coscli.pool import DEFAULT_POOL_SIZE, open_pool
+        pool_size = int(config.get("pool_size") or DEFAULT_POOL_SIZE)
+        pool = open_pool(pool_size)
+        pool.attach(self.client)
+
+        # 可选的本地目录列出结果缓存
+        self.index = None
+        ttl = int(config.get("index_ttl") or 0)
+        if ttl > 0:
+            self.index = open_index(
+                config.get("index_path") or DEFAULT_INDEX, ttl
+            )
+
+        # 可选的传输限速, 所有 COS 实例共享
+        self.limiter = None
+        rate = parse_rate(config.get("limit_rate") or 0)
+        control_file = config.get("limit_rate_file")
+        if rate > 0 or control_file:
+            self.limiter = open_limiter(rate, control_file)
+            # 上传的请求内容在发送时按块限速
+            pool.limit(self.limiter)
+
+    def _throttle(self, nbytes):
+        if self.limiter is not None:
+            self.limiter.consume(nbytes)
+
+    def _request(self, op, call, policy=IDEMPOTENT, nbytes=0,
+                 missing_ok=False):
+        """
+        执行 SDK 请求, 临时错误时按 policy 重试
+
+        :param op: 操作名, 用于统计
+        :param call: 无参数函数, 每次重试重新调用
+        :param nbytes: 请求传输的数据量, 用于统计
+        :param missing_ok: 检查是否存在的请求, 不存在是正常的结果, 不计为失败
+        :rtype dict, SDK 返回的响应
+        """
+        attempt = 0
+        while True:
+            error = None
+            start = time.time()
+            try:
+                resp = call()
+            except Exception as e:
+                error = e
+                resp = {"code": _exception_code(e), "message": str(e)}
+
+            code = resp["code"]
+            ok = code == 0 or (missing_ok and code == NOT_EXISTS)
+            current().request(
+                op, time.time() - start, ok, nbytes if code == 0 else 0
+            )
+            if ok:
+                return resp
+
+            if not policy.should_retry(_error_kind(resp), attempt):
+                if error is not None:
+                    raise error
+                return resp
+
+            current().retry(op)
+            time.sleep(policy.delay(attempt))
+            attempt += 1
+
+    def _index_lookup(self, bucket, path):
+        """
+        从缓存中查找 path, 返回 (是否有未过期的缓存, info 或 None)
+        """
+        if self.index is None:
+            return False, None
+
+        name = path.rstrip("/")
+        prefix = posixpath.dirname(name).rstrip("/") + "/"
+        name = posixpath.basename(name)
+        if path.endswith("/"):
+            name += "/"
+
+        return self.index.lookup(bucket, prefix, name)
+
+    def _invalidate(self, bucket, *paths):
+        if self.index is None:
+            return
+
+        for path in paths:
+            self.index.invalidate(bucket, path)
 
     def file_exists(self, bucket, path):
         """
@@ -44,8 +283,18 @@ class COS(object):
         :param bucket: bucket name
         :param path: file path
         """
+        # 以 / 结尾的只能是目录, SDK 也不允许 stat
+        if path.endswith("/"):
+            return False
+
+        fresh, info = self._index_lookup(bucket, path)
+        if fresh:
+            return info is not None and not info["name"].endswith("/")
+
         req = qcos.StatFileRequest(unicode(bucket), unicode(path))
-        resp = self.client.stat_file(req)
+        resp = self._request(
+            "stat", lambda: self.client.stat_file(req), missing_ok=True
+        )
 
         return resp["code"] == 0
 
@@ -58,10 +307,19 @@ class COS(object):
         """
         # COS 没办法存储一个空目录, 判断一个目录是否存在需要检查下面是否有文件
         dir_path = path.rstrip("/") + "/"
+        if self.index is not None:
+            count = self.index.count(bucket, dir_path)
+            if count is not None:
+                return count > 0
+            if dir_path != "/":
+                fresh, info = self._index_lookup(bucket, dir_path)
+                if fresh:
+                    return info is not None
+
         req = qcos.ListFolderRequest(
             unicode(bucket), unicode(dir_path), num=1
         )
-        resp = self.client.list_folder(req)
+        resp = self._request("list", lambda: self.client.list_folder(req))
         if resp["code"] != 0:
             raise Exception(resp["message"])
 
@@ -78,24 +336,50 @@ class COS(object):
         :param path: dir path
         :rtype COSObject
         """
+        # 同一目录下的对象共享 prefix
+        prefix = unicode(path)
+        if not prefix.endswith("/"):
+            prefix += "/"
+
+        if self.index is not None:
+            infos = self.index.get(bucket, path)
+            if infos is not None:
+                for info in infos:
+                    yield self._info_obj(prefix, info)
+                return
+
+            # 列出完成后写入缓存
+            infos = []
+        else:
+            infos = None
+
         data = {"listover": False, "context": u""}
         while not data["listover"]:
             req = qcos.ListFolderRequest(
                 unicode(bucket),
                 unicode(path), context=data["context"]
             )
-            resp = self.client.list_folder(req)
+            resp = self._request("list", lambda: self.client.list_folder(req))
             if resp["code"] != 0:
                 raise Exception(resp["message"])
             data = resp["data"]
             for info in data["infos"]:
-                obj = COSObject(
-                    posixpath.join(path, info["name"]),
-                    info.get("filesize"),
-                    info.get("mtime"),
-                    info.get("sha")
-                )
-                yield obj
+                if infos is not None:
+                    infos.append(info)
+                yield self._info_obj(prefix, info)
+
+        if infos is not None:
+            self.index.put(bucket, path, infos)
+
+    @staticmethod
+    def _info_obj(prefix, info):
+        return COSObject(
+            info["name"],
+            info.get("filesize"),
+            info.get("mtime"),
+            info.get("sha"),
+            prefix
+        )
 
     def walk_path(self, bucket, path):
         """
@@ -112,6 +396,20 @@ class COS(object):
             else:
                 yield obj
 
+    @staticmethod
+    def _upload_obj(path, resp, filesize=None, sha=None):
+        """
+        由上传响应生成 COSObject, 响应中没有的字段使用 COS 已经校验过的值,
+        都没有时为 None, 需要 stat 确认
+        """
+        data = resp.get("data") or {}
+        return COSObject(
+            path,
+            data.get("filesize", filesize),
+            data.get("mtime"),
+            data.get("sha", sha)
+        )
+
     def upload(self, bucket, path, local_file):
         """
         上传本地文件到 COS, 将覆盖已经存在的文件
@@ -119,14 +417,19 @@ class COS(object):
         :param bucket: bucket name
         :param path: dest cos path
         :param local_file: local file
+        :rtype COSObject
         """
+        self._invalidate(bucket, path)
         req = qcos.UploadFileRequest(
             unicode(bucket),
             unicode(path),
             unicode(local_file),
             insert_only=0
         )
-        resp = self.client.upload_file(req)
+        resp = self._request(
+            "upload", lambda: self.client.upload_file(req),
+            nbytes=os.path.getsize(local_file)
+        )
         if resp["code"] != 0:
             # COS 上传失败的文件会保留, 下次上传时无法覆盖, 这里先删除
             if resp["message"].find("status_code:403") != -1:
@@ -135,21 +438,78 @@ class COS(object):
 
             raise Exception(resp["message"])
 
-    def download(self, bucket, path, local_file):
+        return self._upload_obj(path, resp)
+
+    def upload_data(self, bucket, path, data, sha=None):
         """
-        下载 COS 文件到本地
+        上传内存中的数据到 COS, 将覆盖已经存在的文件
 
         :param bucket: bucket name
-        :param path: cos path
-        :param local_file: dest local file
+        :param path: dest cos path
+        :param data: 文件内容
+        :param sha: 文件内容的 sha1, COS 会校验上传的内容
+        :rtype COSObject
         """
-        req = qcos.DownloadFileRequest(
-            unicode(bucket), unicode(path), unicode(local_file)
+        self._invalidate(bucket, path)
+        fields = {
+            "op": "upload",
+            "filecontent": data,
+            "insertOnly": 0,
+        }
+        if sha is not None:
+            fields["sha"] = sha
+
+        resp = self._request(
+            "upload", lambda: self._post_form(bucket, path, fields),
+            nbytes=len(data)
         )
-        resp = self.client.download_file(req)
         if resp["code"] != 0:
+            # COS 上传失败的文件会保留, 下次上传时无法覆盖, 这里先删除
+            if resp["message"].find("status_code:403") != -1:
+                req = qcos.DelFileRequest(unicode(bucket), unicode(path))
+                self.client.del_file(req)
+
             raise Exception(resp["message"])
 
+        # 上传成功说明 COS 收到的内容与 sha 一致
+        if sha is None:
+            return self._upload_obj(path, resp)
+        return self._upload_obj(path, resp, len(data), sha)
+
+    def download_range(self, bucket, path, start, end):
+        """
+        下载 COS 文件中 [start, end] 范围的内容
+
+        :param bucket: bucket name
+        :param path: cos path
+        :param start: 起始字节
+        :param end: 结束字节, 包含在内
+        :rtype str
+        """
+        # SDK 不会根据 range_start/range_end 设置 Range, 需要自己指定
+        req = qcos.DownloadObjectRequest(
+            unicode(bucket), unicode(path), start, end,
+            headers={"Range": "bytes=%d-%d" % (start, end)}
+        )
+
+        def call():
+            stream = self.client.download_object(req)
+            # 每读取一块获取一次限速令牌, 避免整段一次性突发
+            chunks = []
+            while True:
+                chunk = stream.read(READ_SIZE)
+                if not chunk:
+                    break
+                self._throttle(len(chunk))
+                chunks.append(chunk)
+            data = "".join(chunks)
+            if len(data) != end - start + 1:
+                raise IOError("range %d-%d size not match" % (start, end))
+            return {"code": 0, "data": data}
+
+        resp = self._request("download", call, nbytes=end - start + 1)
+        return resp["data"]
+
     def delete(self, bucket, path):
         """
         删除 COS 文件
@@ -157,8 +517,9 @@ class COS(object):
         :param bucket: bucket name
         :param path: cos path
         """
+        self._invalidate(bucket, path)
         req = qcos.DelFileRequest(unicode(bucket), unicode(path))
-        resp = self.client.del_file(req)
+        resp = self._request("delete", lambda: self.client.del_file(req))
         if resp["code"] != 0:
             raise Exception(resp["message"])
 
@@ -170,13 +531,16 @@ class COS(object):
         :param src_path: src cos path
         :param dest_path: dest cos path
         """
+        self._invalidate(bucket, src_path, dest_path)
         req = qcos.MoveFileRequest(
             unicode(bucket),
             unicode(src_path),
             unicode(dest_path),
             overwrite=True
         )
-        resp = self.client.move_file(req)
+        resp = self._request(
+            "move", lambda: self.client.move_file(req), NON_IDEMPOTENT
+        )
         if resp["code"] != 0:
             raise Exception(resp["message"])
 
@@ -188,31 +552,134 @@ class COS(object):
         :param src_path: src cos path
         :param dest_path: dest cos path
         """
+        self._invalidate(bucket, dest_path)
+
         # 由于官方 sdk 还没有提供 copy api, 这里 hack 一下
-        auth = qcos.Auth(self.client._cred)
         bucket = unicode(bucket)
         cos_path = unicode(src_path)
-        sign = auth.sign_once(bucket, cos_path)
+
+        def send():
+            # 签名只能使用一次, 重试时需要重新签名
+            auth = qcos.Auth(self.client._cred)
+            sign = auth.sign_once(bucket, cos_path)
+
+            http_header = dict()
+            http_header["Authorization"] = sign
+            http_header["User-Agent"] = self.client._config.get_user_agent()
+
+            http_body = dict()
+            http_body["op"] = "copy"
+            http_body["dest_fileid"] = unicode(dest_path)
+            http_body["to_over_write"] = "1"
+
+            timeout = self.client._config.get_timeout()
+            return self.client._file_op.send_request(
+                "POST", bucket, cos_path,
+                headers=http_header,
+                params=http_body,
+                timeout=timeout
+            )
+
+        resp = self._request("copy", send)
+        if resp["code"] != 0:
+            raise Exception(resp["message"])
+
+    def _post_form(self, bucket, path, fields):
+        """
+        直接以 multipart/form-data 请求 COS 文件接口, 用于 SDK 没有提供的操作
+
+        :param fields: 表单字段, filecontent 作为文件内容上传
+        """
+        bucket = unicode(bucket)
+        cos_path = unicode(path)
+
+        auth = qcos.Auth(self.client._cred)
+        sign = auth.sign_more(bucket, cos_path, int(time.time()) + 3600)
 
         http_header = dict()
         http_header["Authorization"] = sign
         http_header["User-Agent"] = self.client._config.get_user_agent()
 
-        http_body = dict()
-        http_body["op"] = "copy"
-        http_body["dest_fileid"] = unicode(dest_path)
-        http_body["to_over_write"] = "1"
+        files = dict()
+        for name, value in fields.items():
+            if name == "filecontent":
+                files[name] = ("blob", value)
+            else:
+                files[name] = (None, str(value))
 
         timeout = self.client._config.get_timeout()
-        resp = self.client._file_op.send_request(
+        return self.client._file_op.send_request(
             "POST", bucket, cos_path,
             headers=http_header,
-            params=http_body,
+            files=files,
             timeout=timeout
         )
+
+    def slice_init(self, bucket, path, filesize, slice_size):
+        """
+        初始化分片上传, 将覆盖已存在的文件
+
+        :param bucket: bucket name
+        :param path: dest cos path
+        :param filesize: 文件大小
+        :param slice_size: 分片大小
+        :return: (session, slice_size, COS 上已有的分片 offset 集合)
+        """
+        self._invalidate(bucket, path)
+        fields = {
+            "op": "upload_slice_init",
+            "filesize": filesize,
+            "slice_size": slice_size,
+            "insertOnly": 0,
+        }
+        resp = self._request(
+            "slice_init", lambda: self._post_form(bucket, path, fields)
+        )
+        if resp["code"] != 0:
+            raise Exception(resp["message"])
+
+        data = resp["data"]
+        done = set(int(part["offset"]) for part in data.get("listparts", []))
+
+        return data["session"], int(data.get("slice_size", slice_size)), done
+
+    def slice_data(self, bucket, path, session, offset, data):
+        """
+        上传一个分片, 相同 offset 重复上传会覆盖
+        """
+        fields = {
+            "op": "upload_slice_data",
+            "session": session,
+            "offset": offset,
+            "filecontent": data,
+        }
+        resp = self._request(
+            "slice_data", lambda: self._post_form(bucket, path, fields),
+            nbytes=len(data)
+        )
+        if resp["code"] != 0:
+            raise Exception(resp["message"])
+
+    def slice_finish(self, bucket, path, session, filesize):
+        """
+        所有分片上传完成, 合并为文件
+
+        :rtype COSObject
+        """
+        self._invalidate(bucket, path)
+        fields = {
+            "op": "upload_slice_finish",
+            "session": session,
+            "filesize": filesize,
+        }
+        resp = self._request(
+            "slice_finish", lambda: self._post_form(bucket, path, fields)
+        )
         if resp["code"] != 0:
             raise Exception(resp["message"])
 
+        return self._upload_obj(path, resp)
+
     def stat_file(self, bucket, path):
         """
         获取 COS 文件属性
@@ -221,11 +688,359 @@ class COS(object):
         :param path: cos path
         :rtype COSObject
         """
+        fresh, info = self._index_lookup(bucket, path)
+        if fresh and info is not None and "sha" in info:
+            return COSObject(
+                path, info["filesize"], info["mtime"], info["sha"]
+            )
+
         req = qcos.StatFileRequest(unicode(bucket), unicode(path))
-        resp = self.client.stat_file(req)
+        resp = self._request("stat", lambda: self.client.stat_file(req))
         if resp["code"] != 0:
             raise Exception(resp["message"])
 
         info = resp["data"]
 
         return COSObject(path, info["filesize"], info["mtime"], info["sha"])
+
+
+# 空闲的 COS 实例, 按配置区分
+_idle_clients = {}
+_idle_lock = threading.Lock()
+
+
+def _config_key(config):
+    return tuple(sorted(config.items()))
+
+
+def open_client(config):
+    """
+    取一个空闲的 COS 实例, 没有时创建, 用完后通过 release_client 放回.
+    工作线程每次运行结束时放回, batch 中的多条命令复用同一组实例
+    """
+    key = _config_key(config)
+    with _idle_lock:
+        idle = _idle_clients.get(key)
+        if idle:
+            return idle.pop()
+
+    return COS(config)
+
+
+def release_client(cos):
+    """
+    放回 open_client 返回的 COS 实例, 之后不能再使用
+    """
+    with _idle_lock:
+        _idle_clients.setdefault(cos.config_key, []).append(cos)
+
+
+@contextlib.contextmanager
+def borrow_client(config):
+    """
+    with 中使用 open_client 取到的 COS 实例, 结束时放回
+    """
+    cos = open_client(config)
+    try:
+        yield cos
+    finally:
+        release_client(cos)
+
+
+class _Listing(object):
+    """
+    COSWalker 中一个目录的完整列出结果
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.objs = None
+        self.error = None
+        self.scheduled = False
+        self.done = threading.Event()
+
+
+class COSWalker(object):
+    """
+    并发递归列出目录下所有文件, 最多使用 nworker 个 COS client 同时列出多个目录
+
+    - ordered 为 True 时输出顺序与 COS.walk_path 相同, 按深度优先预取子目录
+    - 否则按列出完成的顺序输出, 适合 get/del/mv 这类不关心顺序的场景
+    """
+
+    # 无序模式下结果队列长度, 每个元素为一批文件
+    _buffer = 64
+    _batch = 100
+
+    def __init__(self, config, nworker=8, ordered=True):
+        self.config = config
+        self.nworker = max(1, nworker)
+        self.ordered = ordered
+
+    def walk(self, bucket, path):
+        """
+        递归的列出目录下所有文件
+
+        :param bucket: bucket name
+        :param path: dir path
+        :rtype COSObject
+        """
+        if self.ordered:
+            return self._walk_ordered(bucket, path)
+        return self._walk_unordered(bucket, path)
+
+    def _start(self, target):
+        def run():
+            cos = open_client(self.config)
+            try:
+                target(cos)
+            finally:
+                release_client(cos)
+
+        threads = []
+        for i in range(self.nworker):
+            thread = threading.Thread(target=inherit(run))
+            thread.daemon = True
+            threads.append(thread)
+            thread.start()
+
+        return threads
+
+    def _join(self, threads, tasks, stop):
+        # 完成或出错时都等待线程退出, 否则解释器退出时守护线程可能仍在运行
+        stop.set()
+        for _ in threads:
+            tasks.put(None)
+        for thread in threads:
+            thread.join()
+
+    def _walk_unordered(self, bucket, path):
+        tasks = Queue.Queue()
+        results = Queue.Queue(maxsize=self._buffer)
+        stop = threading.Event()
+        lock = threading.Lock()
+        pending = [1]
+        finished = object()
+
+        def put_result(item):
+            # 调用方提前结束迭代时不能一直阻塞在满的队列上
+            while not stop.is_set():
+                try:
+                    results.put(item, timeout=0.1)
+                    return
+                except Queue.Full:
+                    pass
+
+        def work(cos):
+            while True:
+                dir_path = tasks.get()
+                if dir_path is None or stop.is_set():
+                    return
+
+                batch = []
+                try:
+                    for obj in cos.iter_path(bucket, dir_path):
+                        if stop.is_set():
+                            break
+                        if obj.is_dir:
+                            with lock:
+                                pending[0] += 1
+                            tasks.put(obj.path)
+                            continue
+
+                        batch.append(obj)
+                        if len(batch) >= self._batch:
+                            put_result(batch)
+                            batch = []
+                    if batch:
+                        put_result(batch)
+                except Exception as e:
+                    put_result(e)
+
+                with lock:
+                    pending[0] -= 1
+                    last = pending[0] == 0
+                if last:
+                    put_result(finished)
+
+        threads = self._start(work)
+        tasks.put(path)
+        try:
+            while True:
+                item = results.get()
+                if item is finished:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                for obj in item:
+                    yield obj
+        finally:
+            self._join(threads, tasks, stop)
+
+    def _walk_ordered(self, bucket, path):
+        tasks = Queue.Queue()
+        stop = threading.Event()
+        # 最多预取的目录数, 避免调用方处理较慢时缓存整棵树
+        window = self.nworker * 4
+        inflight = [0]
+
+        def work(cos):
+            while True:
+                listing = tasks.get()
+                if listing is None:
+                    return
+
+                if not stop.is_set():
+                    try:
+                        objs = cos.iter_path(bucket, listing.path)
+                        listing.objs = list(objs)
+                    except Exception as e:
+                        listing.error = e
+                listing.done.set()
+
+        def schedule(listing):
+            if not listing.scheduled:
+                listing.scheduled = True
+                inflight[0] += 1
+                tasks.put(listing)
+
+        def visit(listing):
+            schedule(listing)
+            while not listing.done.wait(0.1):
+                pass
+            inflight[0] -= 1
+
+            if listing.error is not None:
+                raise listing.error
+            objs, listing.objs = listing.objs, None
+
+            children = [_Listing(obj.path) for obj in objs if obj.is_dir]
+            for child in children:
+                if inflight[0] >= window:
+                    break
+                schedule(child)
+
+            children = iter(children)
+            for obj in objs:
+                if obj.is_dir:
+                    for sub_obj in visit(next(children)):
+                        yield sub_obj
+                else:
+                    yield obj
+
+        threads = self._start(work)
+        try:
+            for obj in visit(_Listing(path)):
+                yield obj
+        finally:
+            self._join(threads, tasks, stop)
+
+
+class _Usage(object):
+    """
+    COSUsage 中一个目录的统计, pending 为未完成的列出和子目录数
+    """
+
+    def __init__(self, path, parent, depth):
+        self.path = path
+        self.parent = parent
+        self.depth = depth
+        self.size = 0
+        self.count = 0
+        self.pending = 1
+
+
+class COSUsage(COSWalker):
+    """
+    并发统计目录占用的空间, 一次遍历把文件大小和数量汇总到每一层目录,
+    目录及其子目录都列出完成时立即返回该目录的统计
+    """
+
+    def __init__(self, config, nworker=8):
+        super(COSUsage, self).__init__(config, nworker, ordered=False)
+
+    def usage(self, bucket, path, max_depth=0, files=False):
+        """
+        :param bucket: bucket name
+        :param path: dir path, 以 / 结束
+        :param max_depth: 返回深度不超过 max_depth 的目录, path 的深度为 0
+        :param files: 是否同时返回深度不超过 max_depth 的文件
+        :rtype (COSObject, size, count), 按完成顺序返回, path 最后返回
+        """
+        tasks = Queue.Queue()
+        results = Queue.Queue(maxsize=self._buffer)
+        stop = threading.Event()
+        lock = threading.Lock()
+        finished = object()
+
+        def put_result(item):
+            while not stop.is_set():
+                try:
+                    results.put(item, timeout=0.1)
+                    return
+                except Queue.Full:
+                    pass
+
+        def complete(node):
+            # 调用时持有 lock, 逐层向上汇总已经完成的目录
+            done = []
+            while node is not None:
+                node.pending -= 1
+                if node.pending > 0:
+                    break
+
+                if node.depth <= max_depth:
+                    done.append((COSObject(node.path), node.size, node.count))
+                parent = node.parent
+                if parent is not None:
+                    parent.size += node.size
+                    parent.count += node.count
+                else:
+                    done.append(finished)
+                node = parent
+            return done
+
+        def work(cos):
+            while True:
+                node = tasks.get()
+                if node is None or stop.is_set():
+                    return
+
+                entries = []
+                try:
+                    for obj in cos.iter_path(bucket, node.path):
+                        if stop.is_set():
+                            break
+                        if obj.is_dir:
+                            child = _Usage(obj.path, node, node.depth + 1)
+                            with lock:
+                                node.pending += 1
+                            tasks.put(child)
+                            continue
+
+                        with lock:
+                            node.size += obj.filesize
+                            node.count += 1
+                        if files and node.depth < max_depth:
+                            entries.append((obj, obj.filesize, 1))
+                except Exception as e:
+                    put_result(e)
+
+                with lock:
+                    entries.extend(complete(node))
+                if entries:
+                    put_result(entries)
+
+        threads = self._start(work)
+        tasks.put(_Usage(path, None, 0))
+        try:
+            while True:
+                item = results.get()
+                if isinstance(item, Exception):
+                    raise item
+                for entry in item:
+                    if entry is finished:
+                        return
+                    yield entry
+        finally:
+            self._join(threads, tasks, stop)
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import sqlite3
+import posixpath
+import threading
+
+from coscli.utils import ensure_dir_exists
+
+
+DEFAULT_INDEX = "~/.cache/coscli/index.db"
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def open_index(path=DEFAULT_INDEX, ttl=300):
+    """
+    同一进程中相同路径的 ListingIndex 只打开一次, 所有 COS 实例共享
+    """
+    path = os.path.expanduser(path)
+    with _indexes_lock:
+        index = _indexes.get(path)
+        if index is None:
+            index = _indexes[path] = ListingIndex(path, ttl)
+        index.ttl = ttl
+
+    return index
+
+
+def parent_prefixes(path):
+    """
+    path 所在的所有上级目录, 由近到远, 如 /a/b/c -> /a/b/, /a/, /
+    """
+    path = path.rstrip("/")
+    while path:
+        path = posixpath.dirname(path).rstrip("/")
+        yield path + "/"
+
+
+class ListingIndex(object):
+    """
+    本地保存的目录列出结果, 以 (bucket, 目录) 为 key, 超过 ttl 秒后失效
+
+    只保存目录下一层的列出结果, 递归列出时每个子目录单独缓存.
+    同一个 ListingIndex 可以在多个线程中使用, 每个线程使用单独的连接
+    """
+
+    _schema = (
+        """
+        CREATE TABLE IF NOT EXISTS prefixes (
+            bucket TEXT NOT NULL,
+            prefix TEXT NOT NULL,
+            updated REAL NOT NULL,
+            PRIMARY KEY (bucket, prefix)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS entries (
+            bucket TEXT NOT NULL,
+            prefix TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            filesize INTEGER,
+            mtime INTEGER,
+            sha TEXT,
+            PRIMARY KEY (bucket, prefix, seq)
+        )
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS entries_name
+        ON entries (bucket, prefix, name)
+        """,
+    )
+
+    def __init__(self, path=DEFAULT_INDEX, ttl=300):
+        self.path = os.path.expanduser(path)
+        self.ttl = ttl
+
+        dirname = os.path.dirname(self.path)
+        if dirname:
+            ensure_dir_exists(dirname)
+
+        self._local = threading.local()
+        # 本进程中已经失效过的目录, 重复失效时不需要再写入
+        self._invalidated = set()
+        self._lock = threading.Lock()
+
+        conn = self._conn()
+        for sql in self._schema:
+            conn.execute(sql)
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.text_factory = unicode
+            # 只是缓存, 丢失也没关系, 不需要每次提交都落盘
+            conn.execute("PRAGMA synchronous = OFF")
+            self._local.conn = conn
+        return conn
+
+    def _is_fresh(self, conn, bucket, prefix):
+        row = conn.execute(
+            "SELECT updated FROM prefixes WHERE bucket = ? AND prefix = ?",
+            (bucket, prefix)
+        ).fetchone()
+
+        return row is not None and time.time() - row[0] < self.ttl
+
+    def get(self, bucket, prefix):
+        """
+        获取目录的列出结果, 没有缓存或已经过期时返回 None
+
+        :param bucket: bucket name
+        :param prefix: dir path, 以 / 结束
+        :rtype list of dict, 与 COS list_folder 返回的 infos 格式相同
+        """
+        conn = self._conn()
+        if not self._is_fresh(conn, bucket, prefix):
+            return None
+
+        rows = conn.execute(
+            "SELECT name, filesize, mtime, sha FROM entries "
+            "WHERE bucket = ? AND prefix = ? ORDER BY seq",
+            (bucket, prefix)
+        )
+        return [self._row_info(row) for row in rows]
+
+    def count(self, bucket, prefix):
+        """
+        目录下一层的文件和目录数, 没有缓存或已经过期时返回 None
+        """
+        conn = self._conn()
+        if not self._is_fresh(conn, bucket, prefix):
+            return None
+
+        return conn.execute(
+            "SELECT COUNT(*) FROM entries WHERE bucket = ? AND prefix = ?",
+            (bucket, prefix)
+        ).fetchone()[0]
+
+    def lookup(self, bucket, prefix, name):
+        """
+        在目录的列出结果中查找一项
+
+        :return: (是否有未过期的缓存, info 或 None)
+        """
+        conn = self._conn()
+        if not self._is_fresh(conn, bucket, prefix):
+            return False, None
+
+        row = conn.execute(
+            "SELECT name, filesize, mtime, sha FROM entries "
+            "WHERE bucket = ? AND prefix = ? AND name = ?",
+            (bucket, prefix, name)
+        ).fetchone()
+
+        return True, row and self._row_info(row)
+
+    def put(self, bucket, prefix, infos):
+        """
+        保存目录的完整列出结果
+
+        :param infos: COS list_folder 返回的 infos
+        """
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "DELETE FROM entries WHERE bucket = ? AND prefix = ?",
+                (bucket, prefix)
+            )
+            conn.executemany(
+                "INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    (
+                        bucket, prefix, seq, info["name"],
+                        info.get("filesize"), info.get("mtime"),
+                        info.get("sha")
+                    )
+                    for seq, info in enumerate(infos)
+                )
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO prefixes VALUES (?, ?, ?)",
+                (bucket, prefix, time.time())
+            )
+
+        with self._lock:
+            self._invalidated.discard((bucket, prefix))
+
+    def invalidate(self, bucket, path):
+        """
+        path 被修改, 使其所在的所有上级目录失效
+        """
+        with self._lock:
+            prefixes = [
+                prefix for prefix in parent_prefixes(path)
+                if (bucket, prefix) not in self._invalidated
+            ]
+            self._invalidated.update((bucket, p) for p in prefixes)
+
+        if not prefixes:
+            return
+
+        conn = self._conn()
+        with conn:
+            conn.executemany(
+                "DELETE FROM prefixes WHERE bucket = ? AND prefix = ?",
+                ((bucket, prefix) for prefix in prefixes)
+            )
+
+    @staticmethod
+    def _row_info(row):
+        name, filesize, mtime, sha = row
+        info = {"name": name}
+        if not name.endswith("/"):
+            info.update(filesize=filesize, mtime=mtime, sha=sha)
+        return info
@@ -3,12 +3,16 @@
 
 import sys
 import click
+import shlex
 import os.path
-import qcloud_cos as qcos
 from ConfigParser import ConfigParser
 
 from coscli import __version__
 from coscli import command
+from coscli.ratelimit import parse_rate
+from coscli.utils import AUTO_PARALLEL, OUTPUT_FORMATS, set_output_format
+from coscli.utils import output
+from coscli.manifest import DEFAULT_MANIFEST
 
 
 SYSTEM_LEVEL_CONFIG = "/etc/coscli.cfg"
@@ -27,10 +31,17 @@ class CliConfig(object):
             "region": cfg.get("cos", "region")
         }
 
+        # 可选的本地目录列出缓存, ttl 为 0 时不使用
+        if cfg.has_section("index"):
+            for name in ("ttl", "path"):
+                if cfg.has_option("index", name):
+                    self.cos_config["index_" + name] = cfg.get("index", name)
+
         self._check_cos_config()
 
         self.dry_run = False
         self.debug = False
+        self.report = None
 
     def _check_cos_config(self):
         try:
@@ -38,12 +49,42 @@ class CliConfig(object):
         except (ValueError, KeyError):
             raise ValueError("app_id must int value")
 
-        appid = int(self.cos_config["appid"])
-        key = unicode(self.cos_config["key"])
-        secret = unicode(self.cos_config["secret"])
-        region = unicode(self.cos_config["region"])
+        try:
+            int(self.cos_config.get("index_ttl", 0))
+        except ValueError:
+            raise ValueError("index ttl must int value")
+
+        # 只检查配置项, 不创建 CosClient, 避免导入 SDK, 由命令第一次请求时创建
+        for name, option in (("key", "access_key_id"),
+                             ("secret", "access_key_secret"),
+                             ("region", "region")):
+            if not self.cos_config[name].strip():
+                raise ValueError("%s must not be empty" % option)
+
+
+class ParallelType(click.ParamType):
+    """
+    --p 参数, 正整数或 auto
+    """
+
+    name = "parallel"
+
+    def convert(self, value, param, ctx):
+        if value == AUTO_PARALLEL:
+            return value
+
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            self.fail("%s is not a valid integer or auto" % value, param, ctx)
+
+        if value < 1:
+            self.fail("%d is not a positive integer" % value, param, ctx)
 
-        qcos.CosClient(appid, key, secret, region)
+        return value
+
+
+PARALLEL = ParallelType()
 
 
 def handle_exception(e, debug):
@@ -64,12 +105,28 @@ pass_config = click.make_pass_decorator(CliConfig)
 @click.option("--dryrun", "-n", is_flag=True,
               help="Only show what should be do.")
 @click.option("--debug", "-d", is_flag=True, help="Enable debug output.")
+@click.option("--no-index", is_flag=True,
+              help="Do not use the local listing index.")
+@click.option("--limit-rate", metavar="RATE",
+              help="Limit total transfer rate, like 500k, 10M.")
+@click.option("--limit-rate-file", type=click.Path(),
+              help="File holding the rate limit, reread when changed.")
+@click.option("--pool-size", type=click.IntRange(1),
+              help="Max idle keep-alive connections kept per host.")
+@click.option("--report", type=click.Path(),
+              help="Write a JSON run report with transfer metrics.")
+@click.option("--format", "fmt", default="text", show_default=True,
+              type=click.Choice(OUTPUT_FORMATS),
+              help="Output format of listings and transfer results.")
 @click.version_option(__version__)
 @click.pass_context
-def cli(ctx, config, dryrun, debug):
+def cli(ctx, config, dryrun, debug, no_index, limit_rate, limit_rate_file,
+        pool_size, report, fmt):
     """
     Coscli is simple command line tool for qcloud cos
     """
+    set_output_format(fmt)
+
     try:
         if config is None:
             config = os.path.expanduser(USER_LEVEL_CONFIG)
@@ -84,6 +141,15 @@ def cli(ctx, config, dryrun, debug):
 
         conf.dry_run = dryrun
         conf.debug = debug
+        conf.report = report
+        if no_index:
+            conf.cos_config.pop("index_ttl", None)
+        if limit_rate is not None:
+            conf.cos_config["limit_rate"] = parse_rate(limit_rate)
+        if limit_rate_file is not None:
+            conf.cos_config["limit_rate_file"] = limit_rate_file
+        if pool_size is not None:
+            conf.cos_config["pool_size"] = pool_size
     except Exception as e:
         raise SystemExit("\ncos config error: %s" % e)
 
@@ -95,13 +161,17 @@ def cli(ctx, config, dryrun, debug):
 @click.option("--recursive", "-r", is_flag=True,
               help="Enable recursive list.")
 @click.option("--human", "-h", is_flag=True, help="Enable human readable.")
+@click.option("--p", default=1, type=PARALLEL,
+              help="Use parallel recursive list")
+@click.option("--sort", "-s", is_flag=True,
+              help="Sort by path, directories first.")
 @pass_config
-def ls_command(config, uri, recursive, human):
+def ls_command(config, uri, recursive, human, p, sort):
     """
     List path file or directory
     """
     try:
-        command.cos_ls(config, uri, recursive, human)
+        command.cos_ls(config, uri, recursive, human, p, sort)
     except Exception as e:
         handle_exception(e, config.debug)
 
@@ -110,15 +180,69 @@ def ls_command(config, uri, recursive, human):
 @click.argument("src", nargs=-1)
 @click.argument("uri", nargs=1)
 @click.option("--force", "-f", is_flag=True, help="Enable overwrite exists.")
-@click.option("--checksum", "-c", is_flag=True, help="Enable checksum check.")
-@click.option("--p", default=1, help="Use parallel upload")
+@click.option("--checksum/--no-checksum", "-c/-C", default=True,
+              show_default=True, help="Enable sha1 checksum check.")
+@click.option("--p", default=1, type=PARALLEL,
+              help="Use parallel upload, auto to tune by throughput")
+@click.option("--slice-size", default="1024", show_default=True,
+              type=click.Choice(["512", "1024", "2048", "3072"]),
+              help="Slice size in KB for large files.")
+@click.option("--slice-parallel", default=0,
+              help="Max parallel slices per file, default no limit.")
+@click.option("--rehash", is_flag=True,
+              help="Ignore cached sha1 of local files.")
+@click.option("--skip-identical", is_flag=True,
+              help="Skip existing files with the same sha1.")
+@click.option("--lazy-verify", is_flag=True,
+              help="Verify files by one listing after all uploads.")
 @pass_config
-def put_command(config, src, uri, force, checksum, p):
+def put_command(config, src, uri, force, checksum, p,
+                slice_size, slice_parallel, rehash, lazy_verify,
+                skip_identical):
     """
     Put local file or directory to COS
     """
     try:
-        command.cos_put(config, src, uri, force, checksum, p)
+        failed = command.cos_put(
+            config, src, uri, force, checksum, p,
+            int(slice_size), slice_parallel, rehash, lazy_verify,
+            skip_identical
+        )
+        sys.exit(1 if failed else 0)
+    except Exception as e:
+        handle_exception(e, config.debug)
+
+
+@cli.command(name="sync")
+@click.argument("src", nargs=-1)
+@click.argument("uri", nargs=1)
+@click.option("--checksum/--no-checksum", "-c/-C", default=True,
+              show_default=True, help="Enable sha1 checksum check.")
+@click.option("--p", default=1, type=PARALLEL,
+              help="Use parallel upload, auto to tune by throughput")
+@click.option("--slice-size", default="1024", show_default=True,
+              type=click.Choice(["512", "1024", "2048", "3072"]),
+              help="Slice size in KB for large files.")
+@click.option("--slice-parallel", default=0,
+              help="Max parallel slices per file, default no limit.")
+@click.option("--manifest", type=click.Path(), default=DEFAULT_MANIFEST,
+              show_default=True, help="Local sync state file.")
+@click.option("--rehash", is_flag=True,
+              help="Ignore cached sha1 of local files.")
+@click.option("--lazy-verify", is_flag=True,
+              help="Verify files by one listing after all uploads.")
+@pass_config
+def sync_command(config, src, uri, checksum, p, slice_size, slice_parallel,
+                 manifest, rehash, lazy_verify):
+    """
+    Put changed local files to COS, skip unchanged since last sync
+    """
+    try:
+        failed = command.cos_sync(
+            config, src, uri, checksum, p, int(slice_size), slice_parallel,
+            manifest, rehash, lazy_verify
+        )
+        sys.exit(1 if failed else 0)
     except Exception as e:
         handle_exception(e, config.debug)
 
@@ -128,15 +252,34 @@ def put_command(config, src, uri, force, checksum, p):
 @click.argument("dst", nargs=1)
 @click.option("--force", "-f", is_flag=True, help="Enable overwrite exists.")
 @click.option("--skip", "-s", is_flag=True, help="Enable skip exists.")
-@click.option("--checksum", "-c", is_flag=True, help="Enable checksum check.")
-@click.option("--p", default=1, help="Use parallel download")
+@click.option("--checksum/--no-checksum", "-c/-C", default=True,
+              show_default=True, help="Enable sha1 checksum check.")
+@click.option("--p", default=1, type=PARALLEL,
+              help="Use parallel download, auto to tune by throughput")
+@click.option("--parts", default=4, show_default=True,
+              type=click.IntRange(1, 64),
+              help="Parallel ranges per large file. Each large file buffers "
+                   "up to (parts + 2) * part-size in memory, for each of "
+                   "--p files.")
+@click.option("--part-size", default=16, show_default=True,
+              type=click.IntRange(1, 1024),
+              help="Range size in MB, larger files download by ranges.")
+@click.option("--rehash", is_flag=True,
+              help="Ignore cached sha1 of local files.")
+@click.option("--skip-identical", is_flag=True,
+              help="Skip existing files with the same sha1.")
 @pass_config
-def get_command(config, uri, dst, force, skip, checksum, p):
+def get_command(config, uri, dst, force, skip, checksum, p, parts, part_size,
+                rehash, skip_identical):
     """
     Get COS file or directory to local
     """
     try:
-        command.cos_get(config, uri, dst, force, skip, checksum, p)
+        failed = command.cos_get(
+            config, uri, dst, force, skip, checksum, p, parts, part_size,
+            rehash, skip_identical
+        )
+        sys.exit(1 if failed else 0)
     except Exception as e:
         handle_exception(e, config.debug)
 
@@ -145,14 +288,16 @@ def get_command(config, uri, dst, force, skip, checksum, p):
 @click.argument("uri", nargs=1)
 @click.option("--recursive", "-r", is_flag=True,
               help="Enable recursive delete.")
-@click.option("--p", default=1, help="Use parallel delete")
+@click.option("--p", default=1, type=PARALLEL,
+              help="Use parallel delete, auto to tune by throughput")
 @pass_config
 def del_command(config, uri, recursive, p):
     """
     Delete COS file or directory
     """
     try:
-        command.cos_del(config, uri, recursive, p)
+        failed = command.cos_del(config, uri, recursive, p)
+        sys.exit(1 if failed else 0)
     except Exception as e:
         handle_exception(e, config.debug)
 
@@ -162,14 +307,18 @@ def del_command(config, uri, recursive, p):
 @click.argument("udst", nargs=1)
 @click.option("--force", "-f", is_flag=True, help="Enable overwrite exists.")
 @click.option("--recursive", "-r", is_flag=True, help="Enable recursive mv.")
-@click.option("--p", default=1, help="Use parallel download")
+@click.option("--p", default=1, type=PARALLEL,
+              help="Use parallel download, auto to tune by throughput")
 @pass_config
 def mv_command(config, usrc, udst, force, recursive, p):
     """
     Mv COS file or directory to other COS local
     """
     try:
-        command.cos_mv_copy("mv", config, usrc, udst, force, recursive, p)
+        failed = command.cos_mv_copy(
+            "mv", config, usrc, udst, force, recursive, p
+        )
+        sys.exit(1 if failed else 0)
     except Exception as e:
         handle_exception(e, config.debug)
 
@@ -180,14 +329,18 @@ def mv_command(config, usrc, udst, force, recursive, p):
 @click.option("--force", "-f", is_flag=True, help="Enable overwrite exists.")
 @click.option("--recursive", "-r", is_flag=True,
               help="Enable recursive copy.")
-@click.option("--p", default=1, help="Use parallel download")
+@click.option("--p", default=1, type=PARALLEL,
+              help="Use parallel download, auto to tune by throughput")
 @pass_config
 def copy_command(config, usrc, udst, force, recursive, p):
     """
     Copy COS file or directory to other COS local
     """
     try:
-        command.cos_mv_copy("copy", config, usrc, udst, force, recursive, p)
+        failed = command.cos_mv_copy(
+            "copy", config, usrc, udst, force, recursive, p
+        )
+        sys.exit(1 if failed else 0)
     except Exception as e:
         handle_exception(e, config.debug)
 
@@ -197,13 +350,17 @@ def copy_command(config, usrc, udst, force, recursive, p):
 @click.option("-s", is_flag=True,
               help="Display an entry for each specified file")
 @click.option("--human", "-h", is_flag=True, help="Enable human readable.")
+@click.option("--p", default=1, type=PARALLEL,
+              help="Use parallel recursive list")
+@click.option("--max-depth", type=click.IntRange(0),
+              help="Display directories at most this deep, the dir is 0.")
 @pass_config
-def du_command(config, uri, s, human):
+def du_command(config, uri, s, human, p, max_depth):
     """
     Displays sizes of files and directories contained in the given directory
     """
     try:
-        command.cos_du(config, uri, s, human)
+        command.cos_du(config, uri, s, human, p, max_depth)
     except Exception as e:
         handle_exception(e, config.debug)
 
@@ -226,3 +383,86 @@ def test_command(config, uri, d, e, f):
         sys.exit(0 if test else 1)
     except Exception as e:
         handle_exception(e, config.debug)
+
+
+def _read_batch(f):
+    """
+    读取 batch 文件, 每行一条命令, 忽略空行和 # 开头的注释
+    """
+    for lineno, line in enumerate(f, 1):
+        line = line.strip()
+        if line and not line.startswith("#"):
+            yield lineno, line
+
+
+def _exit_code(code):
+    """
+    SystemExit.code 转为退出码, 为字符串时是错误信息
+    """
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+
+    output(str(code).strip())
+    return 1
+
+
+def _batch_dispatch(ctx):
+    """
+    返回执行 batch 中一行命令的函数, 使用与命令行相同的参数解析,
+    共享已读取的配置
+    """
+    config = ctx.find_object(CliConfig)
+
+    def dispatch(line):
+        try:
+            args = shlex.split(line)
+        except ValueError as e:
+            # 引号不匹配等
+            output("Error: %s" % e)
+            return 2
+
+        try:
+            name = args[0]
+            cmd = cli.get_command(ctx, name)
+            if cmd is None or cmd is batch_command:
+                raise click.UsageError("No such command '%s'." % name)
+
+            with cmd.make_context(name, args[1:], parent=ctx) as sub_ctx:
+                cmd.invoke(sub_ctx)
+        except SystemExit as e:
+            return _exit_code(e.code)
+        except click.exceptions.Exit as e:
+            return e.exit_code
+        except click.ClickException as e:
+            output("Error: %s" % e.format_message())
+            return e.exit_code
+        except Exception as e:
+            if config.debug:
+                raise
+            output("Error: %s" % e)
+            return 1
+
+        return 0
+
+    return dispatch
+
+
+@cli.command(name="batch")
+@click.argument("src", type=click.File("r"), default="-")
+@click.option("--p", default=1, type=click.IntRange(1),
+              help="Run independent lines concurrently")
+@click.pass_context
+def batch_command(ctx, src, p):
+    """
+    Run coscli commands from a file (or stdin), one command per line
+    """
+    config = ctx.find_object(CliConfig)
+    try:
+        failed = command.cos_batch(
+            config, _read_batch(src), p, _batch_dispatch(ctx)
+        )
+        sys.exit(1 if failed else 0)
+    except Exception as e:
+        handle_exception(e, config.debug)
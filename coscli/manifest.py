@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sqlite3
+import threading
+
+from coscli.utils import ensure_dir_exists
+
+
+DEFAULT_MANIFEST = "~/.cache/coscli/sync.db"
+
+
+class SyncManifest(object):
+    """
+    sync 命令的本地状态, 记录每个已上传文件的 path, size, mtime 和 sha1
+
+    以 (bucket, cos path) 为 key, 本地文件路径, 大小和修改时间都没有变化时
+    认为文件没有改变, 不需要再上传
+    """
+
+    _schema = """
+        CREATE TABLE IF NOT EXISTS files (
+            bucket TEXT NOT NULL,
+            cos_path TEXT NOT NULL,
+            local_path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime REAL NOT NULL,
+            sha1 TEXT,
+            PRIMARY KEY (bucket, cos_path)
+        )
+    """
+
+    # 每记录这么多条提交一次, 中断时最多只需要重传这么多文件
+    _commit_every = 100
+
+    def __init__(self, path=DEFAULT_MANIFEST):
+        path = os.path.expanduser(path)
+        dirname = os.path.dirname(path)
+        if dirname:
+            ensure_dir_exists(dirname)
+
+        # Uploader 会在多个线程中记录, 访问都在 _lock 内
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.text_factory = str
+        self._conn.execute(self._schema)
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    def is_unchanged(self, bucket, cos_path, local_file, st=None):
+        """
+        本地文件自上次上传后是否没有变化
+
+        :param bucket: bucket name
+        :param cos_path: dest cos path
+        :param local_file: local file
+        :param st: 已经得到的本地文件 os.stat 结果, 为 None 时重新获取
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT local_path, size, mtime FROM files "
+                "WHERE bucket = ? AND cos_path = ?",
+                (bucket, cos_path)
+            ).fetchone()
+
+        if row is None:
+            return False
+
+        if st is None:
+            try:
+                st = os.stat(local_file)
+            except OSError:
+                return False
+
+        local_path, size, mtime = row
+        return (
+            local_path == os.path.abspath(local_file) and
+            size == st.st_size and
+            mtime == st.st_mtime
+        )
+
+    def record(self, bucket, cos_path, local_file, st, sha1):
+        """
+        记录一个上传成功的文件
+
+        :param st: 上传前本地文件的 os.stat 结果, 上传过程中文件被修改时
+                   下次 sync 仍会重新上传
+        :param sha1: 文件 sha1
+        """
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    bucket, cos_path, os.path.abspath(local_file),
+                    st.st_size, st.st_mtime, sha1
+                )
+            )
+            self._pending += 1
+            if self._pending >= self._commit_every:
+                self._conn.commit()
+                self._pending = 0
+
+    def close(self):
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
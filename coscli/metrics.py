@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import math
+import time
+import json
+import threading
+import contextlib
+
+
+class Histogram(object):
+    """
+    耗时分布, 按对数分桶, 占用内存固定, 分位数的误差在一个桶(约 10%)以内
+    """
+
+    _min = 0.0001
+    _base = 1.1
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        index = 0
+        if value > self._min:
+            index = int(math.log(value / self._min, self._base)) + 1
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, p):
+        """
+        :param p: 0 - 100
+        :return: 分位数所在桶的上界, 不超过最大值
+        """
+        if self.count == 0:
+            return 0.0
+
+        rank = max(1, int(math.ceil(self.count * p / 100.0)))
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(self.max, self._min * self._base ** index)
+
+        return self.max
+
+
+class OpStats(object):
+    """
+    一种 COS 请求或任务的统计
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.failed = 0
+        self.retries = 0
+        self.bytes = 0
+        self.latency = Histogram()
+
+    def to_dict(self):
+        latency = self.latency
+        return {
+            "requests": self.requests,
+            "failed": self.failed,
+            "retries": self.retries,
+            "bytes": self.bytes,
+            "latency": {
+                "mean": latency.total / latency.count if latency.count else 0,
+                "p50": latency.percentile(50),
+                "p95": latency.percentile(95),
+                "p99": latency.percentile(99),
+                "max": latency.max,
+            },
+        }
+
+
+class Metrics(object):
+    """
+    进程内所有 COS 请求和传输任务的统计, 包括请求数, 失败数, 传输字节数和耗时分布
+
+    COS 请求以操作名(stat, upload, download...)区分, 传输任务以 task. 开头.
+    有 parent 时为一次运行(如 batch 中的一行命令)的统计, 同时计入 parent
+    """
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        self._lock = threading.Lock()
+        self.start = time.time()
+        self.ops = {}
+        # 从连接池获取连接时复用和新建的次数
+        self.pool_hits = 0
+        self.pool_misses = 0
+
+    def _op(self, name):
+        stats = self.ops.get(name)
+        if stats is None:
+            stats = self.ops[name] = OpStats()
+        return stats
+
+    def request(self, op, latency, ok, nbytes=0):
+        """
+        记录一次请求
+
+        :param latency: 耗时, 秒
+        :param nbytes: 成功传输的字节数
+        """
+        with self._lock:
+            stats = self._op(op)
+            stats.requests += 1
+            if not ok:
+                stats.failed += 1
+            stats.bytes += nbytes
+            stats.latency.add(latency)
+
+        if self.parent is not None:
+            self.parent.request(op, latency, ok, nbytes)
+
+    def retry(self, op):
+        """
+        记录一次请求重试
+        """
+        with self._lock:
+            self._op(op).retries += 1
+
+        if self.parent is not None:
+            self.parent.retry(op)
+
+    def task(self, name, latency, ok):
+        """
+        记录一个传输任务, 如一个文件的上传
+        """
+        self.request("task." + name, latency, ok)
+
+    def connection(self, reused):
+        """
+        记录一次从连接池获取连接, reused 为是否复用了 keep-alive 连接
+        """
+        with self._lock:
+            if reused:
+                self.pool_hits += 1
+            else:
+                self.pool_misses += 1
+
+        if self.parent is not None:
+            self.parent.connection(reused)
+
+    def total_bytes(self):
+        with self._lock:
+            return sum(stats.bytes for stats in self.ops.values())
+
+    def total_retries(self):
+        with self._lock:
+            return sum(stats.retries for stats in self.ops.values())
+
+    def report(self, **extra):
+        """
+        :param extra: 其他需要写入报告的字段
+        :rtype dict
+        """
+        elapsed = time.time() - self.start
+        total_bytes = self.total_bytes()
+        with self._lock:
+            ops = dict(
+                (name, stats.to_dict()) for name, stats in self.ops.items()
+            )
+            pool = {"hits": self.pool_hits, "misses": self.pool_misses}
+
+        report = {
+            "elapsed": elapsed,
+            "bytes": total_bytes,
+            "throughput": total_bytes / elapsed if elapsed > 0 else 0,
+            "ops": ops,
+            "pool": pool,
+        }
+        report.update(extra)
+        return report
+
+    def write_report(self, path, **extra):
+        """
+        以 JSON 格式写入报告文件
+        """
+        with open(path, "w") as f:
+            json.dump(
+                self.report(**extra), f,
+                indent=2, sort_keys=True, separators=(",", ": ")
+            )
+            f.write("\n")
+
+
+metrics = Metrics()
+
+_local = threading.local()
+
+
+def current():
+    """
+    当前线程记录统计的 Metrics, 不在 scope 中时为进程的 metrics
+    """
+    return getattr(_local, "metrics", None) or metrics
+
+
+@contextlib.contextmanager
+def scope():
+    """
+    在当前线程中开始一次运行的统计, 返回新的 Metrics, 同时计入外层的统计
+    """
+    outer = getattr(_local, "metrics", None)
+    _local.metrics = Metrics(current())
+    try:
+        yield _local.metrics
+    finally:
+        _local.metrics = outer
+
+
+def inherit(func):
+    """
+    返回在调用线程的 Metrics 中执行 func 的函数, 作为工作线程的 target
+    """
+    recorder = current()
+
+    def run(*args, **kwargs):
+        _local.metrics = recorder
+        return func(*args, **kwargs)
+
+    return run
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import threading
+
+from requests import Session
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.connectionpool import (
+    HTTPConnectionPool, HTTPSConnectionPool
+)
+
+from coscli.metrics import current
+
+
+DEFAULT_POOL_SIZE = 64
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def open_pool(size=DEFAULT_POOL_SIZE):
+    """
+    同一进程中所有 COS 实例共享一个 ConnectionPool, 以第一次打开时的 size 为准
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(size)
+
+    return _pool
+
+
+def _get_conn(pool_cls):
+    def get_conn(self, timeout=None):
+        conn = pool_cls._get_conn(self, timeout)
+        # sock 为 None 时是新建或已断开的连接, 发送请求时需要重新建立连接
+        current().connection(getattr(conn, "sock", None) is not None)
+        return conn
+    return get_conn
+
+
+class _HTTPPool(HTTPConnectionPool):
+    _get_conn = _get_conn(HTTPConnectionPool)
+
+
+class _HTTPSPool(HTTPSConnectionPool):
+    _get_conn = _get_conn(HTTPSConnectionPool)
+
+
+_POOL_CLASSES = {
+    "http": _HTTPPool,
+    "https": _HTTPSPool,
+}
+
+
+class _ThrottledBody(object):
+    """
+    请求内容, 发送时每读取一块获取一次限速令牌
+    """
+
+    def __init__(self, data, limiter):
+        self._data = data
+        self._offset = 0
+        self._limiter = limiter
+
+    def __len__(self):
+        return len(self._data)
+
+    def read(self, size=-1):
+        start = self._offset
+        if size < 0:
+            self._offset = len(self._data)
+        else:
+            self._offset = min(len(self._data), start + size)
+
+        chunk = self._data[start:self._offset]
+        if chunk:
+            self._limiter.consume(len(chunk))
+        return chunk
+
+
+class _PoolAdapter(HTTPAdapter):
+
+    limiter = None
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(_PoolAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = _POOL_CLASSES
+
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        # 使用 HTTP_PROXY 等代理时连接由 ProxyManager 管理
+        manager = super(_PoolAdapter, self).proxy_manager_for(
+            proxy, **proxy_kwargs
+        )
+        manager.pool_classes_by_scheme = _POOL_CLASSES
+        return manager
+
+    def send(self, request, *args, **kwargs):
+        # Content-Length 已经设置, 文件对象会被按块读取发送
+        limiter = self.limiter
+        if limiter is not None and isinstance(request.body, str):
+            request.body = _ThrottledBody(request.body, limiter)
+        return super(_PoolAdapter, self).send(request, *args, **kwargs)
+
+
+class ConnectionPool(object):
+    """
+    所有 COS 实例和线程共享的 HTTP 会话, 连接保持 keep-alive, 请求结束后放回
+    连接池供其他线程复用, 避免每个线程, 每个命令都重新建立连接
+
+    每个 host 最多保留 size 个空闲连接, 并发超过 size 时不等待, 多出的连接
+    用完后关闭. 复用和新建连接的次数记录在 metrics 中
+    """
+
+    def __init__(self, size=DEFAULT_POOL_SIZE):
+        self.size = size
+
+        adapter = self._adapter = _PoolAdapter(pool_maxsize=size)
+        self.session = Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def limit(self, limiter):
+        """
+        上传的请求内容按块获取 limiter 的令牌, 而不是发送前一次获取
+        """
+        self._adapter.limiter = limiter
+
+    def attach(self, client):
+        """
+        替换 SDK 为每个 CosClient 单独创建的会话
+        """
+        client._http_session = self.session
+        client._file_op._http_session = self.session
+        client._folder_op._http_session = self.session
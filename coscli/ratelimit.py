@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import time
+import threading
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+_RATE_RE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([kKmMgG]?)[bB]?\s*$")
+_RATE_UNITS = {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+
+
+def parse_rate(value):
+    """
+    解析限速值, 如 500k, 10M, 1G, 单位为字节每秒, 0 表示不限速
+
+    :rtype int
+    """
+    m = _RATE_RE.match(str(value))
+    if m is None:
+        raise ValueError("invalid rate '%s', need like 500k, 10M" % value)
+
+    number, unit = m.groups()
+    return int(float(number) * _RATE_UNITS[unit.lower()])
+
+
+def open_limiter(rate=0, control_file=None):
+    """
+    同一进程中限速和控制文件都相同的 COS 实例共享一个 RateLimiter,
+    上传和下载共用同一限速. batch 中指定了不同限速的命令各自限速
+    """
+    path = control_file and os.path.abspath(os.path.expanduser(control_file))
+    key = (rate, path)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = _limiters[key] = RateLimiter(rate, path)
+
+    return limiter
+
+
+class RateLimiter(object):
+    """
+    令牌桶限速, 所有传输线程共享
+
+    允许令牌为负数: 一次请求的数据量大于桶容量时也可以发送, 之后的请求等待
+    补足欠下的令牌, 这样长时间的平均速度仍为 rate.
+
+    指定 control_file 时, 文件被修改后(最多每秒检查一次)使用其中的新限速,
+    可以在传输过程中调整, 如 echo 2M > control_file, 写入 0 时不限速
+    """
+
+    _check_interval = 1.0
+
+    def __init__(self, rate=0, control_file=None):
+        self.rate = rate
+        self.control_file = control_file
+
+        self._lock = threading.Lock()
+        self._tokens = float(rate)
+        self._last = time.time()
+        self._checked = 0
+        self._control_mtime = None
+
+        self._reload()
+
+    def _reload(self):
+        """
+        控制文件有修改时重新读取限速, 文件内容不正确时保持原限速
+        """
+        if self.control_file is None:
+            return
+
+        try:
+            mtime = os.stat(self.control_file).st_mtime
+            if mtime == self._control_mtime:
+                return
+            with open(self.control_file) as f:
+                rate = parse_rate(f.read())
+        except (OSError, IOError, ValueError):
+            return
+
+        self._control_mtime = mtime
+        if rate != self.rate:
+            self.rate = rate
+            self._tokens = min(self._tokens, float(rate))
+
+    def consume(self, nbytes):
+        """
+        获取 nbytes 字节的令牌, 超过限速时阻塞当前线程
+
+        前面的请求欠下的令牌补足后才能继续, 等待期间限速被修改时立即生效
+        """
+        while True:
+            with self._lock:
+                now = time.time()
+                if now - self._checked >= self._check_interval:
+                    self._checked = now
+                    self._reload()
+
+                # 桶容量为 1 秒的数据量
+                elapsed = now - self._last
+                self._last = now
+                if self.rate <= 0:
+                    self._tokens = 0.0
+                    return
+
+                self._tokens = min(
+                    float(self.rate), self._tokens + elapsed * self.rate
+                )
+                if self._tokens >= 0:
+                    self._tokens -= nbytes
+                    return
+
+                wait = -self._tokens / self.rate
+
+            time.sleep(min(wait, self._check_interval))
@@ -2,17 +2,471 @@
 # -*- coding: utf-8 -*-
 
 import os
+import sys
+import json
 import time
-
-from coscli.cos import COS
-from coscli.utils import ThreadWorker
+import hashlib
+import itertools
+import posixpath
+import threading
+
+from coscli.cos import COSObject, open_client, release_client, borrow_client
+from coscli.metrics import current
+from coscli.utils import ThreadWorker, Progress
+from coscli.utils import AdaptiveConcurrency, AUTO_PARALLEL
 from coscli.utils import ensure_dir_exists, COSUri
-from coscli.utils import output, format_size, sha1_checksum
+from coscli.utils import output_record, format_size, sha1_checksum
+
+
+UPLOAD_STATE_DIR = "~/.cache/coscli/uploads"
+
+
+def _concurrency(count):
+    """
+    count 为 auto 时根据吞吐量自动调整并发数, COS 请求重试视为过载
+    """
+    if count == AUTO_PARALLEL:
+        return AdaptiveConcurrency(pressure=current().total_retries)
+    return count
+
+
+class PutTask(tuple):
+    """
+    上传任务 (local_file, cos_dest), 附带扫描目录时得到的本地文件 stat 结果,
+    上传时不需要再次 stat
+    """
+
+    def __new__(cls, local_file, cos_dest, st=None):
+        task = tuple.__new__(cls, (local_file, cos_dest))
+        task.st = st
+        return task
+
+
+def _task_output(text, op, progress, src, dst, ok, msg):
+    """
+    输出一个任务的结果, text 为文本格式时的输出
+    """
+    output_record([
+        ("op", op),
+        ("progress", progress),
+        ("src", src),
+        ("dst", dst),
+        ("ok", ok),
+        ("message", msg),
+    ], text)
+
+
+def _task_stat(task):
+    st = getattr(task, "st", None)
+    if st is None:
+        st = os.stat(task[0])
+    return st
+
+
+class TaskError(Exception):
+    """
+    任务失败, 但不需要清理已有文件, 比如目标已经存在
+    """
+    pass
+
+
+class PartState(object):
+    """
+    分段下载的进度, 保存在本地文件旁的 sidecar 文件中, 用于中断后继续下载
+
+    COS 文件大小, 修改时间或 sha 变化时, 之前的进度作废
+    """
+
+    suffix = ".coscli-part"
+
+    def __init__(self, cos_obj, local_file, part_size):
+        self.path = local_file + self.suffix
+        self.part_size = part_size
+        self.meta = {
+            "path": cos_obj.path,
+            "filesize": cos_obj.filesize,
+            "mtime": cos_obj.mtime,
+            "sha": cos_obj.sha,
+            "part_size": part_size,
+        }
+        self.done = set()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def exists(cls, local_file):
+        return os.path.exists(local_file + cls.suffix)
+
+    def load(self):
+        """
+        读取之前的进度, 与当前 COS 文件一致时返回 True
+        """
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (IOError, ValueError):
+            return False
+
+        if state.get("meta") != self.meta:
+            return False
+
+        self.done = set(state.get("done", []))
+        return True
+
+    def parts(self):
+        """
+        所有分段 (index, start, end), end 包含在内
+        """
+        size = self.meta["filesize"]
+        for index, start in enumerate(xrange(0, size, self.part_size)):
+            yield index, start, min(start + self.part_size, size) - 1
+
+    def mark_done(self, index):
+        with self._lock:
+            self.done.add(index)
+            self.save()
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"meta": self.meta, "done": sorted(self.done)}, f)
+        os.rename(tmp, self.path)
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class SliceState(object):
+    """
+    分片上传的进度, 保存在本地缓存目录中, 用于中断后继续上传
+
+    本地文件大小或修改时间变化时, 之前的进度作废
+    """
+
+    def __init__(self, bucket, cos_dest, local_file, st, slice_size):
+        key = "%s\0%s\0%s" % (bucket, cos_dest, os.path.abspath(local_file))
+        if isinstance(key, unicode):
+            key = key.encode("utf-8")
+        self.path = os.path.join(
+            os.path.expanduser(UPLOAD_STATE_DIR),
+            hashlib.sha1(key).hexdigest() + ".json"
+        )
+        self.meta = {
+            "filesize": st.st_size,
+            "mtime": st.st_mtime,
+            "slice_size": slice_size,
+        }
+        self.session = None
+        self.done = set()
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        读取之前的进度, 与当前本地文件一致时返回 True
+        """
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (IOError, ValueError):
+            return False
+
+        if state.get("meta") != self.meta:
+            return False
+
+        self.session = state.get("session")
+        self.done = set(state.get("done", []))
+        return True
+
+    def mark_done(self, offset):
+        with self._lock:
+            self.done.add(offset)
+            self.save()
+
+    def save(self):
+        ensure_dir_exists(os.path.dirname(self.path))
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({
+                "meta": self.meta,
+                "session": self.session,
+                "done": sorted(self.done)
+            }, f)
+        os.rename(tmp, self.path)
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class SliceUpload(object):
+    """
+    一个大文件的分片上传, 分片作为独立任务与其他文件共享上传线程
+
+    分片由上传线程读取, 读取失败只影响这个文件. 读取时按 offset 顺序计算
+    sha1, 乱序完成的分片最多缓存 max_pending 字节, 超过时放弃, 校验时
+    重新读取文件. 生成方分发完所有分片和所有分片上传完成后, 最后结束的
+    一方负责合并文件并输出结果
+    """
+
+    max_pending = 64 * 1024 * 1024
+
+    def __init__(self, task, st, state, parallel):
+        self.task = task
+        self.st = st
+        self.state = state
+        self.error = None
+        self.start = time.time()
+        self.dispatched = False
+
+        self._offsets = iter(
+            xrange(0, st.st_size, state.meta["slice_size"])
+        )
+        # 未完成的分片数, 加上生成方自身
+        self._remain = 1
+        # 限制单个文件同时上传的分片数
+        self._parallel = parallel
+        self._running = 0
+        self._cond = threading.Condition()
+
+        self._sha1 = hashlib.sha1()
+        self._hashed = 0
+        self._pending = {}
+        self._pending_size = 0
+
+    def ready(self):
+        """
+        生成方分发可以上传的分片, 同时上传的分片数达到上限时返回, 不等待.
+        分发完所有分片后 dispatched 为 True
+        """
+        while not self.dispatched:
+            with self._cond:
+                if self._running >= self._parallel:
+                    return
+                offset = next(self._offsets, None)
+                if offset is not None:
+                    self._running += 1
+                    self._remain += 1
+
+            if offset is None:
+                self.dispatched = True
+                if self.slice_finished():
+                    yield SliceJob(self, None)
+                return
+            yield SliceJob(self, offset)
+
+    def wait(self):
+        """
+        等待有分片完成, 带超时保证可以响应 Ctrl-C
+        """
+        with self._cond:
+            if self._running >= self._parallel:
+                self._cond.wait(0.1)
+
+    def release(self):
+        with self._cond:
+            self._running -= 1
+            self._cond.notify_all()
+
+    def read(self, offset):
+        local_file = self.task[0]
+        size = min(self.state.meta["slice_size"], self.st.st_size - offset)
+
+        with open(local_file, "rb") as f:
+            f.seek(offset)
+            data = f.read(size)
+        if len(data) != size:
+            raise IOError("%s changed while uploading" % local_file)
+
+        self._hash(offset, data)
+        return data
+
+    def _hash(self, offset, data):
+        with self._cond:
+            if self._sha1 is None:
+                return
+
+            self._pending[offset] = data
+            self._pending_size += len(data)
+            while self._hashed in self._pending:
+                data = self._pending.pop(self._hashed)
+                self._sha1.update(data)
+                self._hashed += len(data)
+                self._pending_size -= len(data)
+
+            if self._pending_size > self.max_pending:
+                self._sha1 = None
+                self._pending.clear()
+
+    def hexdigest(self):
+        """
+        上传过程中计算的 sha1, 缓存超过上限放弃计算时返回 None
+        """
+        with self._cond:
+            if self._sha1 is None or self._hashed != self.st.st_size:
+                return None
+            return self._sha1.hexdigest()
+
+    def slice_finished(self, error=None):
+        """
+        一个分片结束, 返回是否是最后一个
+        """
+        with self._cond:
+            if error is not None and self.error is None:
+                self.error = error
+            self._remain -= 1
+            return self._remain == 0
+
+
+class SliceJob(object):
+    """
+    分片上传任务, offset 为 None 时只需要合并文件
+    """
+
+    def __init__(self, upload, offset):
+        self.upload = upload
+        self.offset = offset
+
+
+class OrderedHasher(object):
+    """
+    按 offset 顺序计算 sha1, 乱序完成的分段先缓存, 缓存的分段数不超过 slots
+
+    生成方在分发每个分段前调用 acquire, 分段计算 sha1 后释放
+    """
+
+    def __init__(self, slots):
+        self._sha1 = hashlib.sha1()
+        self._next = 0
+        self._pending = {}
+        self._failed = False
+        self._lock = threading.Lock()
+        self._slots = threading.Semaphore(slots)
+
+    def acquire(self):
+        self._slots.acquire()
+
+    def add(self, offset, data):
+        with self._lock:
+            if self._failed:
+                self._slots.release()
+                return
+
+            self._pending[offset] = data
+            while self._next in self._pending:
+                data = self._pending.pop(self._next)
+                self._sha1.update(data)
+                self._next += len(data)
+                self._slots.release()
+
+    def fail(self):
+        """
+        有分段失败时 sha1 已无法计算, 释放所有缓存, 之后的分段不再缓存
+        """
+        with self._lock:
+            self._failed = True
+            for _ in range(len(self._pending) + 1):
+                self._slots.release()
+            self._pending.clear()
+
+    def hexdigest(self):
+        return self._sha1.hexdigest()
+
+
+class DestListing(object):
+    """
+    目标目录下已存在的文件, 开始前列出一次, 之后检查目标是否存在时
+    不需要再逐个请求 COS
+
+    不列出时每个任务需要一次 stat 请求, 所以只在任务较多时列出, 列出的
+    请求数超过任务数的 max_ratio 时放弃, load 返回 None, 仍然逐个检查
+    """
+
+    # 任务数少于这个数时不列出
+    min_tasks = 8
+    # 流式的任务预先取出的最多任务数
+    max_count = 2000
+    # 列出请求数最多为任务数的这个比例
+    max_ratio = 0.25
+    # 一次列出请求最多返回的文件和目录数
+    page_size = 199
+
+    def __init__(self, objs):
+        self._objs = objs
+
+    @classmethod
+    def count(cls, tasks):
+        """
+        任务数, tasks 不是 list 时预先取出最多 max_count 个, 超过时只数到
+        max_count
+
+        :return: (任务数, tasks)
+        """
+        if isinstance(tasks, list):
+            return len(tasks), tasks
+
+        head = list(itertools.islice(tasks, cls.max_count))
+        return len(head), itertools.chain(head, tasks)
+
+    @classmethod
+    def load(cls, cos, bucket, dests, count):
+        """
+        :param dests: 目标路径, 列出它们共同的上级目录
+        :param count: 任务数
+        :rtype DestListing or None
+        """
+        if count < cls.min_tasks:
+            return None
+        max_requests = int(count * cls.max_ratio)
+
+        prefix = posixpath.dirname(posixpath.commonprefix(dests))
+        prefix = prefix.rstrip("/") + "/"
+
+        objs = {}
+        requests = 0
+        dirs = [prefix]
+        while dirs:
+            requests += 1
+            if requests > max_requests:
+                return None
+
+            listed = 0
+            for obj in cos.iter_path(bucket, dirs.pop()):
+                listed += 1
+                if listed % cls.page_size == 0:
+                    requests += 1
+                    if requests > max_requests:
+                        return None
+
+                if obj.is_dir:
+                    dirs.append(obj.path)
+                else:
+                    objs[obj.path] = obj
+
+        return cls(objs)
+
+    def get(self, path):
+        """
+        :rtype COSObject, 不存在时返回 None
+        """
+        return self._objs.get(path)
 
 
 class Uploader(object):
 
-    def __init__(self, config, bucket, tasks, force, checksum):
+    # 大于这么多个分片的文件使用分片上传, 读取分片时计算 sha1. 只有一个
+    # 线程时分片在调用线程中依次上传, 也不需要再读一次文件
+    slice_threshold = 8
+    # 同时分发分片的文件数上限
+    slice_files = 8
+
+    def __init__(self, config, bucket, tasks, force, checksum, manifest=None,
+                 slice_size=1024*1024, slice_parallel=None,
+                 checksum_cache=None, lazy_verify=False,
+                 skip_identical=False):
         self.cos_config = config.cos_config
         self.dry_run = config.dry_run
 
@@ -20,40 +474,195 @@ class Uploader(object):
         self.tasks = tasks
         self.force = force
         self.checksum = checksum
-
-    def simple_upload(self):
-        cos = COS(self.cos_config)
-
-        total = len(self.tasks)
-        for index, task in enumerate(self.tasks):
-            self._upload(total, index+1, cos, task)
-
-    def parallel_upload(self, count):
+        self.manifest = manifest
+        self.checksum_cache = checksum_cache
+        # 目标已存在且内容相同时跳过, 否则报错
+        self.skip_identical = skip_identical
+
+        self.slice_size = slice_size
+        self.slice_parallel = slice_parallel
+
+        # 上传响应中没有大小或 sha1 的文件, 全部上传完成后一起检查
+        self.lazy_verify = lazy_verify
+        self._unverified = []
+
+        self.dest_listing = None
+        self.progress = Progress()
+
+    def run(self, count, dest_dir=None):
+        """
+        使用 count 个线程上传, 大文件的分片与其他文件共享线程, 返回 WorkResult
+
+        :param dest_dir: 目标目录, tasks 不是 list 时用于预先列出目标
+        """
+        # 文件较多时预先列出目标目录, 不需要为每个文件检查目标是否存在
+        if not (self.force or self.dry_run):
+            ntask, self.tasks = DestListing.count(self.tasks)
+            if isinstance(self.tasks, list):
+                dests = [dest for _, dest in self.tasks]
+            else:
+                dests = [dest_dir] if dest_dir is not None else None
+            if dests:
+                with borrow_client(self.cos_config) as cos:
+                    self.dest_listing = DestListing.load(
+                        cos, self.bucket, dests, ntask
+                    )
 
         def setup():
-            return COS(self.cos_config)
+            return open_client(self.cos_config)
 
         def work(ctx, job):
             cos = ctx
-            _total, _index, _task = job
-            self._upload(_total, _index, cos, _task)
+            if isinstance(job, SliceJob):
+                return self._upload_slice(cos, job)
+            return self._upload(cos, job)
+
+        worker = ThreadWorker(_concurrency(count), setup=setup, work=work,
+                              teardown=release_client)
+        result = worker.run(self._jobs())
+        if self._unverified:
+            self._verify_later(result)
+
+        return result
+
+    def _jobs(self):
+        cos = None
+        threshold = self.slice_size * self.slice_threshold
+        uploads = []
+        try:
+            for task in self.progress.track(self.tasks):
+                local_file, cos_dest = task
+
+                # 文件无法访问时交给普通上传, 作为这个文件的错误输出
+                try:
+                    st = _task_stat(task)
+                except OSError:
+                    yield task
+                    continue
+
+                if self.dry_run or st.st_size <= threshold:
+                    yield task
+                    continue
+
+                if cos is None:
+                    cos = open_client(self.cos_config)
+
+                # 目标已存在或者分片初始化失败时, 交给普通上传处理
+                try:
+                    if not self.force:
+                        if self._dest_exists(cos, cos_dest):
+                            yield task
+                            continue
+                    upload = self._slice_init(cos, task, st)
+                except Exception:
+                    yield task
+                    continue
+
+                uploads.append(upload)
+                for job in self._slice_jobs(uploads, False):
+                    yield job
+                while len(uploads) > self.slice_files:
+                    for job in self._slice_jobs(uploads, True):
+                        yield job
+
+            while uploads:
+                for job in self._slice_jobs(uploads, True):
+                    yield job
+        finally:
+            if cos is not None:
+                release_client(cos)
+
+
+    @staticmethod
+    def _slice_jobs(uploads, wait):
+        """
+        分发各个文件可以上传的分片, 某个文件的分片达到上限时继续分发其他文件
+        和其他任务, 不阻塞共享的上传线程. wait 时如果没有分片可以分发,
+        等待最早的文件有分片完成
+        """
+        dispatched = False
+        for upload in list(uploads):
+            for job in upload.ready():
+                dispatched = True
+                yield job
+            if upload.dispatched:
+                uploads.remove(upload)
+
+        if wait and not dispatched and uploads:
+            uploads[0].wait()
+
+    def _slice_init(self, cos, task, st):
+        local_file, cos_dest = task
 
-        worker = ThreadWorker(count, setup=setup, work=work)
-        total = len(self.tasks)
-        for index, task in enumerate(self.tasks):
-            worker.add_job((total, index+1, task))
+        state = SliceState(
+            self.bucket, cos_dest, local_file, st, self.slice_size
+        )
+        resume = state.load()
 
-        worker.start()
+        session, slice_size, done = cos.slice_init(
+            self.bucket, cos_dest, st.st_size, self.slice_size
+        )
+        if slice_size != self.slice_size:
+            raise Exception("slice size %d not supported" % self.slice_size)
 
-    def _upload(self, total, index, cos, task):
-        sformat = "(%s/%s) upload: %s -> %s (%s)"
+        # 本地进度与 COS 的 session 一致时才继续. 本地文件变化后 COS 可能
+        # 仍返回同一 session, 其中的分片是旧内容, 需要全部重新上传
+        if resume and session == state.session:
+            state.done.update(done)
+        else:
+            state.done = set()
+        state.session = session
+        state.save()
+
+        return SliceUpload(
+            task, st, state, self.slice_parallel or sys.maxint
+        )
+
+    def _upload_slice(self, cos, job):
+        upload = job.upload
+        if job.offset is None:
+            return self._upload(cos, upload.task, upload)
+
+        local_file, cos_dest = upload.task
+
+        # 有分片失败时继续上传其他分片, 重新上传时需要的分片更少.
+        # 已上传的分片也需要读取, 用于计算 sha1
+        error = None
+        try:
+            data = upload.read(job.offset)
+            if job.offset not in upload.state.done:
+                cos.slice_data(
+                    self.bucket, cos_dest, upload.state.session,
+                    job.offset, data
+                )
+                upload.state.mark_done(job.offset)
+        except Exception as e:
+            error = e
+        finally:
+            data = None
+            upload.release()
+
+        if not upload.slice_finished(error):
+            return None
+
+        return self._upload(cos, upload.task, upload)
+
+    def _upload(self, cos, task, upload=None):
+        sformat = "(%s) upload: %s -> %s (%s)"
         local_file, cos_dest = task
+        start = upload.start if upload is not None else time.time()
 
+        ok = False
         try:
             if self.dry_run:
                 msg = "dry run"
+            elif upload is not None:
+                msg = self._finish_slices(cos, upload)
             else:
                 msg = self._do_upload(cos, task)
+            ok = True
+        except TaskError as e:
+            msg = str(e)
         except Exception as e:
             try:
                 cos.delete(self.bucket, cos_dest)
@@ -61,45 +670,189 @@ class Uploader(object):
                 pass
             msg = str(e)
 
-        output(sformat % (
-            index, total,
-            local_file, COSUri.compose_uri(self.bucket, cos_dest),
-            msg
-        ))
+        current().task("upload", time.time() - start, ok)
+        step = self.progress.step()
+        dest_uri = COSUri.compose_uri(self.bucket, cos_dest)
+        _task_output(
+            sformat % (step, local_file, dest_uri, msg),
+            "upload", step, local_file, dest_uri, ok, msg
+        )
+
+        return ok
 
     def _do_upload(self, cos, task):
         local_file, cos_dest = task
 
         if not self.force:
-            if cos.file_exists(self.bucket, cos_dest):
-                return "error: dest exists"
+            cos_obj = self._dest_obj(cos, cos_dest)
+            if cos_obj is not None:
+                if self._is_identical(cos_obj, local_file):
+                    return "skip identical"
+                raise TaskError("error: dest exists")
 
+        st = _task_stat(task)
         start = time.time()
-        cos.upload(self.bucket, cos_dest, local_file)
-        cost = time.time() - start
 
+        # 小文件读入内存, 上传的同时得到 sha1, COS 会校验上传内容
+        if st.st_size <= self.slice_size * self.slice_threshold:
+            with open(local_file, "rb") as f:
+                data = f.read()
+            local_sha1 = hashlib.sha1(data).hexdigest()
+            cos_obj = cos.upload_data(self.bucket, cos_dest, data, local_sha1)
+        else:
+            local_sha1 = None
+            cos_obj = cos.upload(self.bucket, cos_dest, local_file)
+
+        return self._verify(cos, task, st, start, local_sha1, cos_obj)
+
+    def _finish_slices(self, cos, upload):
+        local_file, cos_dest = upload.task
+
+        # 保留已上传的分片, 重新上传时继续
+        if upload.error is not None:
+            raise TaskError("error: %s, rerun to resume" % upload.error)
+
+        cos_obj = cos.slice_finish(
+            self.bucket, cos_dest, upload.state.session, upload.st.st_size
+        )
+        upload.state.remove()
+
+        return self._verify(
+            cos, upload.task, upload.st, upload.start,
+            upload.hexdigest(), cos_obj
+        )
+
+    def _local_sha1(self, local_file):
+        if self.checksum_cache is not None:
+            return self.checksum_cache.checksum(local_file)
+        return sha1_checksum(local_file)
+
+    def _dest_exists(self, cos, cos_dest):
+        if self.dest_listing is not None:
+            return self.dest_listing.get(cos_dest) is not None
+        return cos.file_exists(self.bucket, cos_dest)
+
+    def _dest_obj(self, cos, cos_dest):
+        """
+        已存在的目标文件, 不存在时返回 None. 只在需要比较 sha1 时请求 stat
+        """
+        if self.dest_listing is not None:
+            return self.dest_listing.get(cos_dest)
+
+        if not cos.file_exists(self.bucket, cos_dest):
+            return None
+        if self.skip_identical:
+            return cos.stat_file(self.bucket, cos_dest)
+        return COSObject(cos_dest)
+
+    def _is_identical(self, cos_obj, local_file):
+        """
+        COS 上已存在的文件与本地文件内容是否相同, 只在开启 skip_identical 时检查
+        """
+        if not self.skip_identical:
+            return False
+
+        if cos_obj.filesize != os.path.getsize(local_file):
+            return False
+
+        return self._local_sha1(local_file) == cos_obj.sha
+
+    def _verify(self, cos, task, st, start, local_sha1=None, cos_obj=None):
+        """
+        检查上传结果
+
+        :param local_sha1: 上传过程中计算的 sha1, 为 None 时需要重新读取文件
+        :param cos_obj: 上传响应得到的 COSObject, 缺少需要比较的字段时
+                        请求 stat, lazy_verify 时留到最后列出目录一起检查
+        """
+        local_file, cos_dest = task
+        cost = time.time() - start
         local_size = os.path.getsize(local_file)
-        cos_obj = cos.stat_file(self.bucket, cos_dest)
-        if local_size != cos_obj.filesize:
-            raise Exception("error: file size not match")
 
-        if self.checksum:
-            local_sha1 = sha1_checksum(local_file)
-            if local_sha1 != cos_obj.sha:
-                raise Exception("error: sha1 checksum not match")
+        if cos_obj is None or cos_obj.filesize is None or (
+                self.checksum and cos_obj.sha is None):
+            cos_obj = None
+
+        if cos_obj is None and self.lazy_verify:
+            self._unverified.append((task, st, local_sha1))
+            suffix = ", verify later"
+        else:
+            if cos_obj is None:
+                cos_obj = cos.stat_file(self.bucket, cos_dest)
+            self._check(task, st, local_sha1, cos_obj)
+            suffix = ""
 
         speed = local_size / cost
         value, coeff = format_size(speed, human_readable=True)
-        msg = "%d bytes in %0.1f seconds, %0.2f%sB/s" % (
-            local_size, cost, value, coeff
+        msg = "%d bytes in %0.1f seconds, %0.2f%sB/s%s" % (
+            local_size, cost, value, coeff, suffix
         )
 
         return msg
 
+    def _check(self, task, st, local_sha1, cos_obj):
+        """
+        比较本地文件与 COS 文件的大小和 sha1, 一致时记录 sha1
+        """
+        local_file, cos_dest = task
+
+        if os.path.getsize(local_file) != cos_obj.filesize:
+            raise Exception("error: file size not match")
+
+        if self.checksum:
+            if local_sha1 is None:
+                local_sha1 = self._local_sha1(local_file)
+            if local_sha1 != cos_obj.sha:
+                raise Exception("error: sha1 checksum not match")
+
+        if self.checksum_cache is not None and local_sha1 is not None:
+            self.checksum_cache.store(st, local_sha1)
+
+        if self.manifest is not None:
+            # SDK 上传的响应中可能没有 sha, 优先记录本地计算的 sha1
+            self.manifest.record(
+                self.bucket, cos_dest, local_file, st,
+                local_sha1 if local_sha1 is not None else cos_obj.sha
+            )
+
+    def _verify_later(self, result):
+        """
+        列出一次目标目录, 检查上传时没有校验的文件, 失败的文件删除并计为失败
+        """
+        sformat = "verify: %s -> %s (%s)"
+
+        with borrow_client(self.cos_config) as cos:
+            dests = [task[1] for task, _, _ in self._unverified]
+            listing = DestListing.load(cos, self.bucket, dests, len(dests))
+
+            for task, st, local_sha1 in self._unverified:
+                local_file, cos_dest = task
+                try:
+                    if listing is not None:
+                        cos_obj = listing.get(cos_dest)
+                        if cos_obj is None:
+                            raise Exception("error: not found after upload")
+                    else:
+                        cos_obj = cos.stat_file(self.bucket, cos_dest)
+                    self._check(task, st, local_sha1, cos_obj)
+                except Exception as e:
+                    try:
+                        cos.delete(self.bucket, cos_dest)
+                    except Exception:
+                        pass
+                    result.revoke(task, e)
+                    dest_uri = COSUri.compose_uri(self.bucket, cos_dest)
+                    _task_output(
+                        sformat % (local_file, dest_uri, e),
+                        "verify", None, local_file, dest_uri, False, str(e)
+                    )
+
 
 class Downloader(object):
 
-    def __init__(self, config, bucket, tasks, force, skip, checksum):
+    def __init__(self, config, bucket, tasks, force, skip, checksum,
+                 parts=1, part_size=16*1024*1024, checksum_cache=None,
+                 skip_identical=False):
         self.cos_config = config.cos_config
         self.dry_run = config.dry_run
 
@@ -108,67 +861,86 @@ class Downloader(object):
         self.force = force
         self.skip = skip
         self.checksum = checksum
+        self.checksum_cache = checksum_cache
+        # 本地文件已存在且内容相同时跳过, 否则报错
+        self.skip_identical = skip_identical
 
-    def simple_download(self):
-        cos = COS(self.cos_config)
+        # 大于 part_size 的文件分成多段, 使用 parts 个线程并行下载
+        self.parts = parts
+        self.part_size = part_size
 
-        total = len(self.tasks)
-        for index, task in enumerate(self.tasks):
-            self._download(total, index+1, cos, task)
+        self.progress = Progress()
 
-    def parallel_download(self, count):
+    def run(self, count):
+        """
+        使用 count 个线程下载, 返回 WorkResult
+        """
 
         def setup():
-            return COS(self.cos_config)
+            return open_client(self.cos_config)
 
         def work(ctx, job):
             cos = ctx
-            _total, _index, _task = job
-            self._download(_total, _index, cos, _task)
+            return self._download(cos, job)
 
-        worker = ThreadWorker(count, setup=setup, work=work)
-        total = len(self.tasks)
-        for index, task in enumerate(self.tasks):
-            worker.add_job((total, index+1, task))
+        worker = ThreadWorker(_concurrency(count), setup=setup, work=work,
+                              teardown=release_client)
+        return worker.run(self.progress.track(self.tasks))
 
-        worker.start()
-
-    def _download(self, total, index, cos, task):
-        sformat = "(%s/%s) download: %s -> %s (%s)"
+    def _download(self, cos, task):
+        sformat = "(%s) download: %s -> %s (%s)"
         cos_obj, local_file = task
+        start = time.time()
 
+        ok = False
         try:
             if self.dry_run:
                 msg = "dry run"
             else:
                 msg = self._do_download(cos, task)
+            ok = True
+        except TaskError as e:
+            msg = str(e)
         except Exception as e:
-            try:
-                os.remove(local_file)
-            except OSError:
-                pass
+            # 分段下载保留已下载的部分, 重新下载时继续
+            if not PartState.exists(local_file):
+                try:
+                    os.remove(local_file)
+                except OSError:
+                    pass
             msg = str(e)
 
-        output(sformat % (
-            index, total,
-            COSUri.compose_uri(self.bucket, cos_obj.path), local_file,
-            msg
-        ))
+        current().task("download", time.time() - start, ok)
+        step = self.progress.step()
+        src_uri = COSUri.compose_uri(self.bucket, cos_obj.path)
+        _task_output(
+            sformat % (step, src_uri, local_file, msg),
+            "download", step, src_uri, local_file, ok, msg
+        )
+
+        return ok
 
     def _do_download(self, cos, task):
         cos_obj, local_file = task
 
-        if os.path.exists(local_file):
+        ranged = cos_obj.filesize > self.part_size
+        resume = ranged and PartState.exists(local_file)
+        if os.path.exists(local_file) and not resume:
             if self.skip:
                 return "skip exists"
             if not self.force:
-                return "error: local file exists"
+                if self._is_identical(cos_obj, local_file):
+                    return "skip identical"
+                raise TaskError("error: local file exists")
 
         dirname = os.path.dirname(local_file)
         ensure_dir_exists(dirname)
 
         start = time.time()
-        cos.download(self.bucket, cos_obj.path, local_file)
+        if ranged:
+            local_sha1 = self._range_download(cos_obj, local_file)
+        else:
+            local_sha1 = self._small_download(cos, cos_obj, local_file)
         cost = time.time() - start
 
         local_size = os.path.getsize(local_file)
@@ -176,10 +948,12 @@ class Downloader(object):
             raise Exception("error: file size not match")
 
         if self.checksum:
-            local_sha1 = sha1_checksum(local_file)
             if local_sha1 != cos_obj.sha:
                 raise Exception("error: sha1 checksum not match")
 
+        if self.checksum_cache is not None:
+            self.checksum_cache.store(os.stat(local_file), local_sha1)
+
         speed = local_size / cost
         speed_fmt = format_size(speed, human_readable=True)
         msg = "%d bytes in %0.1f seconds, %0.2f%sB/s" % (
@@ -188,6 +962,100 @@ class Downloader(object):
 
         return msg
 
+    def _is_identical(self, cos_obj, local_file):
+        """
+        本地已存在的文件与 COS 文件内容是否相同, 只在开启 skip_identical 时检查
+        """
+        if not self.skip_identical:
+            return False
+
+        if os.path.getsize(local_file) != cos_obj.filesize:
+            return False
+
+        if self.checksum_cache is not None:
+            local_sha1 = self.checksum_cache.checksum(local_file)
+        else:
+            local_sha1 = sha1_checksum(local_file)
+
+        return local_sha1 == cos_obj.sha
+
+    def _small_download(self, cos, cos_obj, local_file):
+        """
+        下载小文件, 写入的同时计算 sha1
+        """
+        data = ""
+        if cos_obj.filesize > 0:
+            data = cos.download_range(
+                self.bucket, cos_obj.path, 0, cos_obj.filesize - 1
+            )
+
+        with open(local_file, "wb") as f:
+            f.write(data)
+
+        return hashlib.sha1(data).hexdigest()
+
+    def _range_download(self, cos_obj, local_file):
+        """
+        分段并行下载到预先分配好大小的本地文件, 写入的同时计算 sha1
+        """
+        state = PartState(cos_obj, local_file, self.part_size)
+        if not (state.load() and os.path.exists(local_file)):
+            state.done = set()
+            with open(local_file, "wb") as f:
+                f.truncate(cos_obj.filesize)
+            state.save()
+
+        parallel = max(1, self.parts)
+        hasher = OrderedHasher(parallel + 2)
+
+        def setup():
+            return open_client(self.cos_config), open(local_file, "r+b")
+
+        def teardown(ctx):
+            cos, f = ctx
+            f.close()
+            release_client(cos)
+
+        def work(ctx, job):
+            cos, f = ctx
+            index, start, end = job
+            try:
+                data = cos.download_range(
+                    self.bucket, cos_obj.path, start, end
+                )
+                f.seek(start)
+                f.write(data)
+                f.flush()
+            except Exception:
+                hasher.fail()
+                raise
+            state.mark_done(index)
+            hasher.add(start, data)
+
+        def jobs():
+            # 按顺序生成分段, 之前已经下载的分段从本地文件读取计算 sha1
+            with open(local_file, "rb") as f:
+                for index, start, end in state.parts():
+                    hasher.acquire()
+                    if index in state.done:
+                        f.seek(start)
+                        hasher.add(start, f.read(end - start + 1))
+                    else:
+                        yield index, start, end
+
+        worker = ThreadWorker(parallel, setup=setup, work=work,
+                              teardown=teardown)
+        result = worker.run(jobs())
+        if result.failed:
+            raise TaskError(
+                "error: %d parts failed, %s, rerun to resume" % (
+                    result.failed, result.errors[0][1]
+                )
+            )
+
+        state.remove()
+        return hasher.hexdigest()
+
 
 class Deleter(object):
 
@@ -198,51 +1066,48 @@ class Deleter(object):
         self.bucket = bucket
         self.tasks = tasks
 
-    def simple_delete(self):
-        cos = COS(self.cos_config)
-
-        total = len(self.tasks)
-        for index, task in enumerate(self.tasks):
-            self._delete(total, index+1, cos, task)
+        self.progress = Progress()
 
-    def parallel_delete(self, count):
+    def run(self, count):
+        """
+        使用 count 个线程删除, 返回 WorkResult
+        """
 
         def setup():
-            return COS(self.cos_config)
+            return open_client(self.cos_config)
 
         def work(ctx, job):
             cos = ctx
-            _total, _index, _task = job
-            self._delete(_total, _index, cos, _task)
-
-        worker = ThreadWorker(count, setup=setup, work=work)
-        total = len(self.tasks)
-        for index, task in enumerate(self.tasks):
-            worker.add_job((total, index+1, task))
+            return self._delete(cos, job)
 
-        worker.start()
+        worker = ThreadWorker(_concurrency(count), setup=setup, work=work,
+                              teardown=release_client)
+        return worker.run(self.progress.track(self.tasks))
 
-    def _delete(self, total, index, cos, task):
+    def _delete(self, cos, task):
         cos_path = task
+        uri = COSUri.compose_uri(self.bucket, cos_path)
 
         try:
             if self.dry_run:
-                output("(%s/%s) deleted: %s (dry run)" % (
-                    index, total,
-                    COSUri.compose_uri(self.bucket, cos_path)
-                ))
+                step = self.progress.step()
+                text = "(%s) deleted: %s (dry run)" % (step, uri)
+                msg = "dry run"
             else:
                 cos.delete(self.bucket, cos_path)
-                output("(%s/%s) deleted: %s" % (
-                    index, total,
-                    COSUri.compose_uri(self.bucket, cos_path)
-                ))
+                step = self.progress.step()
+                text = "(%s) deleted: %s" % (step, uri)
+                msg = "ok"
         except Exception as e:
-            output("(%s/%s) delete: %s (%s)" % (
-                index, total,
-                COSUri.compose_uri(self.bucket, cos_path),
-                str(e)
-            ))
+            step = self.progress.step()
+            _task_output(
+                "(%s) delete: %s (%s)" % (step, uri, e),
+                "delete", step, uri, None, False, str(e)
+            )
+            return False
+
+        _task_output(text, "delete", step, uri, None, True, msg)
+        return True
 
 
 class MoveCopyer(object):
@@ -257,62 +1122,74 @@ class MoveCopyer(object):
         self.tasks = tasks
         self.force = force
 
-    def simple_move_copy(self):
-        cos = COS(self.cos_config)
+        self.dest_listing = None
+        self.progress = Progress()
 
-        total = len(self.tasks)
-        for index, task in enumerate(self.tasks):
-            self._move_copy(total, index+1, cos, task)
+    def run(self, count, dest_dir=None):
+        """
+        使用 count 个线程移动或拷贝, 返回 WorkResult
 
-    def parallel_move_copy(self, count):
+        :param dest_dir: 目标目录, 任务较多时预先列出, 不需要逐个检查目标
+                         是否存在
+        """
+        if not (self.force or self.dry_run) and dest_dir is not None:
+            ntask, self.tasks = DestListing.count(self.tasks)
+            with borrow_client(self.cos_config) as cos:
+                self.dest_listing = DestListing.load(
+                    cos, self.bucket, [dest_dir], ntask
+                )
 
         def setup():
-            return COS(self.cos_config)
+            return open_client(self.cos_config)
 
         def work(ctx, job):
             cos = ctx
-            _total, _index, _task = job
-            self._move_copy(_total, _index, cos, _task)
-
-        worker = ThreadWorker(count, setup=setup, work=work)
-        total = len(self.tasks)
-        for index, task in enumerate(self.tasks):
-            worker.add_job((total, index+1, task))
+            return self._move_copy(cos, job)
 
-        worker.start()
+        worker = ThreadWorker(_concurrency(count), setup=setup, work=work,
+                              teardown=release_client)
+        return worker.run(self.progress.track(self.tasks))
 
-    def _move_copy(self, total, index, cos, task):
-        sformat = "(%s/%s) %s: %s -> %s (%s)"
+    def _move_copy(self, cos, task):
+        sformat = "(%s) %s: %s -> %s (%s)"
         cos_src, cos_dest = task
 
+        ok = False
         try:
             if self.dry_run:
                 msg = "dry run"
             else:
                 msg = self._do_move_copy(cos, task)
+            ok = True
         except Exception as e:
             msg = str(e)
 
-        output(sformat % (
-            index, total,
-            self.action,
-            COSUri.compose_uri(self.bucket, cos_src),
-            COSUri.compose_uri(self.bucket, cos_dest),
-            msg
-        ))
+        step = self.progress.step()
+        src_uri = COSUri.compose_uri(self.bucket, cos_src)
+        dest_uri = COSUri.compose_uri(self.bucket, cos_dest)
+        _task_output(
+            sformat % (step, self.action, src_uri, dest_uri, msg),
+            self.action, step, src_uri, dest_uri, ok, msg
+        )
+
+        return ok
 
     def _do_move_copy(self, cos, task):
         cos_src, cos_dest = task
 
         if not self.force:
-            if cos.file_exists(self.bucket, cos_dest):
-                return "error: dest exists"
+            if self.dest_listing is not None:
+                exists = self.dest_listing.get(cos_dest) is not None
+            else:
+                exists = cos.file_exists(self.bucket, cos_dest)
+            if exists:
+                raise TaskError("error: dest exists")
 
         if self.action == "mv":
             cos.move(self.bucket, cos_src, cos_dest)
         elif self.action == "copy":
             cos.copy(self.bucket, cos_src, cos_dest)
         else:
-            return "error: unkown op"
+            raise TaskError("error: unkown op")
 
         return "ok"
@@ -2,17 +2,189 @@
 # -*- coding: utf-8 -*-
 
 import re
+import csv
+import sys
+import json
+import stat
 import click
 import errno
 import Queue
+import time
+import atexit
 import hashlib
 import os.path
 import datetime
 import threading
+import collections
+
+from coscli.metrics import inherit
+
+# Python3.5+ 自带 os.scandir, Python2 可以安装 scandir 包, 都没有时使用 listdir
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+OUTPUT_FORMATS = ("text", "jsonl", "tsv", "csv")
+
+
+class OutputWriter(object):
+    """
+    标准输出的唯一写入方
+
+    - 多个线程同时输出时以整行写入, 不会交错
+    - 输出到终端时每行立即写入, 否则按块缓冲, 超过 flush_interval 秒也会写入
+    - jsonl/tsv/csv 格式时标准输出只有记录, 其他信息输出到标准错误
+    """
+
+    buffer_size = 256 * 1024
+    flush_interval = 1.0
+
+    def __init__(self, stream=None, fmt="text"):
+        self.stream = stream or sys.stdout
+        self.format = fmt
+
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._buffered = 0
+        self._last_flush = time.time()
+        self._header = False
+        self._line_buffered = self._isatty()
+
+    def _isatty(self):
+        try:
+            return self.stream.isatty()
+        except Exception:
+            return False
+
+    @staticmethod
+    def _text(value):
+        if value is None:
+            return ""
+        if isinstance(value, unicode):
+            return value.encode("utf-8")
+        return str(value)
+
+    def _format_csv(self, values):
+        line = _CSVLine()
+        csv.writer(line, lineterminator="").writerow(
+            [self._text(v) for v in values]
+        )
+        return line.value
+
+    def _format(self, fields):
+        if self.format == "jsonl":
+            return json.dumps(
+                collections.OrderedDict(fields),
+                separators=(",", ":")
+            )
+
+        values = [value for _, value in fields]
+        if self.format == "csv":
+            return self._format_csv(values)
+
+        # tsv 中的 tab 和换行无法转义, 替换为空格
+        return "\t".join(
+            re.sub(r"[\t\r\n]", " ", self._text(v)) for v in values
+        )
+
+    def message(self, info):
+        """
+        输出非记录的信息, 如汇总
+        """
+        if self.format == "text":
+            self.write(info)
+        else:
+            self.flush()
+            click.echo(info, err=True)
+
+    def record(self, fields, text):
+        """
+        输出一条记录
+
+        :param fields: [(name, value)], 结构化格式中的字段和顺序
+        :param text: text 格式时输出的内容
+        """
+        if self.format == "text":
+            self.write(text)
+            return
+
+        line = self._format(fields)
+        with self._lock:
+            if self.format == "csv" and not self._header:
+                self._header = True
+                self._append(self._format_csv([name for name, _ in fields]))
+            self._append(line)
+
+    def write(self, line):
+        with self._lock:
+            self._append(line)
+
+    def _append(self, line):
+        if isinstance(line, unicode):
+            line = line.encode("utf-8")
+        self._buffer.append(line)
+        self._buffer.append("\n")
+        self._buffered += len(line) + 1
+
+        if (self._line_buffered or self._buffered >= self.buffer_size or
+                time.time() - self._last_flush >= self.flush_interval):
+            self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if self._buffer:
+            self.stream.write("".join(self._buffer))
+            self._buffer = []
+            self._buffered = 0
+        self.stream.flush()
+        self._last_flush = time.time()
+
+
+class _CSVLine(object):
+    """
+    csv.writer 需要一个有 write 方法的对象
+    """
+
+    def __init__(self):
+        self.value = ""
+
+    def write(self, data):
+        self.value += data
+
+
+_writer = OutputWriter()
+atexit.register(lambda: _writer.flush())
+
+
+def set_output_format(fmt):
+    """
+    设置输出格式, 需要在输出之前调用
+    """
+    global _writer
+    _writer.flush()
+    _writer = OutputWriter(fmt=fmt)
 
 
 def output(info):
-    click.echo(info)
+    _writer.message(info)
+
+
+def output_record(fields, text):
+    """
+    输出一条记录, 如 ls 的一个文件或一个文件的上传结果
+
+    :param fields: [(name, value)], jsonl/tsv/csv 格式中的字段和顺序
+    :param text: text 格式时输出的内容
+    """
+    _writer.record(fields, text)
 
 
 class COSUri(object):
@@ -79,22 +251,133 @@ def list_dir_files(path):
     List all files in give directory
     :param path: directory
     """
-    listdir_names = os.listdir(path)
-    names = []
-    for name in listdir_names:
-        file_path = os.path.join(path, name)
-        if os.path.isdir(file_path):
-            name = name + os.path.sep
-        names.append(name)
+    for file_path, _ in scan_dir_files(path):
+        yield file_path
+
+
+def _scan_entries(path):
+    """
+    列出目录下一层, 返回 [(排序 key, path, stat)], 目录的 stat 为 None.
+    使用 scandir 时文件类型来自目录项, 不需要再 isdir/isfile
+    """
+    entries = []
+    if scandir is not None:
+        for entry in scandir(path):
+            try:
+                if entry.is_dir():
+                    entries.append((entry.name + "/", entry.path, None))
+                elif entry.is_file():
+                    entries.append((entry.name, entry.path, entry.stat()))
+            except OSError:
+                # 列出后被删除或者是无效的链接
+                continue
+    else:
+        for name in os.listdir(path):
+            file_path = os.path.join(path, name)
+            try:
+                st = os.stat(file_path)
+            except OSError:
+                continue
+            if stat.S_ISDIR(st.st_mode):
+                entries.append((name + "/", file_path, None))
+            elif stat.S_ISREG(st.st_mode):
+                entries.append((name, file_path, st))
+
+    return entries
+
+
+def scan_dir_files(path, nworker=1):
+    """
+    递归列出目录下所有文件, 边扫描边返回 (file_path, stat)
+
+    - nworker 为 1 时按名字排序, 深度优先
+    - 否则使用 nworker 个线程同时扫描多个子目录, 按扫描完成的顺序返回
+
+    :param path: directory
+    """
+    if nworker > 1:
+        return _scan_parallel(path, nworker)
+    return _scan_ordered(path)
+
+
+def _scan_ordered(path):
+    for _, file_path, st in sorted(_scan_entries(path)):
+        if st is None:
+            for item in _scan_ordered(file_path):
+                yield item
+        else:
+            yield file_path, st
+
 
-    names.sort(key=lambda item: item.replace(os.sep, "/"))
-    for name in names:
-        file_path = os.path.join(path, name)
-        if os.path.isdir(file_path):
-            for x in list_dir_files(file_path):
-                yield x
-        elif os.path.isfile(file_path):
-            yield file_path
+def _scan_parallel(path, nworker):
+    dirs = Queue.Queue()
+    results = Queue.Queue(maxsize=64)
+    stop = threading.Event()
+    lock = threading.Lock()
+    pending = [1]
+
+    def put_result(item):
+        # 调用方提前结束迭代时不能一直阻塞在满的队列上
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=0.1)
+                return
+            except Queue.Full:
+                pass
+
+    def work():
+        while True:
+            dir_path = dirs.get()
+            if dir_path is None or stop.is_set():
+                return
+
+            try:
+                entries = _scan_entries(dir_path)
+            except Exception as e:
+                put_result(e)
+                return
+
+            files = []
+            for _, file_path, st in entries:
+                if st is None:
+                    with lock:
+                        pending[0] += 1
+                    dirs.put(file_path)
+                else:
+                    files.append((file_path, st))
+            put_result(files)
+
+            with lock:
+                pending[0] -= 1
+                finished = pending[0] == 0
+            if finished:
+                put_result(_SENTINEL)
+                return
+
+    dirs.put(path)
+    threads = []
+    for i in range(nworker):
+        thread = threading.Thread(target=work)
+        thread.daemon = True
+        threads.append(thread)
+        thread.start()
+
+    try:
+        while True:
+            item = results.get()
+            if item is _SENTINEL:
+                return
+            if isinstance(item, Exception):
+                raise item
+            for file_item in item:
+                yield file_item
+    finally:
+        # 通知等待目录的线程退出
+        stop.set()
+        for thread in threads:
+            dirs.put(None)
+        for thread in threads:
+            thread.join()
 
 
 def sha1_checksum(filepath):
@@ -112,39 +395,319 @@ def sha1_checksum(filepath):
     return sha1.hexdigest()
 
 
+class Progress(object):
+    """
+    流式任务的进度, 输出为 "已完成/已发现", 列出未结束时带 "+" 后缀
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.done = 0
+        self.found = 0
+        self.listed = False
+
+    def track(self, jobs):
+        """
+        迭代 jobs 并统计已发现的任务数
+        """
+        if isinstance(jobs, list):
+            self.found = len(jobs)
+            self.listed = True
+            for job in jobs:
+                yield job
+            return
+
+        for job in jobs:
+            self.found += 1
+            yield job
+        self.listed = True
+
+    def step(self):
+        """
+        完成一个任务, 返回进度描述
+        """
+        with self._lock:
+            self.done += 1
+            return "%d/%d%s" % (
+                self.done, self.found, "" if self.listed else "+"
+            )
+
+
+class WorkResult(object):
+    """
+    ThreadWorker 执行结果汇总
+    """
+
+    # 最多保留的失败任务数, 避免大量失败时占用过多内存
+    max_errors = 100
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.succeeded = 0
+        self.failed = 0
+        self.errors = []
+        # 自动并发时最终选择的并发数
+        self.concurrency = None
+
+    def add(self, job, ok, error=None):
+        with self._lock:
+            if ok:
+                self.succeeded += 1
+                return
+
+            self.failed += 1
+            if len(self.errors) < self.max_errors:
+                self.errors.append((job, error))
+
+    def revoke(self, job, error):
+        """
+        已经计为成功的任务之后检查失败, 改为失败
+        """
+        with self._lock:
+            self.succeeded -= 1
+        self.add(job, False, error)
+
+    def __str__(self):
+        return "%d succeeded, %d failed" % (self.succeeded, self.failed)
+
+
+# --p auto, 自动调整并发数
+AUTO_PARALLEL = "auto"
+
+
+class AdaptiveConcurrency(object):
+    """
+    根据吞吐量和错误自动调整同时执行的任务数 (AIMD)
+
+    - 每个采样周期内每秒完成的任务数作为吞吐量, 比上一周期上升时增加并发数,
+      开始时翻倍增加, 吞吐量第一次不再上升或减少过并发数后每次加 1
+    - 周期内失败和限流重试超过任务数的 max_error_ratio, 或耗时中位数超过
+      历史最低值 latency_factor 倍时并发数减半
+
+    :param pressure: 返回累计限流/重试次数的函数, 增加的次数计为出错
+    """
+
+    interval = 1.0
+    latency_factor = 2.0
+    max_error_ratio = 0.1
+    # 吞吐量上升超过这个比例才继续增加并发
+    min_gain = 0.05
+
+    def __init__(self, min_workers=2, max_workers=32, pressure=None):
+        self.min_workers = min_workers
+        self.max_workers = max(min_workers, max_workers)
+        self.limit = min_workers
+        self._pressure = pressure
+        self._slow_start = True
+
+        self._cond = threading.Condition()
+        self._active = 0
+        self._last_throughput = 0.0
+        self._base_latency = None
+        self._reset_window(time.time())
+
+    def _reset_window(self, now):
+        self._window_start = now
+        self._latencies = []
+        self._errors = 0
+        self._pressure_seen = self._pressure() if self._pressure else 0
+
+    def acquire(self):
+        """
+        正在执行的任务数达到当前并发数时等待
+        """
+        with self._cond:
+            while self._active >= self.limit:
+                self._cond.wait()
+            self._active += 1
+
+    def release(self, latency=None, ok=True):
+        """
+        任务完成, 记录耗时和是否成功, 并在采样周期结束时调整并发数.
+        latency 为 None 时表示没有执行任务, 如线程退出
+        """
+        with self._cond:
+            self._active -= 1
+            if latency is not None:
+                self._latencies.append(latency)
+                if not ok:
+                    self._errors += 1
+
+                now = time.time()
+                elapsed = now - self._window_start
+                if elapsed >= self.interval:
+                    self._adjust(elapsed)
+                    self._reset_window(now)
+
+            self._cond.notify_all()
+
+    def _adjust(self, elapsed):
+        done = len(self._latencies)
+        throughput = done / elapsed
+        latency = sorted(self._latencies)[done // 2]
+
+        errors = self._errors
+        if self._pressure:
+            errors += self._pressure() - self._pressure_seen
+
+        if (errors > done * self.max_error_ratio or
+                (self._base_latency is not None and
+                 latency > self._base_latency * self.latency_factor)):
+            self.limit = max(self.min_workers, self.limit // 2)
+            self._slow_start = False
+            self._last_throughput = 0.0
+            return
+
+        if throughput > self._last_throughput * (1 + self.min_gain):
+            step = self.limit if self._slow_start else 1
+            self.limit = min(self.max_workers, self.limit + step)
+        else:
+            self._slow_start = False
+
+        if self._base_latency is None or latency < self._base_latency:
+            self._base_latency = latency
+        self._last_throughput = throughput
+
+
+# 通知 worker 线程退出
+_SENTINEL = object()
+
+
 class ThreadWorker(object):
+    """
+    使用固定数量线程执行任务
+
+    - 任务从 jobs 中边生成边分发, 队列有界, 生成过快时阻塞生成方
+    - 任务分发完成后通过 sentinel 通知线程退出
+    - work 抛出异常或返回 False 时记为失败, 不影响线程继续执行其他任务,
+      返回 None 时为中间步骤(如文件的一个分片), 不计入结果
+    - setup 抛出异常时, 该线程执行的任务都记为失败, 成功时线程结束后以它的
+      返回值调用 teardown
+    - 工作线程的请求统计计入调用线程的 Metrics
+    - nworker 为 1 时直接在调用线程中执行
+    - nworker 为 AdaptiveConcurrency 时启动 max_workers 个线程,
+      同时执行的任务数由其自动调整
+    """
+
+    def __init__(self, nworker, setup=None, work=None, maxsize=None,
+                 teardown=None):
+        self._adaptive = None
+        if isinstance(nworker, AdaptiveConcurrency):
+            self._adaptive = nworker
+            nworker = nworker.max_workers
 
-    def __init__(self, nworker, setup=None, work=None):
-        self._nworker = nworker
+        self._nworker = max(1, nworker)
         self._setup = setup
         self._work = work
-        self._queue = Queue.Queue()
+        self._teardown = teardown
+
+        if maxsize is None:
+            maxsize = self._nworker * 2
+        self._queue = Queue.Queue(maxsize)
+
+    def run(self, jobs):
+        """
+        执行所有任务, 返回 WorkResult
 
-    def add_job(self, job):
-        self._queue.put(job)
+        :param jobs: 任务迭代器
+        :rtype WorkResult
+        """
+        result = WorkResult()
+
+        if self._nworker == 1:
+            ctx, error = self._setup_ctx()
+            try:
+                for job in jobs:
+                    self._run_job(ctx, error, job, result)
+            finally:
+                self._teardown_ctx(ctx, error)
+            return result
 
-    def start(self):
         threads = []
         for i in range(self._nworker):
             thread = threading.Thread(
-                target=self._do_work,
+                target=inherit(self._do_work),
+                args=(result,)
             )
+            thread.daemon = True
             threads.append(thread)
             thread.start()
 
-        for thread in reversed(threads):
-            thread.join()
+        try:
+            for job in jobs:
+                self._put(job)
+        finally:
+            for thread in threads:
+                self._put(_SENTINEL)
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(0.1)
 
-    def _do_work(self):
-        if self._setup:
-            ctx = self._setup()
-        else:
-            ctx = None
+        if self._adaptive is not None:
+            result.concurrency = self._adaptive.limit
+
+        return result
 
+    def _put(self, job):
+        # 带超时等待, 保证阻塞时可以响应 Ctrl-C
         while True:
             try:
-                job = self._queue.get(timeout=1)
-            except Queue.Empty:
+                self._queue.put(job, timeout=0.1)
+                return
+            except Queue.Full:
+                pass
+
+    def _setup_ctx(self):
+        """
+        setup 失败时返回异常, 之后的任务都记为失败, 避免生成方一直阻塞
+
+        :return: (ctx, error)
+        """
+        if not self._setup:
+            return None, None
+        try:
+            return self._setup(), None
+        except Exception as e:
+            return None, e
+
+    def _teardown_ctx(self, ctx, error):
+        if self._teardown and self._setup and error is None:
+            self._teardown(ctx)
+
+    def _run_job(self, ctx, error, job, result):
+        if error is not None:
+            result.add(job, False, error)
+            return False
+        return self._do_job(ctx, job, result)
+
+    def _do_job(self, ctx, job, result):
+        try:
+            ok = self._work(ctx, job)
+        except Exception as e:
+            result.add(job, False, e)
+            return False
+
+        if ok is not None:
+            result.add(job, ok)
+        return ok is not False
+
+    def _do_work(self, result):
+        ctx, error = self._setup_ctx()
+        adaptive = self._adaptive
+        while True:
+            if adaptive is not None:
+                adaptive.acquire()
+
+            job = self._queue.get()
+            if job is _SENTINEL:
+                if adaptive is not None:
+                    adaptive.release()
                 break
 
-            self._work(ctx, job)
+            start = time.time()
+            ok = self._run_job(ctx, error, job, result)
+
+            if adaptive is not None:
+                adaptive.release(time.time() - start, ok)
+
+        self._teardown_ctx(ctx, error)
@@ -29,6 +29,9 @@ setup(
         "click>=4.0",
         "qcloud_cos_v4>=0.0.12",
     ],
+    extras_require={
+        "scandir": ["scandir>=1.5"],
+    },
     entry_points={
         "console_scripts": [
             "coscli=coscli.main:cli"
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测试公用的 fake COS 服务和配置
+
+每个测试类启动一个 benchmarks/fakecos.py 的 FakeCOSServer, 通过 HTTP_PROXY
+访问, 每个测试使用新的 Store 和临时目录, HOME 指向临时目录, 分片上传的
+进度和 sha1 缓存等都写在其中
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import contextlib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from fakecos import FakeCOSServer, Store  # noqa
+from coscli import utils  # noqa
+
+
+BUCKET = u"bucket"
+
+
+@contextlib.contextmanager
+def failing(cls, name, should_fail):
+    """
+    替换 cls 的方法 name, should_fail(*args) 为 True 时抛出 IOError,
+    模拟传输中断
+    """
+    method = cls.__dict__[name]
+
+    def wrapper(self, *args):
+        if should_fail(*args):
+            raise IOError("%s interrupted" % name)
+        return method(self, *args)
+
+    setattr(cls, name, wrapper)
+    try:
+        yield
+    finally:
+        setattr(cls, name, method)
+
+
+class Config(object):
+    """
+    与 main.CliConfig 属性相同的配置, 不读取配置文件
+    """
+
+    def __init__(self, **cos_config):
+        self.cos_config = {
+            "appid": "1000000",
+            "key": "key",
+            "secret": "secret",
+            "region": "shanghai",
+        }
+        self.cos_config.update(cos_config)
+
+        self.dry_run = False
+        self.debug = False
+        self.report = None
+
+
+class FakeCOSTestCase(unittest.TestCase):
+
+    # 传给 FakeCOSServer 的参数, 如 latency, reset_rate
+    server_options = {}
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FakeCOSServer(**cls.server_options).start()
+        cls._environ = dict(os.environ)
+        os.environ["HTTP_PROXY"] = os.environ["http_proxy"] = \
+            cls.server.proxy_url
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        os.environ.clear()
+        os.environ.update(cls._environ)
+
+    def setUp(self):
+        self.fake = self.server.cos
+        self.fake.store = Store()
+        self.fake.requests.clear()
+
+        self.tmp = tempfile.mkdtemp(prefix="coscli-test-")
+        self._home = os.environ.get("HOME")
+        os.environ["HOME"] = self.mkdir("home")
+
+        # 任务输出写入 /dev/null
+        self._writer = utils._writer
+        self._devnull = open(os.devnull, "w")
+        utils._writer = utils.OutputWriter(stream=self._devnull)
+
+        self.config = Config()
+
+    def tearDown(self):
+        utils._writer.flush()
+        utils._writer = self._writer
+        self._devnull.close()
+
+        if self._home is None:
+            os.environ.pop("HOME", None)
+        else:
+            os.environ["HOME"] = self._home
+        shutil.rmtree(self.tmp)
+
+    def mkdir(self, name):
+        path = os.path.join(self.tmp, name)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        return path
+
+    def write_file(self, name, data):
+        path = os.path.join(self.tmp, name)
+        self.mkdir(os.path.dirname(name))
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def read_file(self, path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    def put_object(self, path, data):
+        self.fake.store.put(BUCKET, path, data)
+
+    def get_object(self, path):
+        return self.fake.store.get(BUCKET, path)[0]
+
+    def requests(self, op):
+        return self.fake.requests.get(op, 0)
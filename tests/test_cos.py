@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from tests.base import FakeCOSTestCase, BUCKET
+from coscli import metrics
+from coscli.cos import COS, borrow_client
+
+
+class COSTest(FakeCOSTestCase):
+
+    def setUp(self):
+        super(COSTest, self).setUp()
+        self.cos = COS(self.config.cos_config)
+
+    def test_file_exists_missing_is_not_a_failure(self):
+        self.put_object(u"/a.txt", "a")
+
+        with metrics.scope() as recorder:
+            self.assertTrue(self.cos.file_exists(BUCKET, u"/a.txt"))
+            self.assertFalse(self.cos.file_exists(BUCKET, u"/b.txt"))
+
+        stat = recorder.report()["ops"]["stat"]
+        self.assertEqual((stat["requests"], stat["failed"]), (2, 0))
+
+    def test_stat_missing_is_a_failure(self):
+        with metrics.scope() as recorder:
+            self.assertRaises(
+                Exception, self.cos.stat_file, BUCKET, u"/b.txt"
+            )
+
+        stat = recorder.report()["ops"]["stat"]
+        self.assertEqual((stat["requests"], stat["failed"]), (1, 1))
+
+    def test_borrowed_client_is_reused(self):
+        with borrow_client(self.config.cos_config) as first:
+            with borrow_client(self.config.cos_config) as second:
+                self.assertIsNot(first, second)
+
+        with borrow_client(self.config.cos_config) as again:
+            self.assertIn(again, (first, second))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import hashlib
+import unittest
+
+from tests.base import FakeCOSTestCase, BUCKET, failing
+from coscli.cos import COS
+from coscli.tools import Downloader, PartState
+
+
+class RangeResumeTest(FakeCOSTestCase):
+
+    part_size = 64 * 1024
+
+    def setUp(self):
+        super(RangeResumeTest, self).setUp()
+        self.data = os.urandom(self.part_size * 10 + 123)
+        self.put_object(u"/big.bin", self.data)
+        self.local_file = os.path.join(self.mkdir("dst"), "big.bin")
+
+    def download(self, parts):
+        cos_obj = COS(self.config.cos_config).stat_file(BUCKET, u"/big.bin")
+        downloader = Downloader(
+            self.config, BUCKET, [(cos_obj, self.local_file)], False, False,
+            True, parts=parts, part_size=self.part_size
+        )
+        return downloader.run(1)
+
+    def interrupt(self, parts):
+        """
+        只下载前 5 段, 进度保留在 sidecar 中
+        """
+        def should_fail(bucket, path, start, end):
+            return start >= self.part_size * 5
+
+        with failing(COS, "download_range", should_fail):
+            result = self.download(parts)
+        self.assertEqual((result.succeeded, result.failed), (0, 1))
+        self.assertTrue(PartState.exists(self.local_file))
+        self.fake.requests.clear()
+
+    def test_resume_downloads_missing_parts(self):
+        for parts in (1, 4):
+            self.interrupt(parts)
+
+            result = self.download(parts)
+            self.assertEqual((result.succeeded, result.failed), (1, 0))
+            self.assertEqual(self.requests("download"), 6)
+            self.assertEqual(self.read_file(self.local_file), self.data)
+            self.assertFalse(PartState.exists(self.local_file))
+            os.remove(self.local_file)
+
+    def test_changed_object_downloads_all_parts(self):
+        self.interrupt(4)
+        data = self.data[::-1]
+        self.fake.store.put(BUCKET, u"/big.bin", data)
+
+        result = self.download(4)
+        self.assertEqual((result.succeeded, result.failed), (1, 0))
+        self.assertEqual(self.requests("download"), 11)
+        self.assertEqual(
+            hashlib.sha1(self.read_file(self.local_file)).hexdigest(),
+            hashlib.sha1(data).hexdigest()
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import unittest
+
+from tests.base import FakeCOSTestCase, Config, BUCKET
+from coscli.command import cos_del, cos_mv_copy, cos_put
+from coscli.cos import COS
+
+
+class ListingIndexTest(FakeCOSTestCase):
+
+    def setUp(self):
+        super(ListingIndexTest, self).setUp()
+        self.config = Config(
+            index_ttl="300", index_path=os.path.join(self.tmp, "index.db")
+        )
+        self.cos = COS(self.config.cos_config)
+
+        self.put_object(u"/d/a.txt", "a")
+        self.put_object(u"/d/sub/b.txt", "b")
+        self.assertEqual(self.listing(u"/d/"), [u"/d/a.txt", u"/d/sub/"])
+        self.assertEqual(self.listing(u"/d/sub/"), [u"/d/sub/b.txt"])
+
+    def listing(self, path):
+        return [obj.path for obj in self.cos.iter_path(BUCKET, path)]
+
+    def assertCached(self, path, paths):
+        lists = self.requests("list")
+        self.assertEqual(self.listing(path), paths)
+        self.assertEqual(self.requests("list"), lists)
+
+    def assertRelisted(self, path, paths):
+        lists = self.requests("list")
+        self.assertEqual(self.listing(path), paths)
+        self.assertEqual(self.requests("list"), lists + 1)
+
+    def test_listing_is_cached(self):
+        self.fake.requests.clear()
+        self.assertCached(u"/d/", [u"/d/a.txt", u"/d/sub/"])
+        self.assertTrue(self.cos.file_exists(BUCKET, u"/d/a.txt"))
+        self.assertFalse(self.cos.file_exists(BUCKET, u"/d/c.txt"))
+        self.assertEqual(self.requests("stat"), 0)
+
+    def test_del_invalidates_parents(self):
+        cos_del(self.config, u"cosn://bucket/d/sub/b.txt", False, 1)
+
+        self.assertRelisted(u"/d/sub/", [])
+        self.assertRelisted(u"/d/", [u"/d/a.txt"])
+        self.assertCached(u"/d/", [u"/d/a.txt"])
+
+    def test_mv_invalidates_source_and_dest(self):
+        self.assertEqual(self.listing(u"/e/"), [])
+
+        cos_mv_copy(
+            "mv", self.config, u"cosn://bucket/d/a.txt",
+            u"cosn://bucket/e/a.txt", False, False, 1
+        )
+
+        self.assertRelisted(u"/d/", [u"/d/sub/"])
+        self.assertRelisted(u"/e/", [u"/e/a.txt"])
+        self.assertFalse(self.cos.file_exists(BUCKET, u"/d/a.txt"))
+
+    def test_put_invalidates_dest(self):
+        local_file = self.write_file("c.txt", "c")
+
+        cos_put(
+            self.config, [local_file], u"cosn://bucket/d/sub/", False, True,
+            1, 1024, 0
+        )
+
+        self.assertRelisted(u"/d/sub/", [u"/d/sub/b.txt", u"/d/sub/c.txt"])
+        self.assertRelisted(u"/d/", [u"/d/a.txt", u"/d/sub/"])
+        self.assertTrue(self.cos.file_exists(BUCKET, u"/d/sub/c.txt"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from tests.base import FakeCOSTestCase, BUCKET
+from coscli.cos import COS
+from coscli.tools import DestListing, Uploader, MoveCopyer
+
+
+class DestListingTest(FakeCOSTestCase):
+
+    def setUp(self):
+        super(DestListingTest, self).setUp()
+        self.cos = COS(self.config.cos_config)
+
+    def load(self, dests, count):
+        return DestListing.load(self.cos, BUCKET, dests, count)
+
+    def test_few_tasks_are_not_listed(self):
+        self.put_object(u"/d/a", "a")
+
+        self.assertIsNone(self.load([u"/d/a"], DestListing.min_tasks - 1))
+        self.assertEqual(self.requests("list"), 0)
+
+    def test_lists_common_parent(self):
+        self.put_object(u"/d/x/a", "a")
+        self.put_object(u"/d/y/b", "b")
+        self.put_object(u"/e/c", "c")
+
+        listing = self.load([u"/d/x/a", u"/d/y/new"], 100)
+        self.assertEqual(listing.get(u"/d/x/a").filesize, 1)
+        self.assertIsNotNone(listing.get(u"/d/y/b"))
+        self.assertIsNone(listing.get(u"/d/y/new"))
+        self.assertIsNone(listing.get(u"/e/c"))
+        self.assertEqual(self.requests("list"), 3)
+
+    def test_gives_up_over_request_budget(self):
+        # 10 个任务最多 2 次列出请求, 这里需要 4 次, 超过时不再发出请求
+        for i in range(3):
+            self.put_object(u"/d/%d/a" % i, "a")
+
+        self.assertIsNone(self.load([u"/d/new"], 10))
+        self.assertEqual(self.requests("list"), 2)
+        self.assertIsNotNone(self.load([u"/d/new"], 16))
+
+    def test_count_streamed_tasks(self):
+        # 超过 max_count 时只数到 max_count, 不影响任务本身
+        jobs = range(DestListing.max_count + 5)
+        count, tasks = DestListing.count(iter(jobs))
+        self.assertEqual(count, DestListing.max_count)
+        self.assertEqual(list(tasks), jobs)
+
+        count, tasks = DestListing.count(iter(range(3)))
+        self.assertEqual((count, list(tasks)), (3, [0, 1, 2]))
+
+
+class PreListTest(FakeCOSTestCase):
+
+    def setUp(self):
+        super(PreListTest, self).setUp()
+        self.tasks = []
+        for i in range(20):
+            local_file = self.write_file("src/f%02d" % i, "x")
+            self.tasks.append((local_file, u"/d/f%02d" % i))
+        self.put_object(u"/d/f00", "old")
+
+    def test_put_checks_dests_by_listing(self):
+        uploader = Uploader(self.config, BUCKET, iter(self.tasks), False,
+                            True)
+        result = uploader.run(4, u"/d/")
+
+        self.assertEqual((result.succeeded, result.failed), (19, 1))
+        self.assertEqual(result.errors[0][0], self.tasks[0])
+        self.assertEqual(self.get_object(u"/d/f00"), "old")
+        self.assertEqual(self.requests("list"), 1)
+        self.assertEqual(self.requests("stat"), 0)
+
+    def test_copy_checks_dests_by_listing(self):
+        tasks = [(u"/d/f00", u"/e/f%02d" % i) for i in range(20)]
+        self.put_object(u"/e/f05", "old")
+
+        copyer = MoveCopyer("copy", self.config, BUCKET, tasks, False)
+        result = copyer.run(4, u"/e/")
+
+        self.assertEqual((result.succeeded, result.failed), (19, 1))
+        self.assertEqual(self.get_object(u"/e/f05"), "old")
+        self.assertEqual(self.requests("list"), 1)
+        self.assertEqual(self.requests("stat"), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
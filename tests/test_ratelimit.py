@@ -0,0 +1,23 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from coscli.ratelimit import open_limiter
+
+
+class OpenLimiterTest(unittest.TestCase):
+
+    def test_same_rate_is_shared(self):
+        self.assertIs(open_limiter(1024), open_limiter(1024))
+
+    def test_different_rates_are_separate(self):
+        slow = open_limiter(2048)
+        fast = open_limiter(4096)
+
+        self.assertIsNot(slow, fast)
+        self.assertEqual((slow.rate, fast.rate), (2048, 4096))
+
+
+if __name__ == "__main__":
+    unittest.main()
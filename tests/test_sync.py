@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sqlite3
+import hashlib
+import unittest
+
+from tests.base import FakeCOSTestCase
+from coscli.command import cos_sync
+
+
+class SyncTest(FakeCOSTestCase):
+
+    def setUp(self):
+        super(SyncTest, self).setUp()
+        self.src = self.mkdir("src")
+        self.manifest = os.path.join(self.tmp, "sync.db")
+
+        # 大于 8 个 512KB 分片的文件使用分片上传
+        self.large = os.urandom(512 * 1024 * 8 + 123)
+        self.small = "x" * 1000
+        self.write_file("src/large.bin", self.large)
+        self.write_file("src/small.txt", self.small)
+
+    def sync(self, checksum=True):
+        return cos_sync(
+            self.config, [self.src], u"cosn://bucket/dst/", checksum, 1,
+            512, 0, self.manifest
+        )
+
+    def manifest_sha1(self):
+        conn = sqlite3.connect(self.manifest)
+        try:
+            return dict(conn.execute("SELECT cos_path, sha1 FROM files"))
+        finally:
+            conn.close()
+
+    def test_sync_uses_slice_size(self):
+        self.assertEqual(self.sync(), 0)
+
+        self.assertEqual(self.requests("upload_slice_data"), 9)
+        self.assertEqual(self.get_object(u"/dst/src/large.bin"), self.large)
+
+    def test_manifest_records_local_sha1(self):
+        self.assertEqual(self.sync(checksum=False), 0)
+
+        self.assertEqual(self.manifest_sha1(), {
+            u"/dst/src/large.bin": hashlib.sha1(self.large).hexdigest(),
+            u"/dst/src/small.txt": hashlib.sha1(self.small).hexdigest(),
+        })
+
+    def test_unchanged_files_are_skipped(self):
+        self.assertEqual(self.sync(), 0)
+        self.fake.requests.clear()
+
+        self.assertEqual(self.sync(), 0)
+        self.assertEqual(self.fake.requests, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
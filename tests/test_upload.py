@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import hashlib
+import unittest
+import contextlib
+import __builtin__
+
+from tests.base import FakeCOSTestCase, BUCKET, failing
+from coscli.cos import COS
+from coscli.tools import Uploader, UPLOAD_STATE_DIR
+
+
+class _CountingFile(object):
+
+    def __init__(self, f, counter):
+        self._f = f
+        self._counter = counter
+
+    def read(self, *args):
+        data = self._f.read(*args)
+        self._counter[0] += len(data)
+        return data
+
+    def __iter__(self):
+        return iter(self.read, "")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._f.close()
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+
+@contextlib.contextmanager
+def count_reads(path):
+    """
+    统计进程中(包括 SDK)从 path 读取的字节数
+    """
+    counter = [0]
+    builtin_open = __builtin__.open
+
+    def counting_open(name, *args, **kwargs):
+        f = builtin_open(name, *args, **kwargs)
+        if os.path.abspath(name) == os.path.abspath(path):
+            return _CountingFile(f, counter)
+        return f
+
+    __builtin__.open = counting_open
+    try:
+        yield counter
+    finally:
+        __builtin__.open = builtin_open
+
+
+class UploaderTest(FakeCOSTestCase):
+
+    slice_size = 64 * 1024
+
+    def upload(self, tasks, count=1, **kwargs):
+        kwargs.setdefault("slice_size", self.slice_size)
+        uploader = Uploader(
+            self.config, BUCKET, tasks, kwargs.pop("force", False),
+            kwargs.pop("checksum", True), **kwargs
+        )
+        return uploader.run(count)
+
+    def test_checksum_reads_large_file_once(self):
+        data = os.urandom(self.slice_size * 10 + 123)
+        local_file = self.write_file("big.bin", data)
+
+        for count in (1, 4):
+            with count_reads(local_file) as counter:
+                result = self.upload(
+                    [(local_file, u"/big-%d.bin" % count)], count
+                )
+
+            self.assertEqual((result.succeeded, result.failed), (1, 0))
+            self.assertEqual(counter[0], len(data))
+            self.assertEqual(self.get_object(u"/big-%d.bin" % count), data)
+
+    def test_checksum_reads_small_file_once(self):
+        data = "x" * 1000
+        local_file = self.write_file("small.txt", data)
+
+        with count_reads(local_file) as counter:
+            result = self.upload([(local_file, u"/small.txt")])
+
+        self.assertEqual((result.succeeded, result.failed), (1, 0))
+        self.assertEqual(counter[0], len(data))
+        self.assertEqual(
+            self.fake.store.get(BUCKET, u"/small.txt")[2],
+            hashlib.sha1(data).hexdigest()
+        )
+
+
+class SliceResumeTest(UploaderTest):
+
+    def setUp(self):
+        super(SliceResumeTest, self).setUp()
+        self.data = os.urandom(self.slice_size * 10 + 123)
+        self.local_file = self.write_file("big.bin", self.data)
+        self.state_dir = os.path.expanduser(UPLOAD_STATE_DIR)
+
+    def interrupt(self, count):
+        """
+        上传前 5 个分片后中断, 进度保留在 sidecar 中
+        """
+        def should_fail(bucket, path, session, offset, data):
+            return offset >= self.slice_size * 5
+
+        with failing(COS, "slice_data", should_fail):
+            result = self.upload([(self.local_file, u"/big.bin")], count)
+        self.assertEqual((result.succeeded, result.failed), (0, 1))
+        self.assertEqual(len(os.listdir(self.state_dir)), 1)
+        self.fake.requests.clear()
+
+    def test_resume_uploads_missing_slices(self):
+        for count in (1, 4):
+            self.interrupt(count)
+
+            result = self.upload([(self.local_file, u"/big.bin")], count)
+            self.assertEqual((result.succeeded, result.failed), (1, 0))
+            self.assertEqual(self.requests("upload_slice_data"), 6)
+            self.assertEqual(self.get_object(u"/big.bin"), self.data)
+            self.assertEqual(os.listdir(self.state_dir), [])
+            self.fake.store.delete(BUCKET, u"/big.bin")
+
+    def test_changed_file_uploads_all_slices(self):
+        self.interrupt(1)
+        data = self.data[::-1]
+        self.write_file("big.bin", data)
+        os.utime(self.local_file, (0, 0))
+
+        result = self.upload([(self.local_file, u"/big.bin")])
+        self.assertEqual((result.succeeded, result.failed), (1, 0))
+        self.assertEqual(self.requests("upload_slice_data"), 11)
+        self.assertEqual(self.get_object(u"/big.bin"), data)
+
+
+if __name__ == "__main__":
+    unittest.main()
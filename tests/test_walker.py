@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import itertools
+import threading
+import unittest
+
+from tests.base import FakeCOSTestCase, BUCKET, failing
+from coscli.cos import COS, COSWalker, COSUsage
+
+
+def walker_threads():
+    """
+    仍在运行的 COSWalker/COSUsage 线程, 不包括 fake COS 服务的线程
+    """
+    return [
+        thread for thread in threading.enumerate()
+        if getattr(thread, "_Thread__target", None) is not None and
+        thread._Thread__target.__module__.startswith("coscli.")
+    ]
+
+
+class TreeTestCase(FakeCOSTestCase):
+    """
+    /t/ 下 ndir 个目录, 每个目录 nfile 个文件
+    """
+
+    # 列出有延迟时提前结束才能确定还有未列出的目录
+    server_options = {"latency": 0.01}
+    ndir = 20
+    nfile = 30
+
+    def setUp(self):
+        super(TreeTestCase, self).setUp()
+        self.paths = []
+        for i in range(self.ndir):
+            for j in range(self.nfile):
+                path = u"/t/d%02d/f%02d" % (i, j)
+                self.put_object(path, "x" * j)
+                self.paths.append(path)
+
+    def assertStopped(self):
+        self.assertEqual(walker_threads(), [])
+
+        # 线程退出后不再发出列出请求
+        lists = self.requests("list")
+        time.sleep(0.2)
+        self.assertEqual(self.requests("list"), lists)
+
+
+class WalkerTest(TreeTestCase):
+
+    def walk(self, ordered):
+        walker = COSWalker(self.config.cos_config, 4, ordered)
+        return walker.walk(BUCKET, u"/t/")
+
+    def test_walk(self):
+        ordered = [obj.path for obj in self.walk(True)]
+        self.assertEqual(ordered, self.paths)
+
+        unordered = [obj.path for obj in self.walk(False)]
+        self.assertEqual(sorted(unordered), self.paths)
+        self.assertStopped()
+
+    def test_early_stop(self):
+        for ordered in (True, False):
+            self.fake.requests.clear()
+            objs = self.walk(ordered)
+            self.assertEqual(len(list(itertools.islice(objs, 10))), 10)
+            self.assertNotEqual(walker_threads(), [])
+            objs.close()
+
+            self.assertStopped()
+            self.assertLess(self.requests("list"), self.ndir)
+
+    def test_error_stops_walk(self):
+        def should_fail(bucket, path):
+            return path == u"/t/d05/"
+
+        for ordered in (True, False):
+            with failing(COS, "iter_path", should_fail):
+                self.assertRaises(IOError, list, self.walk(ordered))
+            self.assertStopped()
+
+
+class UsageTest(TreeTestCase):
+
+    def usage(self, **kwargs):
+        return COSUsage(self.config.cos_config, 4).usage(
+            BUCKET, u"/t/", **kwargs
+        )
+
+    def test_usage(self):
+        results = dict(
+            (obj.path, (size, count))
+            for obj, size, count in self.usage(max_depth=1)
+        )
+
+        dir_size = sum(range(self.nfile))
+        self.assertEqual(results[u"/t/d03/"], (dir_size, self.nfile))
+        self.assertEqual(
+            results[u"/t/"], (dir_size * self.ndir, self.nfile * self.ndir)
+        )
+        self.assertEqual(len(results), self.ndir + 1)
+        self.assertStopped()
+
+    def test_early_stop(self):
+        self.fake.requests.clear()
+        usage = self.usage(max_depth=1)
+        next(usage)
+        self.assertNotEqual(walker_threads(), [])
+        usage.close()
+
+        self.assertStopped()
+        self.assertLess(self.requests("list"), self.ndir + 1)
+
+    def test_error_stops_walk(self):
+        def should_fail(bucket, path):
+            return path == u"/t/d05/"
+
+        with failing(COS, "iter_path", should_fail):
+            self.assertRaises(IOError, list, self.usage())
+        self.assertStopped()
+
+
+if __name__ == "__main__":
+    unittest.main()
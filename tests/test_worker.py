@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import threading
+import unittest
+
+from tests.base import FakeCOSTestCase, BUCKET
+from coscli import metrics
+from coscli.tools import Deleter
+from coscli.utils import ThreadWorker
+
+
+class ThreadWorkerTest(unittest.TestCase):
+
+    def run_worker(self, nworker, work, setup=None, teardown=None):
+        worker = ThreadWorker(nworker, setup=setup, work=work,
+                              teardown=teardown)
+        return worker.run(iter(range(20)))
+
+    def test_work_failures(self):
+        def work(ctx, job):
+            if job % 5 == 0:
+                raise ValueError(job)
+            if job % 5 == 1:
+                return False
+            if job % 5 == 2:
+                return None
+            return True
+
+        for nworker in (1, 4):
+            result = self.run_worker(nworker, work)
+            self.assertEqual((result.succeeded, result.failed), (8, 8))
+
+            errors = dict(result.errors)
+            self.assertIsInstance(errors[0], ValueError)
+            self.assertIsNone(errors[1])
+            self.assertNotIn(2, errors)
+
+    def test_setup_failure_fails_every_job(self):
+        teardowns = []
+
+        def setup():
+            raise IOError("no client")
+
+        for nworker in (1, 4):
+            result = self.run_worker(
+                nworker, lambda ctx, job: True, setup, teardowns.append
+            )
+            self.assertEqual((result.succeeded, result.failed), (0, 20))
+            self.assertIsInstance(result.errors[0][1], IOError)
+
+        self.assertEqual(teardowns, [])
+
+    def test_teardown_once_per_thread(self):
+        lock = threading.Lock()
+        contexts = []
+        teardowns = []
+
+        def setup():
+            with lock:
+                contexts.append(object())
+                return contexts[-1]
+
+        def teardown(ctx):
+            with lock:
+                teardowns.append(ctx)
+
+        for nworker in (1, 4):
+            del contexts[:], teardowns[:]
+            result = self.run_worker(
+                nworker, lambda ctx, job: job % 2 == 0, setup, teardown
+            )
+            self.assertEqual((result.succeeded, result.failed), (10, 10))
+            self.assertEqual(len(contexts), nworker)
+            self.assertEqual(sorted(teardowns), sorted(contexts))
+
+    def test_jobs_error_stops_workers(self):
+        def jobs():
+            yield 1
+            raise RuntimeError("scan failed")
+
+        for nworker in (1, 4):
+            before = threading.active_count()
+            worker = ThreadWorker(nworker, work=lambda ctx, job: True)
+            self.assertRaises(RuntimeError, worker.run, jobs())
+            self.assertEqual(threading.active_count(), before)
+
+
+class DeleterTest(FakeCOSTestCase):
+
+    def test_missing_files_fail(self):
+        for nworker in (1, 4):
+            paths = [u"/d/%d" % i for i in range(10)]
+            for path in paths[::2]:
+                self.put_object(path, "x")
+
+            with metrics.scope() as recorder:
+                result = Deleter(self.config, BUCKET, paths).run(nworker)
+
+            self.assertEqual((result.succeeded, result.failed), (5, 5))
+            self.assertEqual([e for _, e in result.errors], [None] * 5)
+            self.assertEqual(sorted(j for j, _ in result.errors), paths[1::2])
+
+            delete = recorder.report()["ops"]["delete"]
+            self.assertEqual(delete["requests"], 10)
+
+
+if __name__ == "__main__":
+    unittest.main()